@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+from urllib.parse import urlencode
+
+import requests
+
+from constants import CT_HTTP_CACHE_MODE_OFF, CT_HTTP_CACHE_MODE_RECORD, CT_HTTP_CACHE_MODE_REPLAY, \
+    CT_HTTP_CACHE_MODE_TTL, CT_HTTP_CACHE_MODES_LIST
+
+
+def cache_key(url: str, params: dict = None) -> str:
+    """
+    URL with its query parameters sorted, so that the same request always has the same key
+    """
+    if not params:
+        return url
+    return f"{url}?{urlencode(sorted(params.items()))}"
+
+
+class HttpResponseCache:
+    """
+    On-disk cache of successful GET responses of the France Travail APIs, keyed by URL.
+    Bodies are zlib compressed in a SQLite file whose primary key indexes the URLs.
+    Modes:
+    - off: the cache is not used
+    - record: every request goes to the network and its response is stored
+    - replay: responses are only read from disk, a missing URL raises LookupError and no request is sent
+    - ttl: stored responses younger than ttl seconds are reused, others are fetched and stored again
+    """
+
+    def __init__(self, path: str, mode: str = CT_HTTP_CACHE_MODE_TTL, ttl: float = 86400.0,
+                 compression_level: int = 6):
+        """
+        :param path: SQLite file of the cache, created if missing
+        :param mode: one of CT_HTTP_CACHE_MODES_LIST
+        :param ttl: lifetime in seconds of a stored response in ttl mode, 0 or less for no expiration
+        :param compression_level: zlib level of the stored bodies
+        """
+        if mode not in CT_HTTP_CACHE_MODES_LIST:
+            raise ValueError(f"Unknown HTTP cache mode '{mode}', use one of {CT_HTTP_CACHE_MODES_LIST}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.compression_level = compression_level
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__connection = None
+        if mode != CT_HTTP_CACHE_MODE_OFF:
+            self.__connection = sqlite3.connect(path, check_same_thread=False)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS http_response ("
+                                      "url TEXT PRIMARY KEY, status INTEGER NOT NULL, content_type TEXT, "
+                                      "fetched_at REAL NOT NULL, body BLOB NOT NULL)")
+            self.__connection.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != CT_HTTP_CACHE_MODE_OFF
+
+    @property
+    def offline(self) -> bool:
+        return self.mode == CT_HTTP_CACHE_MODE_REPLAY
+
+    def close(self):
+        if self.__connection is not None:
+            with self.__lock:
+                self.__connection.close()
+                self.__connection = None
+
+    def get(self, key: str) -> Optional[requests.Response]:
+        """
+        Stored response of key if the mode allows to use it, None when it must be fetched
+        """
+        if self.mode in (CT_HTTP_CACHE_MODE_OFF, CT_HTTP_CACHE_MODE_RECORD):
+            return None
+        with self.__lock:
+            row = self.__connection.execute("SELECT status, content_type, fetched_at, body FROM http_response "
+                                            "WHERE url = ?", (key,)).fetchone()
+        expired = row is not None and self.mode == CT_HTTP_CACHE_MODE_TTL and 0 < self.ttl < time.time() - row[2]
+        if row is None or expired:
+            self.misses += 1
+            if self.offline:
+                raise LookupError(f"URL={key} is not in the HTTP cache {self.path}, replay mode has no network")
+            return None
+        self.hits += 1
+        status, content_type, _, body = row
+        response = requests.Response()
+        response.status_code = status
+        response.url = key
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = content_type or 'application/json'
+        response._content = zlib.decompress(body)
+        response._content_consumed = True
+        return response
+
+    def put(self, key: str, response: requests.Response):
+        """
+        Store a successful response, other statuses are never cached.
+        A streamed response is read completely here and then iterated from memory
+        """
+        if self.mode in (CT_HTTP_CACHE_MODE_OFF, CT_HTTP_CACHE_MODE_REPLAY) or response.status_code != 200:
+            return
+        body = zlib.compress(response.content, self.compression_level)
+        with self.__lock:
+            self.__connection.execute("INSERT OR REPLACE INTO http_response VALUES (?, ?, ?, ?, ?)",
+                                      (key, response.status_code, response.headers.get('Content-Type'),
+                                       time.time(), body))
+            self.__connection.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'mode': self.mode, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
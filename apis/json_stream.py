@@ -0,0 +1,77 @@
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator
+
+CT_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_array(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[Any]:
+    """
+    Decode the items of a top-level JSON array one at a time from the chunks of a response body,
+    so that only the current chunk and the current item are held in memory
+    :param chunks: body of the response, for instance response.iter_content(chunk_size)
+    :param encoding: encoding of the body, multibyte characters split across chunks are handled
+    :return: iterator of the decoded items, in the order of the array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+    state = 'start'
+
+    def read_more() -> bool:
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            text = text_decoder.decode(b'', final=True)
+        else:
+            text = text_decoder.decode(chunk)
+        buffer = buffer[position:] + text
+        position = 0
+        return True
+
+    while True:
+        position = CT_JSON_WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if read_more():
+                continue
+            if state == 'end':
+                return
+            raise ValueError(f"Truncated JSON array, stream ended while expecting {state}")
+        if state == 'start':
+            if buffer[position] != '[':
+                raise ValueError(f"Expected a JSON array, got '{buffer[position]}'")
+            position += 1
+            state = 'first value'
+        elif state == 'end':
+            raise ValueError(f"Unexpected data after the JSON array: '{buffer[position:position + 20]}'")
+        elif state == 'separator':
+            if buffer[position] == ',':
+                state = 'value'
+            elif buffer[position] == ']':
+                state = 'end'
+            else:
+                raise ValueError(f"Expected ',' or ']' in JSON array, got '{buffer[position]}'")
+            position += 1
+        elif state == 'first value' and buffer[position] == ']':
+            position += 1
+            state = 'end'
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read_more():
+                    continue
+                raise
+            # A number ending the buffer may continue in the next chunk, objects, arrays and strings are closed
+            if end == len(buffer) and not isinstance(item, (dict, list, str)) and read_more():
+                continue
+            position = end
+            state = 'separator'
+            yield item
@@ -0,0 +1,242 @@
+import bisect
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from constants import CT_METRICS_EXPORT_INTERVAL, CT_METRICS_LATENCY_BUCKETS
+from server_cfg import general_logger
+
+# Called as hook(metric_name, labels, value) on each update: counter increment, gauge value or histogram observation
+MetricHook = Callable[[str, Dict[str, str], float], None]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text exposition format.
+    Hooks receive every update to forward it elsewhere (StatsD, OpenTelemetry, tests...),
+    collectors are called before each rendering to refresh values computed on demand.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, 'Metric'] = {}
+        self.hooks: List[MetricHook] = []
+        self.collectors: List[Callable[[], None]] = []
+        self.__lock = threading.Lock()
+
+    def register(self, metric: 'Metric'):
+        with self.__lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def add_hook(self, hook: MetricHook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: MetricHook):
+        self.hooks.remove(hook)
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        self.collectors.remove(collector)
+
+    def notify(self, name: str, labels: Dict[str, str], value: float):
+        for hook in list(self.hooks):
+            try:
+                hook(name, labels, value)
+            except Exception as exc:
+                # A failing hook must not break the request or the sync being measured
+                general_logger.warning(f"Metrics hook {hook} failed on {name}: {exc}")
+
+    def render(self) -> str:
+        for collector in list(self.collectors):
+            collector()
+        with self.__lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Write the rendered metrics atomically, for the textfile collector of the node exporter
+        """
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temporary_path, path)
+
+
+metrics_registry = MetricsRegistry()
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 registry: MetricsRegistry = None):
+        """
+        :param label_names: names of the labels, each update gives a value for every one of them
+        :param registry: registry rendering the metric, the process registry when None
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.registry = metrics_registry if registry is None else registry
+        self.values = {}
+        self.lock = threading.Lock()
+        self.registry.register(self)
+
+    def label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"Metric {self.name} expects the labels {self.label_names}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def notify(self, labels: Dict[str, str], value: float):
+        if self.registry.hooks:
+            self.registry.notify(self.name, labels, value)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+                    for label_values, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+        self.notify(labels, amount)
+
+    def set_total(self, total: float, **labels):
+        """
+        Total counted by another component, hooks receive the increment since the previous total.
+        A total lower than the previous one is a restart of the count from 0.
+        """
+        key = self.label_values(labels)
+        with self.lock:
+            previous = self.values.get(key, 0.0)
+            self.values[key] = total
+        increment = total - previous if total >= previous else total
+        if increment:
+            self.notify(labels, increment)
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self.label_values(labels), 0.0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+        self.notify(labels, value)
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self.label_values(labels), 0.0)
+
+
+class Histogram(Metric):
+    """
+    Cumulative buckets, sum and count of the observed values, by labels
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = CT_METRICS_LATENCY_BUCKETS, registry: MetricsRegistry = None):
+        """
+        :param buckets: increasing upper bounds of the buckets, +Inf is added
+        """
+        super().__init__(name, documentation, label_names=label_names, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # Count per bucket (the last one being +Inf), sum and count
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+        self.notify(labels, value)
+
+    def count(self, **labels) -> int:
+        with self.lock:
+            series = self.values.get(self.label_values(labels))
+            return 0 if series is None else series[2]
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.label_names + ('le',)
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulated = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                    cumulated += bucket_count
+                    lines.append(f"{self.name}_bucket{format_labels(names, label_values + (format_value(bound),))} "
+                                 f"{cumulated}")
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+@contextmanager
+def periodic_export(path: str, interval: float = CT_METRICS_EXPORT_INTERVAL,
+                    registry: MetricsRegistry = None) -> Iterator[MetricsRegistry]:
+    """
+    Write the metrics to path every interval seconds while the block runs, and once more at its end,
+    so that batch runs such as a sync can be scraped through a textfile collector
+    """
+    registry = metrics_registry if registry is None else registry
+    stopped = threading.Event()
+
+    def export():
+        while not stopped.wait(interval):
+            try:
+                registry.write(path)
+            except OSError as exc:
+                general_logger.warning(f"Metrics not written in {path}: {exc}")
+
+    thread = threading.Thread(target=export, name='metrics-export', daemon=True)
+    thread.start()
+    try:
+        yield registry
+    finally:
+        stopped.set()
+        thread.join()
+        registry.write(path)
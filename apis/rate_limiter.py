@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value: str = None) -> float:
+    """
+    Decode a Retry-After header, given either in seconds or as an HTTP date
+    :return: delay in seconds or None if the header is missing or unreadable
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every thread using the same client.
+    The refill rate is cut on 429 responses (multiplicative decrease) and slowly raised back on successful
+    responses (additive increase) without exceeding max_rate, so the client keeps running near the quota ceiling.
+    """
+
+    def __init__(self, max_rate: float, burst: int = 1, min_rate: float = 0.1, backoff_factor: float = 0.5,
+                 recovery_step: float = 0.05, max_jitter: float = 0.5):
+        """
+        :param max_rate: maximum number of requests per second, usually the API quota
+        :param burst: number of requests that can be sent at once after an idle period
+        :param min_rate: lowest rate reached after successive 429 responses
+        :param backoff_factor: rate multiplier applied on a 429 response
+        :param recovery_step: requests per second added back on each successful response
+        :param max_jitter: maximum random delay in seconds added to each pause, to spread the retries of the threads
+        """
+        if max_rate <= 0:
+            raise ValueError(f"Rate limit must be positive, got {max_rate}")
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.burst = max(1, burst)
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.max_jitter = max_jitter
+        self.rate = max_rate
+        self.__tokens = float(self.burst)
+        self.__last_refill = time.monotonic()
+        self.__paused_until = 0.0
+        self.__lock = threading.Lock()
+
+    def __refill__(self, now: float):
+        self.__tokens = min(float(self.burst), self.__tokens + (now - self.__last_refill) * self.rate)
+        self.__last_refill = now
+
+    def acquire(self) -> float:
+        """
+        Block until a request can be sent
+        :return: time waited in seconds
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__refill__(now)
+                if now < self.__paused_until:
+                    delay = self.__paused_until - now
+                elif self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self.__tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self):
+        with self.__lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+    def on_rate_limited(self, retry_after: float = None) -> float:
+        """
+        Slow down after a 429 response and pause every thread until Retry-After has elapsed
+        :param retry_after: delay in seconds requested by the server, if any
+        :return: pause in seconds before the next request
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if now >= self.__paused_until:
+                # Concurrent 429 responses of the same burst only slow down once
+                self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            pause += random.uniform(0, self.max_jitter)
+            self.__paused_until = max(self.__paused_until, now + pause)
+            self.__tokens = 0.0
+            self.__last_refill = now
+            return self.__paused_until - now
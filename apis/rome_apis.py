@@ -1,54 +1,247 @@
 import os
+import time
 import requests
 from dataclasses import dataclass
+from typing import Iterator
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from apis.http_cache import HttpResponseCache, cache_key
+from apis.json_stream import iter_json_array
+from apis.metrics import Counter, Gauge, Histogram
+from apis.rate_limiter import AdaptiveRateLimiter, parse_retry_after
+from apis.token_cache import TokenProvider
+from constants import CT_FT_STREAM_CHUNK_SIZE, CT_FT_TOKEN_DEFAULT_EXPIRES_IN, CT_FT_QUOTA_REMAINING_HEADERS
 from schemas import rome_schemas
-from server_cfg import general_logger
+from server_cfg import general_logger, FT_POOL_SIZE, FT_TRANSPORT_RETRIES, FT_REQUEST_TIMEOUT, FT_RATE_LIMIT, \
+    FT_RATE_LIMIT_BURST, FT_RATE_LIMIT_MIN, FT_RATE_LIMIT_RETRIES, FT_HTTP_CACHE_MODE, FT_HTTP_CACHE_TTL, \
+    HTTP_CACHE_FILE_PATH, FT_TOKEN_CACHE, FT_TOKEN_REFRESH_MARGIN, TOKEN_CACHE_FILE_PATH, FT_API_BASE_URL, FT_OAUTH_URL
+
+# Endpoints are labelled by entity, 'metier' for the list and 'metier/{code}' for the details, or 'token'
+ft_request_duration = Histogram('ft_api_request_duration_seconds',
+                                "Duration of the France Travail API requests until the response headers",
+                                ('endpoint', 'method', 'status'))
+ft_response_bytes = Counter('ft_api_response_bytes_total', "Bytes received from the France Travail API",
+                            ('endpoint',))
+ft_retries = Counter('ft_api_retries_total',
+                     "Retried France Travail API requests by reason: rate_limited, unauthorized or transport",
+                     ('endpoint', 'reason'))
+ft_rate_limit_wait = Counter('ft_api_rate_limit_wait_seconds_total', "Time spent waiting for the client rate limiter")
+ft_rate_limit_rate = Gauge('ft_api_rate_limit_requests_per_second',
+                           "Requests per second currently allowed by the adaptive rate limiter")
+ft_quota_remaining = Gauge('ft_api_quota_remaining', "Requests left in the quota window, when the API announces it",
+                           ('endpoint',))
+
 
 @dataclass
 class FranceTravailClient:
-    __authorization: str = None
+    __token_provider: TokenProvider = None
+    __http_session: requests.Session = None
+    __request_timeout: float = FT_REQUEST_TIMEOUT
+    __rate_limiter: AdaptiveRateLimiter = None
+    __rate_limit_retries: int = FT_RATE_LIMIT_RETRIES
+    __http_cache: HttpResponseCache = None
+    __api_base_url: str = FT_API_BASE_URL
     __env_client_id = 'ENV_FT_CLIENT_ID'
     __env_client_secret = 'ENV_FT_CLIENT_SECRET'
 
+    @staticmethod
+    def __build_http_session__(pool_size: int, transport_retries: int) -> requests.Session:
+        """
+        Pooled keep-alive session shared by every request of the client.
+        Only connection resets and read errors are retried here, HTTP statuses are handled by the client.
+        """
+        retry = Retry(total=transport_retries,
+                      connect=transport_retries,
+                      read=transport_retries,
+                      status=0,
+                      backoff_factor=0.5,
+                      allowed_methods=frozenset({'GET', 'POST'}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        http_session = requests.Session()
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        return http_session
+
+    def close(self):
+        if self.__http_session is not None:
+            self.__http_session.close()
+        if self.__http_cache is not None:
+            self.__http_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __endpoint__(self, url: str) -> str:
+        """
+        Metrics label of a URL, with the codes of the details left out to keep the number of series bounded
+        """
+        if not url.startswith(f"{self.__api_base_url}/"):
+            return 'token'
+        entity, _, code = url[len(self.__api_base_url) + 1:].split('?')[0].partition('/')
+        return f"{entity}/{{code}}" if code else entity
+
+    @staticmethod
+    def __record_response__(response: requests.Response, endpoint: str, method: str, duration: float,
+                            stream: bool):
+        ft_request_duration.observe(duration, endpoint=endpoint, method=method, status=str(response.status_code))
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit():
+            ft_response_bytes.inc(int(content_length), endpoint=endpoint)
+        elif not stream:
+            ft_response_bytes.inc(len(response.content), endpoint=endpoint)
+        # Streamed responses without Content-Length are counted while read, by __stream_list__
+        # Connection resets and read errors retried by urllib3 are only visible in the history of the response
+        retry_history = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        if retry_history:
+            ft_retries.inc(len(retry_history), endpoint=endpoint, reason='transport')
+        for header in CT_FT_QUOTA_REMAINING_HEADERS:
+            remaining = response.headers.get(header)
+            if remaining is not None:
+                try:
+                    ft_quota_remaining.set(float(remaining), endpoint=endpoint)
+                except ValueError:
+                    pass
+                break
+
+    @staticmethod
+    def __release__(response: requests.Response):
+        """
+        Give the pooled connection of a response that is not returned back, streamed ones hold it until closed.
+        The short error body is read first so that the connection is kept alive rather than dropped.
+        """
+        try:
+            response.content
+        except requests.RequestException:
+            pass
+        response.close()
+
     def __proceed_rome_request__(self, func, **kwargs):
         if 'url' not in kwargs:
             raise NameError("Programming Error: 'url' parameter is missing in request call")
         else:
             url = kwargs['url']
-        if 'headers' not in kwargs:
-            kwargs.update({'headers': {'Authorization': self.__authorization,
-                                       'Content-Type': 'application/x-www-form-urlencoded'}})
+        # Requests without explicit headers are authenticated by the access token, renewed once on 401
+        uses_token = 'headers' not in kwargs
+        if 'timeout' not in kwargs:
+            kwargs.update({'timeout': self.__request_timeout})
 
-        try:
-            response = func(**kwargs)
-        except Exception as exc:
-            raise ConnectionError(f"Exception on ROME request URL={url} EXCEPTION={exc}")
+        endpoint = self.__endpoint__(url)
+        method = func.__name__.upper()
+        rate_limited = 0
+        token_renewed = False
+        while True:
+            if uses_token:
+                authorization = self.__token_provider.authorization()
+                kwargs.update({'headers': {'Authorization': authorization,
+                                           'Content-Type': 'application/x-www-form-urlencoded'}})
+            waited = self.__rate_limiter.acquire()
+            if waited > 0:
+                ft_rate_limit_wait.inc(waited)
+            started_at = time.perf_counter()
+            try:
+                response = func(**kwargs)
+            except Exception as exc:
+                ft_request_duration.observe(time.perf_counter() - started_at, endpoint=endpoint, method=method,
+                                            status='error')
+                raise ConnectionError(f"Exception on ROME request URL={url} EXCEPTION={exc}")
+            self.__record_response__(response=response, endpoint=endpoint, method=method,
+                                     duration=time.perf_counter() - started_at, stream=kwargs.get('stream', False))
+            if response.status_code == 401 and uses_token and not token_renewed:
+                general_logger.warning(f"Request failure 401 URL={url}, access token rejected, renew it and retry")
+                ft_retries.inc(endpoint=endpoint, reason='unauthorized')
+                self.__token_provider.invalidate(authorization)
+                token_renewed = True
+                self.__release__(response)
+                continue
+            if response.status_code != 429 or rate_limited == self.__rate_limit_retries:
+                break
+            self.__release__(response)
+            rate_limited += 1
+            ft_retries.inc(endpoint=endpoint, reason='rate_limited')
+            pause = self.__rate_limiter.on_rate_limited(
+                retry_after=parse_retry_after(response.headers.get('Retry-After')))
+            ft_rate_limit_rate.set(self.__rate_limiter.rate)
+            general_logger.warning(f"Request failure 429 URL={url}, out of quota, retry {rate_limited}/"
+                                   f"{self.__rate_limit_retries} in {pause:.1f} seconds "
+                                   f"at {self.__rate_limiter.rate:.2f} requests/s")
 
         if response.status_code == 200:
+            self.__rate_limiter.on_success()
+            ft_rate_limit_rate.set(self.__rate_limiter.rate)
             return response
-        elif response.status_code == 400:
+        self.__release__(response)
+        if response.status_code == 400:
             raise Exception(f"Request failure 400, URL={url}: Bad request, reason: {response.reason}")
         elif response.status_code == 401:
             raise Exception(f"Request failure 401, URL={url}: Unauthorized, check credentials")
         elif response.status_code == 404:
             raise Exception(f"Request failure 404, URL={url}: Not found")
         elif response.status_code == 429:
-            raise OverflowError(f"Request failure 429, Out of quota")
+            raise OverflowError(f"Request failure 429, URL={url}: "
+                                f"Out of quota after {self.__rate_limit_retries} retries")
         else:
             raise Exception(f"Request failure {response.status_code}: {response.content}")
 
     def rome_request_get(self, **kwargs):
-        func = requests.get
-        return self.__proceed_rome_request__(func=func, **kwargs)
+        func = self.__http_session.get
+        if not self.__http_cache.enabled:
+            return self.__proceed_rome_request__(func=func, **kwargs)
+        key = cache_key(url=kwargs.get('url'), params=kwargs.get('params'))
+        response = self.__http_cache.get(key)
+        if response is None:
+            response = self.__proceed_rome_request__(func=func, **kwargs)
+            self.__http_cache.put(key, response)
+        return response
+
+    @property
+    def http_cache(self) -> HttpResponseCache:
+        return self.__http_cache
 
     def rome_request_post(self, **kwargs):
-        func = requests.post
+        func = self.__http_session.post
         return self.__proceed_rome_request__(func=func, **kwargs)
 
-    def __init__(self, client_id: str = None, client_secret: str = None, load_credentials_from_env: bool = False):
+    def __init__(self, client_id: str = None, client_secret: str = None, load_credentials_from_env: bool = False,
+                 pool_size: int = FT_POOL_SIZE, transport_retries: int = FT_TRANSPORT_RETRIES,
+                 request_timeout: float = FT_REQUEST_TIMEOUT, rate_limiter: AdaptiveRateLimiter = None,
+                 rate_limit_retries: int = FT_RATE_LIMIT_RETRIES, http_cache: HttpResponseCache = None,
+                 token_provider: TokenProvider = None, api_base_url: str = FT_API_BASE_URL,
+                 oauth_url: str = FT_OAUTH_URL):
         """
         Source: https://francetravail.io/data/documentation/utilisation-api-pole-emploi/generer-access-token
+        :param pool_size: number of keep-alive connections kept open, should cover the number of concurrent requests
+        :param transport_retries: retries on connection resets and read errors
+        :param request_timeout: connect and read timeout in seconds of each request
+        :param rate_limiter: limiter shared by every request of the client, built from the ini file when None
+        :param rate_limit_retries: retries of a request answered by 429 before raising OverflowError
+        :param http_cache: on-disk response cache, built from the ini file when None.
+            In replay mode no access token is requested and every response comes from the cache
+        :param token_provider: source of access tokens, built from the credentials and the ini file when None.
+            The token is requested on the first API call, refreshed before it expires and renewed on 401
+        :param api_base_url: base URL of the ROME métiers API, the URL of each entity is appended to it
+        :param oauth_url: URL of the OAuth token endpoint
         """
+        self.__api_base_url = api_base_url.rstrip('/')
+        self.__http_session = self.__build_http_session__(pool_size=pool_size, transport_retries=transport_retries)
+        self.__request_timeout = request_timeout
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter(max_rate=FT_RATE_LIMIT, burst=FT_RATE_LIMIT_BURST,
+                                               min_rate=FT_RATE_LIMIT_MIN)
+        self.__rate_limiter = rate_limiter
+        self.__rate_limit_retries = rate_limit_retries
+        if http_cache is None:
+            http_cache = HttpResponseCache(path=HTTP_CACHE_FILE_PATH, mode=FT_HTTP_CACHE_MODE, ttl=FT_HTTP_CACHE_TTL)
+        self.__http_cache = http_cache
+        if http_cache.offline:
+            general_logger.info(f"France Travail client replaying responses from {http_cache.path}")
+            return
+        if token_provider is not None:
+            self.__token_provider = token_provider
+            return
         if load_credentials_from_env:
             if os.environ.get(self.__env_client_id, None) is None:
                 raise NameError(f"Missing variable {self.__env_client_id} in environment variables")
@@ -59,99 +252,158 @@ class FranceTravailClient:
             else:
                 client_secret = os.environ.get(self.__env_client_secret)
         else:
-            if client_secret is None:
+            if client_id is None:
                 raise NameError(f"Missing variable client_id value")
             if client_secret is None:
                 raise NameError(f"Missing variable client_secret value")
 
-        url = "https://entreprise.pole-emploi.fr/connexion/oauth2/access_token"
+        url = oauth_url
         data = {"grant_type": "client_credentials",
                 "client_id": client_id,
                 "client_secret": client_secret,
                 "scope": "nomenclatureRome api_rome-competencesv1 api_rome-metiersv1 api_rome-contextes-travailv1"}
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}  # Mandatory for not to send Authorization
         params = {'realm': '/partenaire'}
-        response = self.rome_request_post(url=url, headers=headers, params=params, data=data)
-        access_token = response.json()['access_token']
-        self.__authorization = f"Bearer {access_token}"
 
-    def get_metiers(self, code: str = None):
+        def request_token() -> dict:
+            response = self.rome_request_post(url=url, headers=headers, params=params, data=data)
+            token = response.json()
+            token.setdefault('expires_in', CT_FT_TOKEN_DEFAULT_EXPIRES_IN)
+            return token
+
+        self.__token_provider = TokenProvider(fetch_func=request_token, cache_key=f"{client_id} {data['scope']}",
+                                              cache_path=TOKEN_CACHE_FILE_PATH if FT_TOKEN_CACHE else None,
+                                              refresh_margin=FT_TOKEN_REFRESH_MARGIN)
+
+    @property
+    def token_provider(self) -> TokenProvider:
+        return self.__token_provider
+
+    # Every get_* function returns the list when code is None, else the detail of code.
+    # stream=True yields the validated items of the list while it is downloaded,
+    # raw=True returns the undecoded body, validated by the caller in a single pass (see schemas.row_adapters),
+    # both together yield the decoded but not validated items of the list
+
+    @staticmethod
+    def __counted_chunks__(chunks: Iterator[bytes], endpoint: str) -> Iterator[bytes]:
+        for chunk in chunks:
+            ft_response_bytes.inc(len(chunk), endpoint=endpoint)
+            yield chunk
+
+    def __stream_list__(self, url: str, item_schema, raw: bool = False) -> Iterator:
+        """
+        Validate the items of a list response one at a time while its body is downloaded,
+        the request is sent on the first iteration
+        :param raw: yield the decoded JSON items without validating them
+        """
+        response = self.rome_request_get(url=url, stream=True)
+        chunks = response.iter_content(chunk_size=CT_FT_STREAM_CHUNK_SIZE)
+        # Bytes of chunked responses from the network, without Content-Length, are counted as they are received
+        if response.raw is not None and not response.headers.get('Content-Length', '').isdigit():
+            chunks = self.__counted_chunks__(chunks=chunks, endpoint=self.__endpoint__(url))
+        try:
+            for item in iter_json_array(chunks):
+                yield item if raw else item_schema.model_validate(item)
+        finally:
+            response.close()
+
+    def get_metiers(self, code: str = None, stream: bool = False, raw: bool = False):
         """
         Sources:
         https://francetravail.io/data/documentation/utilisation-api-pole-emploi/requeter-api
         https://francetravail.io/data/api/rome-4-0-metiers/documentation#/api-reference/operations/listerMetiers
         """
         if code is None:
-            url = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/metier"
+            url = f"{self.__api_base_url}/metier"
             Schema = rome_schemas.Metiers
+            if stream:
+                return self.__stream_list__(url=url, item_schema=rome_schemas.MetierRead, raw=raw)
         else:
-            url = f"https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/metier/{code}"
-            Schema = rome_schemas.Metier
+            url = f"{self.__api_base_url}/metier/{code}"
+            Schema = rome_schemas.MetierRead
         response = self.rome_request_get(url=url)
+        if raw:
+            return response.content
         return Schema.model_validate_json(response.text)
 
-    def get_appellations(self, code: str = None):
+    def get_appellations(self, code: str = None, stream: bool = False, raw: bool = False):
         """
         Sources:
         https://francetravail.io/data/documentation/utilisation-api-pole-emploi/requeter-api
         https://francetravail.io/data/api/rome-4-0-metiers/documentation#/api-reference/operations/listerAppellations
         """
         if code is None:
-            url = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/appellation"
+            url = f"{self.__api_base_url}/appellation"
             Schema = rome_schemas.Appellations
+            if stream:
+                return self.__stream_list__(url=url, item_schema=rome_schemas.AppellationRead, raw=raw)
         else:
-            url = f"https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/appellation/{code}"
-            Schema = rome_schemas.Appellation
+            url = f"{self.__api_base_url}/appellation/{code}"
+            Schema = rome_schemas.AppellationRead
 
         response = self.rome_request_get(url=url)
+        if raw:
+            return response.content
         return Schema.model_validate_json(response.text)
 
-    def get_themes(self, code: str = None):
+    def get_themes(self, code: str = None, stream: bool = False, raw: bool = False):
         """
         Sources:
         https://francetravail.io/data/documentation/utilisation-api-pole-emploi/requeter-api
         https://francetravail.io/data/api/rome-4-0-metiers/documentation#/api-reference/operations/listerThemes
         """
         if code is None:
-            url = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/theme"
+            url = f"{self.__api_base_url}/theme"
             Schema = rome_schemas.Themes
+            if stream:
+                return self.__stream_list__(url=url, item_schema=rome_schemas.ThemeRead, raw=raw)
         else:
-            url = f"https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/theme/{code}"
-            Schema = rome_schemas.Theme
+            url = f"{self.__api_base_url}/theme/{code}"
+            Schema = rome_schemas.ThemeRead
 
         response = self.rome_request_get(url=url)
+        if raw:
+            return response.content
         return Schema.model_validate_json(response.text)
 
-    def get_grands_domaines(self, code: str = None):
+    def get_grands_domaines(self, code: str = None, stream: bool = False, raw: bool = False):
         """
         Sources:
         https://francetravail.io/data/documentation/utilisation-api-pole-emploi/requeter-api
         https://francetravail.io/data/api/rome-4-0-metiers/documentation#/api-reference/operations/listerGrandDomaines
         """
         if code is None:
-            url = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/grand-domaine"
+            url = f"{self.__api_base_url}/grand-domaine"
             Schema = rome_schemas.GrandsDomaines
+            if stream:
+                return self.__stream_list__(url=url, item_schema=rome_schemas.GrandDomaineMetiersRead, raw=raw)
         else:
-            url = f"https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/grand-domaine/{code}"
-            Schema = rome_schemas.GrandDomaineMetiers
+            url = f"{self.__api_base_url}/grand-domaine/{code}"
+            Schema = rome_schemas.GrandDomaineMetiersRead
 
         response = self.rome_request_get(url=url)
+        if raw:
+            return response.content
         return Schema.model_validate_json(response.text)
 
-    def get_domaines(self, code: str = None):
+    def get_domaines(self, code: str = None, stream: bool = False, raw: bool = False):
         """
         Sources:
         https://francetravail.io/data/documentation/utilisation-api-pole-emploi/requeter-api
         https://francetravail.io/data/api/rome-4-0-metiers/documentation#/api-reference/operations/listerDomainesProfessionnels
         """
         if code is None:
-            url = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/domaine-professionnel"
+            url = f"{self.__api_base_url}/domaine-professionnel"
             Schema = rome_schemas.DomainesMetiers
+            if stream:
+                return self.__stream_list__(url=url, item_schema=rome_schemas.DomaineMetiersRead, raw=raw)
         else:
-            url = f"https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers/domaine-professionnel/{code}"
+            url = f"{self.__api_base_url}/domaine-professionnel/{code}"
             Schema = rome_schemas.DomaineMetiersRead
 
         response = self.rome_request_get(url=url)
+        if raw:
+            return response.content
         return Schema.model_validate_json(response.text)
 
 
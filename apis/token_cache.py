@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from server_cfg import general_logger
+
+
+@dataclass(frozen=True)
+class OAuthToken:
+    access_token: str
+    expires_at: float
+
+    @property
+    def authorization(self) -> str:
+        return f"Bearer {self.access_token}"
+
+    def is_fresh(self, refresh_margin: float) -> bool:
+        return time.time() < self.expires_at - refresh_margin
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 30.0, stale_after: float = 60.0, poll_interval: float = 0.05) -> Iterator:
+    """
+    Inter-process lock held by the exclusive creation of a lock file, portable across operating systems
+    :param timeout: seconds to wait for the lock before raising TimeoutError
+    :param stale_after: age in seconds after which a lock file left by a killed process is removed
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Lock {path} not acquired after {timeout} seconds")
+            time.sleep(poll_interval)
+    try:
+        os.write(descriptor, str(os.getpid()).encode())
+        os.close(descriptor)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class TokenProvider:
+    """
+    OAuth client credentials token kept with its expiry date and refreshed refresh_margin seconds before it expires.
+    With a cache file, the token is shared by every process using the same credentials:
+    the first one to need a new token requests it under a file lock, the others read it from the file.
+    """
+
+    def __init__(self, fetch_func: Callable[[], Dict], cache_key: str, cache_path: str = None,
+                 refresh_margin: float = 60.0):
+        """
+        :param fetch_func: requests a new token, returns the OAuth JSON response with access_token and expires_in
+        :param cache_key: identifies the credentials and scope in the cache file, never stored in clear
+        :param cache_path: JSON file shared by the processes, None to keep the token in this process only
+        :param refresh_margin: seconds before expiry from which the token is refreshed
+        """
+        self.fetch_func = fetch_func
+        self.cache_key = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.fetch_count = 0
+        self.__token: Optional[OAuthToken] = None
+        self.__lock = threading.Lock()
+
+    def __read_cache__(self) -> Dict[str, Dict]:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def __write_cache__(self, token: OAuthToken):
+        now = time.time()
+        entries = {key: entry for key, entry in self.__read_cache__().items() if entry.get('expires_at', 0) > now}
+        entries[self.cache_key] = {'access_token': token.access_token, 'expires_at': token.expires_at}
+        temporary_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        descriptor = os.open(temporary_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(temporary_path, self.cache_path)
+
+    def __cached_token__(self) -> Optional[OAuthToken]:
+        entry = self.__read_cache__().get(self.cache_key)
+        if entry is None:
+            return None
+        token = OAuthToken(access_token=entry['access_token'], expires_at=entry['expires_at'])
+        if self.__token is not None and token.access_token == self.__token.access_token:
+            # Token rejected by the API in this process, wait for another one
+            return None
+        return token if token.is_fresh(self.refresh_margin) else None
+
+    def __fetch__(self) -> OAuthToken:
+        requested_at = time.time()
+        response = self.fetch_func()
+        self.fetch_count += 1
+        token = OAuthToken(access_token=response['access_token'],
+                           expires_at=requested_at + float(response.get('expires_in', 0)))
+        general_logger.info(f"New OAuth token valid for {token.expires_at - requested_at:.0f} seconds")
+        return token
+
+    def __refresh__(self) -> OAuthToken:
+        if self.cache_path is None:
+            return self.__fetch__()
+        with file_lock(f"{self.cache_path}.lock"):
+            token = self.__cached_token__()
+            if token is None:
+                token = self.__fetch__()
+                self.__write_cache__(token)
+            return token
+
+    def authorization(self) -> str:
+        """
+        Authorization header value, requesting a new token if the current one expires soon
+        """
+        with self.__lock:
+            if self.__token is None or not self.__token.is_fresh(self.refresh_margin):
+                self.__token = self.__refresh__()
+            return self.__token.authorization
+
+    def invalidate(self, authorization: str):
+        """
+        Drop the token of a request answered by 401, unless another thread already replaced it
+        """
+        with self.__lock:
+            if self.__token is not None and self.__token.authorization == authorization:
+                self.__token = OAuthToken(access_token=self.__token.access_token, expires_at=0.0)
@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the validation of Métier details, from the raw API payload to the table row:
+- three passes: MetierRead.model_validate_json, model_dump(), then Metier(**...) validated again
+- single pass: cached TypeAdapter of schemas.row_adapters building the row and the relations as dicts
+Run from the project root: python -m automation.bench_validation
+"""
+import argparse
+import json
+import timeit
+
+from schemas import rome_schemas
+from schemas.row_adapters import row_adapter
+
+
+def metier_payload(index: int) -> bytes:
+    """
+    Synthetic detail with the size and nesting of a real Métier of the ROME 4.0 API
+    """
+    code = f"M{index:04d}"
+
+    def elements(prefix: str, count: int, **extra) -> list:
+        return [dict({'code': f"{prefix}{position}", 'libelle': f"Libellé {prefix} {position} de l'élément"}, **extra)
+                for position in range(count)]
+
+    payload = {
+        'code': code,
+        'libelle': f"Métier {index} de la conduite d'engins agricoles et forestiers",
+        'definition': "Réalise des travaux mécanisés agricoles, sylvicoles ou forestiers. " * 12,
+        'accesEmploi': "Cet emploi/métier est accessible avec un CAP/BEP à un Bac professionnel. " * 4,
+        'riasecMajeur': 'R',
+        'riasecMineur': 'C',
+        'transitionEcologique': True,
+        'transitionNumerique': False,
+        'codeIsco': '8341',
+        'domaineProfessionnel': {'code': 'A11', 'libelle': "Engins agricoles et forestiers"},
+        'appellations': elements('1', 12, libelleCourt="Conducteur", emploiCadre=False, emploiReglemente=False),
+        'themes': elements('T', 3, definition="Thème"),
+        'competencesMobilisees': elements('C', 40, codeOgr='123456', type='SAVOIR_FAIRE'),
+        'divisionsNaf': elements('N', 5),
+        'formacodes': elements('F', 8),
+        'contextesTravail': elements('X', 10),
+        'metiersProches': elements('A', 6),
+        'metiersEnvisageables': elements('B', 6),
+        'appellationsProches': elements('2', 4),
+        'appellationsEnvisageables': elements('3', 4),
+    }
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def three_passes(content: bytes) -> dict:
+    ft_element = rome_schemas.MetierRead.model_validate_json(content)
+    return rome_schemas.Metier(**ft_element.model_dump()).model_dump()
+
+
+def single_pass(content: bytes) -> dict:
+    adapter = row_adapter(read_schema=rome_schemas.MetierRead, table_schema=rome_schemas.Metier)
+    return adapter.row(adapter.validate_json(content))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the validation paths of Métier details")
+    parser.add_argument('--payloads', type=int, default=500, help="number of distinct payloads")
+    parser.add_argument('--repeat', type=int, default=5, help="timing repetitions, the best one is kept")
+    args = parser.parse_args()
+
+    contents = [metier_payload(index) for index in range(args.payloads)]
+    assert all(three_passes(content) == single_pass(content) for content in contents[:10])
+    print(f"{args.payloads} Métier payloads of {sum(map(len, contents)) // len(contents)} bytes on average")
+    timings = {}
+    for label, func in (('three passes', three_passes), ('single pass', single_pass)):
+        best = min(timeit.repeat(lambda: [func(content) for content in contents], number=1, repeat=args.repeat))
+        timings[label] = best
+        print(f"{label:>12}: {best * 1000:8.1f} ms, {best / args.payloads * 1e6:7.1f} µs per payload")
+    print(f"CPU saved: {1 - timings['single pass'] / timings['three passes']:.0%}, "
+          f"speed-up x{timings['three passes'] / timings['single pass']:.1f}")
@@ -0,0 +1,263 @@
+"""
+Benchmark of the ROME sync, database writes and read queries, against the local stand-in of the France Travail API
+(see automation.mock_ft_server) and a scratch database, so that the real API and db/rome.db are never touched.
+Results are written as a JSON report, a previous report given as baseline is compared metric by metric.
+Run from the project root: python -m automation.benchmark --output report.json [--baseline previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from constants import CT_ENV_DB_FILE_PATH, CT_ENV_FT_HTTP_CACHE_MODE, CT_ENV_FT_TOKEN_CACHE, CT_ENV_LOGGING_LEVEL, \
+    CT_HTTP_CACHE_MODE_OFF
+
+CT_BENCHMARK_REPORT_VERSION = 1
+
+
+def percentiles(durations: List[float]) -> Dict[str, float]:
+    """
+    Latency distribution in milliseconds, nearest-rank percentiles
+    """
+    ordered = sorted(durations)
+
+    def rank(quantile: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(quantile * len(ordered)) - 1))] * 1000
+
+    return {'count': len(ordered), 'mean_ms': sum(ordered) / len(ordered) * 1000, 'p50_ms': rank(0.50),
+            'p90_ms': rank(0.90), 'p99_ms': rank(0.99), 'max_ms': ordered[-1] * 1000,
+            'ops_per_second': len(ordered) / sum(ordered) if sum(ordered) else 0.0}
+
+
+def time_calls(func: Callable[[], Any], iterations: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started_at)
+    return percentiles(durations)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten_metrics(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, prefix=f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = float(value)
+    return metrics
+
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare the throughputs (*_per_second, higher is better) and durations (*_ms and *seconds, lower is better)
+    of two reports, maximum latencies being left out as too noisy
+    :param tolerance: relative change beyond which a worse metric is a regression, 0.1 for 10 %
+    :return: names of the regressed metrics
+    """
+    current = flatten_metrics(report['results'])
+    previous = flatten_metrics(baseline['results'])
+    regressions = []
+    print(f"\nComparison with the baseline {baseline['environment'].get('revision')} "
+          f"of {baseline['created_at']}:")
+    for name in sorted(current.keys() & previous.keys()):
+        if name.endswith('_per_second'):
+            higher_is_better = True
+        elif (name.endswith('_ms') and not name.endswith('max_ms')) or name.endswith('seconds'):
+            higher_is_better = False
+        else:
+            continue
+        if previous[name] == 0:
+            continue
+        change = current[name] / previous[name] - 1
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif -worse > tolerance:
+            flag = '  improvement'
+        print(f"  {name:<60} {previous[name]:>12.3f} -> {current[name]:>12.3f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def run_benchmark(args: argparse.Namespace, work_dir: str) -> Dict[str, Any]:
+    # The configuration is read at import time: the scratch database and the disabled caches must be set first
+    os.environ[CT_ENV_DB_FILE_PATH] = os.path.join(work_dir, 'rome.db')
+    os.environ[CT_ENV_FT_TOKEN_CACHE] = 'false'
+    os.environ[CT_ENV_FT_HTTP_CACHE_MODE] = CT_HTTP_CACHE_MODE_OFF
+    os.environ.setdefault(CT_ENV_LOGGING_LEVEL, 'warning')
+    from sqlmodel import Session, SQLModel
+    from apis.http_cache import HttpResponseCache
+    from apis.rate_limiter import AdaptiveRateLimiter
+    from apis.rome_apis import FranceTravailClient
+    from automation.mock_ft_server import MockFranceTravailServer, MockReferential
+    from db.crud.relations import write_relations
+    from db.crud.rome_crud import download_all
+    from db.crud.rome_read import read_one, read_one_cached, read_page
+    from db.crud.rome_search import create_search_indexes, search_labels
+    from db.crud.upsert import upsert_rows
+    from db.data_access import create_db_and_tables, create_sqlite_engine, read_engine
+    from schemas import rome_schemas
+    from schemas.row_adapters import row_adapter
+
+    results = {}
+    referential = MockReferential(metiers=args.metiers, appellations_per_metier=args.appellations_per_metier,
+                                  seed=args.seed)
+    server = MockFranceTravailServer(referential=referential, latency=args.latency, jitter=args.jitter,
+                                     rate_limit_ratio=args.rate_limit_ratio, retry_after=args.retry_after,
+                                     seed=args.seed)
+    with server:
+        create_db_and_tables()
+        rate_limiter = AdaptiveRateLimiter(max_rate=args.rate_limit, burst=args.max_in_flight * args.parallel_jobs,
+                                           min_rate=min(1.0, args.rate_limit))
+        ft_client = FranceTravailClient(client_id='benchmark', client_secret='benchmark',
+                                        pool_size=args.max_in_flight * args.parallel_jobs,
+                                        rate_limiter=rate_limiter, rate_limit_retries=args.rate_limit_retries,
+                                        http_cache=HttpResponseCache(path=os.path.join(work_dir, 'http_cache.db'),
+                                                                     mode=CT_HTTP_CACHE_MODE_OFF),
+                                        api_base_url=server.base_url, oauth_url=server.oauth_url)
+        with ft_client:
+            for label, delta in (('sync_full', False), ('sync_delta', True)):
+                server.reset_stats()
+                started_at = time.perf_counter()
+                reports = download_all(max_in_flight=args.max_in_flight, batch_size=args.batch_size, delta=delta,
+                                       max_parallel_jobs=args.parallel_jobs, ft_client=ft_client)
+                elapsed = time.perf_counter() - started_at
+                stats = server.stats()
+                rows = sum(report.inserted + report.updated for report in reports.values())
+                results[label] = {'seconds': elapsed, 'requests': stats['requests'],
+                                  'rate_limited': stats['statuses'].get('429', 0), 'rows': rows,
+                                  'requests_per_second': stats['requests'] / elapsed,
+                                  'rows_per_second': rows / elapsed,
+                                  'megabytes_received': stats['bytes_sent'] / 1e6}
+                print(f"{label}: {rows} rows, {stats['requests']} requests "
+                      f"({results[label]['rate_limited']} answered 429) in {elapsed:.2f}s")
+
+        # Write cost of the sync path without the network: insert, update then unchanged upserts of the métiers
+        # and their relations, in a database of their own
+        write_path = os.path.join(work_dir, 'write.db')
+        write_engine = create_sqlite_engine(file_path=write_path)
+        SQLModel.metadata.create_all(write_engine)
+        create_search_indexes(write_engine)
+        adapter = row_adapter(read_schema=rome_schemas.MetierRead, table_schema=rome_schemas.Metier)
+        payloads = [adapter.validate_python(detail) for detail in referential.details()['metier'].values()]
+        results['db_write'] = {}
+        for label, suffix in (('insert', ''), ('update', ' (mis à jour)'), ('unchanged', ' (mis à jour)')):
+            elements = {payload['code']: dict(payload, libelle=payload['libelle'] + suffix) for payload in payloads}
+
+            def checkpoint(batch_session: Session, batch: List[dict]):
+                write_relations(session=batch_session, schema=rome_schemas.Metier,
+                                elements={row['code']: elements[row['code']] for row in batch})
+
+            with Session(write_engine) as session:
+                started_at = time.perf_counter()
+                report = upsert_rows(session=session, schema=rome_schemas.Metier,
+                                     rows=(adapter.row(element) for element in elements.values()),
+                                     batch_size=args.batch_size, on_batch=checkpoint)
+                elapsed = time.perf_counter() - started_at
+            batches = -(-len(elements) // args.batch_size)
+            results['db_write'][label] = {'seconds': elapsed, 'rows': len(elements),
+                                          'rows_per_second': len(elements) / elapsed,
+                                          'batch_ms': elapsed / batches * 1000, 'report': str(report)}
+            print(f"db_write {label}: {len(elements) / elapsed:.0f} rows/s, {report}")
+        write_engine.dispose()
+
+    # Read latencies on the synced database, one session per call as for an API request
+    randomizer = random.Random(args.seed)
+    metier_codes = [metier['code'] for metier in referential.metiers]
+    appellation_codes = [appellation['code'] for appellation in referential.appellations]
+    words = sorted({word[:4].lower() for metier in referential.metiers for word in metier['libelle'].split()
+                    if len(word) > 3})
+
+    def in_session(func: Callable[[Session], Any]) -> Callable[[], Any]:
+        def call():
+            with Session(read_engine) as session:
+                return func(session)
+        return call
+
+    queries = {
+        'metier_by_code': in_session(lambda session: read_one(session, rome_schemas.Metier,
+                                                              randomizer.choice(metier_codes))),
+        'appellation_by_code': in_session(lambda session: read_one(session, rome_schemas.Appellation,
+                                                                   randomizer.choice(appellation_codes))),
+        'metier_by_code_cached': lambda: read_one_cached(rome_schemas.Metier, randomizer.choice(metier_codes)),
+        'appellation_page_100': in_session(lambda session: read_page(session, rome_schemas.Appellation,
+                                                                     start_with_value=randomizer.choice(
+                                                                         appellation_codes), limit=100)),
+        'search_labels': in_session(lambda session: search_labels(session, randomizer.choice(words), limit=10)),
+    }
+    results['read'] = {}
+    for name, func in queries.items():
+        results['read'][name] = time_calls(func, iterations=args.read_iterations, warmup=args.read_warmup)
+        print(f"read {name}: p50 {results['read'][name]['p50_ms']:.3f} ms, "
+              f"p99 {results['read'][name]['p99_ms']:.3f} ms")
+    read_engine.dispose()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ROME sync and queries against a local mock API")
+    parser.add_argument('--output', help="path of the JSON report, printed when missing")
+    parser.add_argument('--baseline', help="previous JSON report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="relative change of a metric beyond which it is reported as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 on regressions")
+    parser.add_argument('--metiers', type=int, default=200, help="number of métiers served by the mock API")
+    parser.add_argument('--appellations-per-metier', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.005, help="seconds added to each API response")
+    parser.add_argument('--jitter', type=float, default=0.005, help="maximum random seconds added to the latency")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help="share of API requests answered 429, the client backs off on each of them")
+    parser.add_argument('--retry-after', type=float, default=0.1, help="Retry-After of the 429 responses")
+    parser.add_argument('--rate-limit', type=float, default=500.0, help="client requests per second ceiling")
+    parser.add_argument('--rate-limit-retries', type=int, default=10)
+    parser.add_argument('--max-in-flight', type=int, default=8, help="concurrent detail requests per job")
+    parser.add_argument('--parallel-jobs', type=int, default=2, help="sync jobs running at once")
+    parser.add_argument('--batch-size', type=int, default=500, help="rows per write transaction")
+    parser.add_argument('--read-iterations', type=int, default=2000, help="timed calls per read query")
+    parser.add_argument('--read-warmup', type=int, default=100, help="untimed calls per read query")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='rome-benchmark-') as work_dir:
+        results = run_benchmark(args, work_dir)
+    report = {'format_version': CT_BENCHMARK_REPORT_VERSION,
+              'created_at': datetime.now(timezone.utc).isoformat(),
+              'environment': {'revision': git_revision(), 'python': platform.python_version(),
+                              'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+                              'cpu_count': os.cpu_count()},
+              'parameters': vars(args),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2, ensure_ascii=False)
+        print(f"Report written in {args.output}")
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), tolerance=args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressed metrics beyond {args.tolerance:.0%}")
+            if args.fail_on_regression:
+                sys.exit(1)
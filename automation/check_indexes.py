@@ -0,0 +1,254 @@
+"""
+Consistency checks of the indexes built from the referential, on a scratch database synced from the local stand-in
+of the France Travail API (see automation.mock_ft_server), so that the real API and db/rome.db are never touched:
+- similarity: after random edits of the referential, an incremental refresh of the similarity index
+  stores the same neighbours as a full rebuild, round after round
+- mobility: reachable and shortest_path of the mobility graphs, with random node and transition filters,
+  agree with a pure Python BFS over the link tables
+Run from the project root: python -m automation.check_indexes [--rounds 5]
+Exits with status 1 when a check fails.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from constants import CT_ENV_DB_FILE_PATH, CT_ENV_FT_HTTP_CACHE_MODE, CT_ENV_FT_TOKEN_CACHE, CT_ENV_LOGGING_LEVEL, \
+    CT_HTTP_CACHE_MODE_OFF
+
+
+def seed_database(args: argparse.Namespace, work_dir: str):
+    """
+    Sync the scratch database from the stand-in API, the configuration must point to it before any project import
+    """
+    from apis.http_cache import HttpResponseCache
+    from apis.rate_limiter import AdaptiveRateLimiter
+    from apis.rome_apis import FranceTravailClient
+    from automation.mock_ft_server import MockFranceTravailServer, MockReferential
+    from db.crud.rome_crud import download_all
+    from db.data_access import create_db_and_tables
+
+    referential = MockReferential(metiers=args.metiers, appellations_per_metier=args.appellations_per_metier,
+                                  seed=args.seed)
+    with MockFranceTravailServer(referential=referential, seed=args.seed) as server:
+        create_db_and_tables()
+        ft_client = FranceTravailClient(client_id='check', client_secret='check', pool_size=16,
+                                        rate_limiter=AdaptiveRateLimiter(max_rate=5000.0, burst=16),
+                                        http_cache=HttpResponseCache(path=os.path.join(work_dir, 'http_cache.db'),
+                                                                     mode=CT_HTTP_CACHE_MODE_OFF),
+                                        api_base_url=server.base_url, oauth_url=server.oauth_url)
+        with ft_client:
+            download_all(max_in_flight=8, max_parallel_jobs=2, ft_client=ft_client)
+
+
+def edit_referential(connection: Any, randomizer: random.Random, edits: int, round_number: int):
+    """
+    Changes a sync could make: competences of métiers and appellations replaced, themes moved,
+    a métier removed with its links and a new one added
+    """
+    from sqlalchemy import delete, insert, select
+    from db.compact_referential import rome_table_schemas
+    from schemas import rome_schemas
+
+    metier = rome_schemas.Metier.__table__
+    metier_competence = rome_schemas.MetierCompetenceLink.__table__
+    metier_theme = rome_schemas.MetierThemeLink.__table__
+    metier_domaine = rome_schemas.MetierDomaineLink.__table__
+    appellation_competence = rome_schemas.AppellationCompetenceLink.__table__
+    metier_codes = sorted(connection.execute(select(metier.c.code)).scalars())
+    appellation_codes = sorted(connection.execute(select(rome_schemas.Appellation.__table__.c.code)).scalars())
+    competence_codes = sorted(connection.execute(select(rome_schemas.Competence.__table__.c.code)).scalars())
+    theme_codes = sorted(connection.execute(select(rome_schemas.Theme.__table__.c.code)).scalars())
+    for code in randomizer.sample(metier_codes, edits):
+        current = sorted(connection.execute(select(metier_competence.c.codeCompetence)
+                                            .where(metier_competence.c.codeMetier == code)).scalars())
+        removed = randomizer.sample(current, min(3, len(current)))
+        connection.execute(delete(metier_competence).where(metier_competence.c.codeMetier == code,
+                                                           metier_competence.c.codeCompetence.in_(removed)))
+        added = set(randomizer.sample(competence_codes, 3)) - set(current)
+        if added:
+            connection.execute(insert(metier_competence), [{'codeMetier': code, 'codeCompetence': competence}
+                                                           for competence in sorted(added)])
+    for code in randomizer.sample(appellation_codes, edits):
+        connection.execute(delete(appellation_competence).where(appellation_competence.c.codeAppellation == code))
+        connection.execute(insert(appellation_competence), [{'codeAppellation': code, 'codeCompetence': competence}
+                                                            for competence in randomizer.sample(competence_codes, 2)])
+    code = randomizer.choice(metier_codes)
+    connection.execute(delete(metier_theme).where(metier_theme.c.codeMetier == code))
+    connection.execute(insert(metier_theme), [{'codeMetier': code, 'codeTheme': randomizer.choice(theme_codes)}])
+    removed_code, model_code = randomizer.sample(metier_codes, 2)
+    for schema in rome_table_schemas():
+        link = schema.__table__
+        if 'codeMetier' in link.c:
+            connection.execute(delete(link).where(link.c.codeMetier == removed_code))
+    connection.execute(delete(metier).where(metier.c.code == removed_code))
+    # New métier sharing the domaine and part of the competences of another one
+    new_code = f"Z{round_number:04d}"
+    connection.execute(insert(metier), [{'code': new_code, 'libelle': f"Métier ajouté {round_number}"}])
+    for link, column in ((metier_competence, 'codeCompetence'), (metier_domaine, 'codeDomaine')):
+        values = sorted(connection.execute(select(link.c[column]).where(link.c.codeMetier == model_code)).scalars())
+        kept = values if column == 'codeDomaine' else randomizer.sample(values, len(values) // 2)
+        if kept:
+            connection.execute(insert(link), [{'codeMetier': new_code, column: value} for value in kept])
+
+
+def similarity_rows(db_file_path: str) -> Dict[str, List[tuple]]:
+    from schemas import similarity_schemas
+
+    rows = {}
+    with sqlite3.connect(db_file_path) as connection:
+        for schema in (similarity_schemas.MetierSimilaire, similarity_schemas.AppellationSimilaire,
+                       similarity_schemas.SimilaritySignature):
+            table = schema.__table__
+            keys = ', '.join(f'"{column.name}"' for column in table.primary_key.columns)
+            rows[table.name] = connection.execute(f"SELECT * FROM {table.name} ORDER BY {keys}").fetchall()
+    return rows
+
+
+def check_similarity(args: argparse.Namespace, work_dir: str) -> bool:
+    from db.crud.similarity_index import refresh_similarity_index
+    from db.data_access import create_sqlite_engine, engine
+    from server_cfg import SQLITE_FILE_PATH
+
+    randomizer = random.Random(args.seed)
+    built = refresh_similarity_index(engine=engine)
+    print(f"similarity: full build of {built}")
+    succeeded = True
+    for round_number in range(1, args.rounds + 1):
+        with engine.begin() as connection:
+            edit_referential(connection, randomizer, edits=args.edits, round_number=round_number)
+        refreshed = refresh_similarity_index(engine=engine)
+        # Full rebuild of a copy of the same data
+        rebuilt_path = os.path.join(work_dir, f'rebuilt_{round_number}.db')
+        with sqlite3.connect(SQLITE_FILE_PATH) as source, sqlite3.connect(rebuilt_path) as target:
+            source.backup(target)
+        rebuilt_engine = create_sqlite_engine(file_path=rebuilt_path)
+        refresh_similarity_index(engine=rebuilt_engine, full=True)
+        rebuilt_engine.dispose()
+        incremental_rows, rebuilt_rows = similarity_rows(SQLITE_FILE_PATH), similarity_rows(rebuilt_path)
+        mismatches = {name: len(set(rows) ^ set(rebuilt_rows[name]))
+                      for name, rows in incremental_rows.items() if rows != rebuilt_rows[name]}
+        status = 'OK' if not mismatches else f"MISMATCH, rows differing by table {mismatches}"
+        print(f"similarity round {round_number}: incremental refresh of {refreshed}, "
+              f"{sum(map(len, incremental_rows.values()))} rows, {status}")
+        succeeded = succeeded and not mismatches
+    return succeeded
+
+
+def bfs_distances(adjacency: Dict[str, Set[str]], source: str, accepts: Callable[[str], bool],
+                  max_hops: int = None) -> Dict[str, int]:
+    """
+    Transitions from source to every node reached through nodes accepted, the reference of the graph searches
+    """
+    distances = {source: 0}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        if max_hops is not None and distances[node] == max_hops:
+            continue
+        for target in sorted(adjacency.get(node, ())):
+            if target not in distances and accepts(target):
+                distances[target] = distances[node] + 1
+                queue.append(target)
+    return distances
+
+
+def check_mobility(args: argparse.Namespace) -> bool:
+    from sqlalchemy import select
+    from constants import CT_MOBILITY_EDGE_KINDS_LIST
+    from db.crud.mobility_graph import MOBILITY_KINDS, mobility_graph
+    from db.data_access import read_engine
+
+    randomizer = random.Random(args.seed)
+    succeeded = True
+    for kind, mobility_kind in MOBILITY_KINDS.items():
+        graph = mobility_graph(kind)
+        element = mobility_kind.schema.__table__
+        adjacencies: Dict[str, Dict[str, Set[str]]] = {}
+        with read_engine.connect() as connection:
+            ecologique = dict(connection.execute(select(element.c.code, element.c.transitionEcologique)).all())
+            for edge_kind, (link, source_column, target_column) in mobility_kind.edges.items():
+                link_table = link.__table__
+                adjacency = adjacencies.setdefault(edge_kind, {})
+                for source, target in connection.execute(select(link_table.c[source_column],
+                                                                link_table.c[target_column])):
+                    # Links of elements removed from the referential are not transitions
+                    if source != target and source in ecologique and target in ecologique:
+                        adjacency.setdefault(source, set()).add(target)
+            grand_domaines = dict(connection.execute(mobility_kind.grand_domaines()).all())
+        grand_domaine_codes = sorted(set(grand_domaines.values()))
+        failures = []
+        for _ in range(args.queries):
+            source, target = randomizer.sample(graph.codes, 2)
+            edge_kinds = randomizer.choice([None] + [[edge_kind] for edge_kind in CT_MOBILITY_EDGE_KINDS_LIST])
+            transition_ecologique = randomizer.choice([None, True, False])
+            grand_domaine = randomizer.choice([None] + grand_domaine_codes[:3])
+            max_hops = randomizer.randint(1, 4)
+            adjacency = {}
+            for edge_kind in edge_kinds or CT_MOBILITY_EDGE_KINDS_LIST:
+                for node, targets in adjacencies.get(edge_kind, {}).items():
+                    adjacency.setdefault(node, set()).update(targets)
+
+            def accepts(code: str, exempt: Optional[str] = None) -> bool:
+                return code == exempt or (
+                    (transition_ecologique is None or bool(ecologique.get(code)) == transition_ecologique)
+                    and (grand_domaine is None or grand_domaines.get(code) == grand_domaine))
+
+            query = f"{source} -> {target} edge_kinds={edge_kinds} transitionEcologique={transition_ecologique} " \
+                    f"grandDomaine={grand_domaine}"
+            allowed = graph.node_filter(transition_ecologique=transition_ecologique, grand_domaine=grand_domaine)
+            reached = {graph.codes[position]: hops for position, hops in
+                       graph.reachable(source, max_hops, edge_kinds=edge_kinds, allowed=allowed)}
+            expected = bfs_distances(adjacency, source, accepts, max_hops=max_hops)
+            expected.pop(source)
+            if reached != expected:
+                failures.append(f"reachable {query} max_hops={max_hops}")
+            # The target of a path is exempt from the node filter, its intermediate nodes are not
+            path = graph.shortest_path(source, target, edge_kinds=edge_kinds, allowed=allowed)
+            distances = bfs_distances(adjacency, source, lambda code: accepts(code, exempt=target))
+            if path is None:
+                if target in distances:
+                    failures.append(f"shortest_path {query}: no path, expected {distances[target]} transitions")
+                continue
+            codes = [graph.codes[position] for position in path]
+            if (codes[0] != source or codes[-1] != target or len(codes) - 1 != distances.get(target)
+                    or any(step not in adjacency.get(node, ()) for node, step in zip(codes, codes[1:]))
+                    or not all(accepts(code) for code in codes[1:-1])):
+                failures.append(f"shortest_path {query}: invalid path {codes}")
+        for failure in failures[:10]:
+            print(f"mobility MISMATCH {kind} {failure}")
+        print(f"mobility {kind}: {len(graph.codes)} nodes, {len(graph.indices)} edges, {args.queries} queries, "
+              f"{'OK' if not failures else f'{len(failures)} MISMATCHES'}")
+        succeeded = succeeded and not failures
+    return succeeded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the indexes built from the referential on a scratch database")
+    parser.add_argument('--metiers', type=int, default=300, help="number of métiers served by the mock API")
+    parser.add_argument('--appellations-per-metier', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5, help="rounds of edits followed by an incremental refresh")
+    parser.add_argument('--edits', type=int, default=10, help="métiers and appellations edited per round")
+    parser.add_argument('--queries', type=int, default=3000, help="random mobility searches of each graph")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='rome-check-') as work_dir:
+        # The configuration is read at import time: the scratch database and the disabled caches must be set first
+        os.environ[CT_ENV_DB_FILE_PATH] = os.path.join(work_dir, 'rome.db')
+        os.environ[CT_ENV_FT_TOKEN_CACHE] = 'false'
+        os.environ[CT_ENV_FT_HTTP_CACHE_MODE] = CT_HTTP_CACHE_MODE_OFF
+        os.environ.setdefault(CT_ENV_LOGGING_LEVEL, 'warning')
+        seed_database(args, work_dir)
+        succeeded = check_similarity(args, work_dir)
+        succeeded = check_mobility(args) and succeeded
+        from db.data_access import engine, read_engine
+
+        engine.dispose()
+        read_engine.dispose()
+    if not succeeded:
+        sys.exit(1)
@@ -0,0 +1,351 @@
+"""
+Local stand-in of the France Travail ROME métiers API, for benchmarks and offline runs of the sync.
+It serves a synthetic but consistent referential (grands domaines, domaines, métiers, appellations, thèmes)
+on the same URL shapes as the real API, with configurable latency and injected 429 responses.
+Run from the project root: python -m automation.mock_ft_server --port 8765 --latency 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from constants import CT_FT_API_BASE_URL, CT_FT_OAUTH_URL
+
+# Entities of the API: path segment of the URL, as used by FranceTravailClient
+CT_MOCK_ENTITIES = ('grand-domaine', 'domaine-professionnel', 'metier', 'appellation', 'theme')
+CT_MOCK_TOKEN_PREFIX = 'mock-'
+
+
+def reference(code: str, libelle: str) -> Dict[str, str]:
+    return {'code': code, 'libelle': libelle}
+
+
+class MockReferential:
+    """
+    Synthetic ROME referential with the shape, nesting and sizes of the real one.
+    Codes are consistent across entities, so the relations of a sync point to downloaded elements.
+    """
+
+    def __init__(self, metiers: int = 600, appellations_per_metier: int = 20, grands_domaines: int = 14,
+                 domaines_per_grand_domaine: int = 8, themes: int = 17, competences_per_metier: int = 40,
+                 seed: int = 0):
+        """
+        :param metiers: number of métiers, spread over the domaines
+        :param appellations_per_metier: number of appellations of each métier
+        :param competences_per_metier: number of mobilized competences in each métier detail
+        :param seed: seed of the random choices, the same parameters always give the same payloads
+        """
+        randomizer = random.Random(seed)
+        letters = [chr(ord('A') + index) for index in range(grands_domaines)]
+        self.grands_domaines = [reference(letter, f"Grand domaine {letter} des métiers") for letter in letters]
+        self.domaines = [reference(f"{letter}{index + 11}", f"Domaine professionnel {letter}{index + 11}")
+                         for letter in letters for index in range(domaines_per_grand_domaine)]
+        self.themes = [reference(str(index + 1), f"Thème {index + 1} de la mobilité professionnelle")
+                       for index in range(themes)]
+        self.metier_domaines = {}
+        self.metiers = []
+        for index in range(metiers):
+            domaine = self.domaines[index % len(self.domaines)]
+            code = f"{domaine['code']}{index // len(self.domaines) + 1:02d}"
+            self.metiers.append(reference(code, f"Métier {code} de la conduite d'engins et d'équipements"))
+            self.metier_domaines[code] = domaine
+        self.appellations = []
+        self.appellation_metiers = {}
+        for metier in self.metiers:
+            for index in range(appellations_per_metier):
+                code = str(10000 + len(self.appellations))
+                self.appellations.append(reference(code, f"Appellation {code} du métier {metier['code']}"))
+                self.appellation_metiers[code] = metier
+        self.metier_appellations = {}
+        for appellation in self.appellations:
+            self.metier_appellations.setdefault(self.appellation_metiers[appellation['code']]['code'], []).append(
+                appellation)
+        self.competences = [dict(reference(f"C{index:05d}", f"Compétence {index} mobilisée en situation de travail"),
+                                 codeOgr=str(100000 + index), type='SAVOIR_FAIRE')
+                            for index in range(max(competences_per_metier * 10, 1))]
+        self.metier_themes = {metier['code']: randomizer.sample(self.themes, k=min(3, len(self.themes)))
+                              for metier in self.metiers}
+        self.competences_per_metier = min(competences_per_metier, len(self.competences))
+        self.randomizer = randomizer
+
+    def sample(self, elements: List[Dict], count: int) -> List[Dict]:
+        return self.randomizer.sample(elements, k=min(count, len(elements)))
+
+    def lists(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        List responses by entity, entries carry the code and label only so that details are requested
+        """
+        return {'grand-domaine': self.grands_domaines,
+                'domaine-professionnel': self.domaines,
+                'metier': self.metiers,
+                'appellation': [dict(appellation, libelleCourt=appellation['libelle'][:30])
+                                for appellation in self.appellations],
+                'theme': self.themes}
+
+    def details(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Detail responses by entity then code
+        """
+        details = {entity: {} for entity in CT_MOCK_ENTITIES}
+        for grand_domaine in self.grands_domaines:
+            details['grand-domaine'][grand_domaine['code']] = dict(
+                grand_domaine,
+                domaineProfessionnels=[domaine for domaine in self.domaines
+                                       if domaine['code'].startswith(grand_domaine['code'])])
+        for domaine in self.domaines:
+            details['domaine-professionnel'][domaine['code']] = dict(
+                domaine,
+                grandDomaine=next(grand_domaine for grand_domaine in self.grands_domaines
+                                  if domaine['code'].startswith(grand_domaine['code'])),
+                metiers=[metier for metier in self.metiers if self.metier_domaines[metier['code']] is domaine])
+        for theme in self.themes:
+            details['theme'][theme['code']] = dict(
+                theme, definition=f"Définition du {theme['libelle'].lower()}. " * 4,
+                metiers=[code for code, themes in self.metier_themes.items() if theme in themes])
+        for metier in self.metiers:
+            code = metier['code']
+            details['metier'][code] = dict(
+                metier,
+                definition="Réalise des travaux mécanisés agricoles, sylvicoles ou forestiers. " * 12,
+                accesEmploi="Cet emploi/métier est accessible avec un CAP/BEP à un Bac professionnel. " * 4,
+                riasecMajeur=self.randomizer.choice('RIASEC'),
+                riasecMineur=self.randomizer.choice('RIASEC'),
+                transitionEcologique=self.randomizer.random() < 0.3,
+                transitionNumerique=self.randomizer.random() < 0.3,
+                codeIsco=f"{self.randomizer.randint(1000, 9999)}",
+                domaineProfessionnel=self.metier_domaines[code],
+                appellations=[dict(appellation, emploiCadre=False, emploiReglemente=False)
+                              for appellation in self.metier_appellations.get(code, [])],
+                themes=self.metier_themes[code],
+                competencesMobilisees=self.sample(self.competences, self.competences_per_metier),
+                divisionsNaf=[reference(f"{index:02d}.{index % 10}", f"Division NAF {index}")
+                              for index in self.randomizer.sample(range(1, 99), k=5)],
+                formacodes=[reference(f"{index:05d}", f"Formacode {index}")
+                            for index in self.randomizer.sample(range(10000, 99999), k=8)],
+                contextesTravail=[reference(f"X{index}", f"Contexte de travail {index}")
+                                  for index in self.randomizer.sample(range(100), k=10)],
+                metiersProches=self.sample(self.metiers, 6),
+                metiersEnvisageables=self.sample(self.metiers, 6),
+                appellationsProches=self.sample(self.appellations, 4),
+                appellationsEnvisageables=self.sample(self.appellations, 4))
+        for appellation in self.appellations:
+            details['appellation'][appellation['code']] = dict(
+                appellation,
+                libelleCourt=appellation['libelle'][:30],
+                emploiCadre=self.randomizer.random() < 0.2,
+                emploiReglemente=self.randomizer.random() < 0.1,
+                transitionEcologique=False,
+                transitionNumerique=False,
+                classification='PRINCIPALE',
+                metier=self.appellation_metiers[appellation['code']],
+                competencesCles=self.sample(self.competences, 10),
+                metiersProches=self.sample(self.metiers, 3),
+                metiersEnvisageables=self.sample(self.metiers, 3),
+                appellationsProches=self.sample(self.appellations, 4),
+                appellationsEnvisageables=self.sample(self.appellations, 4))
+        return details
+
+    def size(self) -> Dict[str, int]:
+        return {'grand-domaine': len(self.grands_domaines), 'domaine-professionnel': len(self.domaines),
+                'metier': len(self.metiers), 'appellation': len(self.appellations), 'theme': len(self.themes)}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockHTTPServer'
+
+    def log_message(self, format: str, *args):
+        # Access logs would cost more than the benchmarked client
+        pass
+
+    def send_body(self, status: int, body: bytes, headers: Dict[str, str] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock.count(status=status, sent=len(body))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if urlsplit(self.path).path != self.server.mock.oauth_path:
+            self.send_body(404, b'{"message": "Not found"}')
+            return
+        self.send_body(200, self.server.mock.token_body())
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock.wait_latency()
+        if not self.headers.get('Authorization', '').startswith(f"Bearer {CT_MOCK_TOKEN_PREFIX}"):
+            self.send_body(401, b'{"message": "Invalid access token"}')
+            return
+        if mock.rate_limited():
+            self.send_body(429, b'{"message": "Limit exceeded"}', {'Retry-After': f"{mock.retry_after:g}"})
+            return
+        body = mock.body(urlsplit(self.path).path)
+        if body is None:
+            self.send_body(404, b'{"message": "Not found"}')
+        else:
+            self.send_body(200, body)
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    mock: 'MockFranceTravailServer'
+
+
+class MockFranceTravailServer:
+    """
+    HTTP server answering the token, list and detail requests of FranceTravailClient from a MockReferential.
+    Responses are encoded once at start, so that the server stays far cheaper than the client it measures.
+    """
+
+    def __init__(self, referential: MockReferential = None, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, rate_limit_ratio: float = 0.0,
+                 quota: float = 0.0, retry_after: float = 1.0, token_lifetime: int = 1499, seed: int = 0):
+        """
+        :param port: listening port, 0 picks a free one, see base_url
+        :param latency: seconds added to each API response
+        :param jitter: maximum random seconds added to the latency
+        :param rate_limit_ratio: share of the API requests answered by 429, from 0 to 1
+        :param quota: maximum API requests per second over a sliding second, beyond it 429 is answered, 0 for none
+        :param retry_after: value of the Retry-After header of the 429 responses, in seconds
+        :param token_lifetime: expires_in of the delivered access tokens
+        """
+        self.referential = referential or MockReferential(seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.quota = quota
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.api_path = urlsplit(CT_FT_API_BASE_URL).path.rstrip('/')
+        self.oauth_path = urlsplit(CT_FT_OAUTH_URL).path
+        self.bodies = self.__encode_bodies__()
+        self.statuses = Counter()
+        self.bytes_sent = 0
+        self.tokens_delivered = 0
+        self.__randomizer = random.Random(seed)
+        self.__recent_requests = deque()
+        self.__lock = threading.Lock()
+        self.__httpd = MockHTTPServer((host, port), MockRequestHandler)
+        self.__httpd.mock = self
+        self.__thread: Optional[threading.Thread] = None
+
+    def __encode_bodies__(self) -> Dict[str, bytes]:
+        bodies = {}
+        for entity, elements in self.referential.lists().items():
+            bodies[f"{self.api_path}/{entity}"] = json.dumps(elements, ensure_ascii=False).encode('utf-8')
+        for entity, details in self.referential.details().items():
+            for code, detail in details.items():
+                bodies[f"{self.api_path}/{entity}/{code}"] = json.dumps(detail, ensure_ascii=False).encode('utf-8')
+        return bodies
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__httpd.server_address[:2]
+        return f"http://{host}:{port}{self.api_path}"
+
+    @property
+    def oauth_url(self) -> str:
+        host, port = self.__httpd.server_address[:2]
+        return f"http://{host}:{port}{self.oauth_path}"
+
+    def body(self, path: str) -> Optional[bytes]:
+        return self.bodies.get(path.rstrip('/'))
+
+    def token_body(self) -> bytes:
+        with self.__lock:
+            self.tokens_delivered += 1
+            token = f"{CT_MOCK_TOKEN_PREFIX}{self.tokens_delivered}"
+        return json.dumps({'access_token': token, 'token_type': 'Bearer', 'scope': 'api_rome-metiersv1',
+                           'expires_in': self.token_lifetime}).encode('utf-8')
+
+    def wait_latency(self):
+        delay = self.latency + (self.__randomizer.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def rate_limited(self) -> bool:
+        with self.__lock:
+            if self.rate_limit_ratio and self.__randomizer.random() < self.rate_limit_ratio:
+                return True
+            if self.quota:
+                now = time.monotonic()
+                while self.__recent_requests and self.__recent_requests[0] <= now - 1.0:
+                    self.__recent_requests.popleft()
+                if len(self.__recent_requests) >= self.quota:
+                    return True
+                self.__recent_requests.append(now)
+            return False
+
+    def count(self, status: int, sent: int):
+        with self.__lock:
+            self.statuses[status] += 1
+            self.bytes_sent += sent
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            return {'requests': sum(self.statuses.values()),
+                    'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                    'bytes_sent': self.bytes_sent,
+                    'tokens_delivered': self.tokens_delivered}
+
+    def reset_stats(self):
+        with self.__lock:
+            self.statuses.clear()
+            self.bytes_sent = 0
+            self.tokens_delivered = 0
+
+    def start(self) -> 'MockFranceTravailServer':
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, name='mock-ft-server', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a synthetic ROME referential on the France Travail URLs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--metiers', type=int, default=600, help="number of métiers")
+    parser.add_argument('--appellations-per-metier', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each API response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum random seconds added to the latency")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="share of requests answered by 429")
+    parser.add_argument('--quota', type=float, default=0.0, help="requests per second before answering 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After of the 429 responses")
+    args = parser.parse_args()
+    referential = MockReferential(metiers=args.metiers, appellations_per_metier=args.appellations_per_metier)
+    server = MockFranceTravailServer(referential=referential, host=args.host, port=args.port, latency=args.latency,
+                                     jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio, quota=args.quota,
+                                     retry_after=args.retry_after)
+    print(f"Serving {referential.size()}, sync against it with:\n"
+          f"  MY_API_FT_API_BASE_URL={server.base_url} MY_API_FT_OAUTH_URL={server.oauth_url} "
+          f"ENV_FT_CLIENT_ID=mock ENV_FT_CLIENT_SECRET=mock python -m db.crud.rome_crud")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,7 +1,90 @@
 CT_DEFAULT_LIMIT = 1000
 
+CT_SQLITE_MAX_KEYS_PER_QUERY = 500
+# Bytes read at once from a streamed list response
+CT_FT_STREAM_CHUNK_SIZE = 64 * 1024
+# Lifetime in seconds of a France Travail access token when the OAuth response does not give it
+CT_FT_TOKEN_DEFAULT_EXPIRES_IN = 1499
+# Default URLs of the France Travail APIs, overridden to target a mirror or the local stand-in of the benchmarks
+CT_FT_API_BASE_URL = "https://api.pole-emploi.io/partenaire/rome-metiers/v1/metiers"
+CT_FT_OAUTH_URL = "https://entreprise.pole-emploi.fr/connexion/oauth2/access_token"
+
+# Indexed label columns of each searchable table, first column weighs more in the ranking
+CT_SEARCH_TABLES = {
+    'metier': ('libelle', 'definition'),
+    'appellation': ('libelle', 'libelleCourt'),
+}
+CT_SEARCH_COLUMN_WEIGHTS = (10.0, 1.0)
+# unicode61 folds case and remove_diacritics 2 folds French accents, both on indexed text and on queries
+CT_SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+# Prefix indexes used by autocomplete queries
+CT_SEARCH_PREFIX_LENGTHS = '2 3 4'
+
+CT_SYNC_STATUS_RUNNING = 'running'
+CT_SYNC_STATUS_COMPLETED = 'completed'
+# Rows per record batch of the exports, i.e. per Parquet row group
+CT_EXPORT_BATCH_SIZE = 10000
+CT_EXPORT_FORMAT_PARQUET = 'parquet'
+CT_EXPORT_FORMAT_ARROW = 'arrow'
+CT_EXPORT_FORMAT_NDJSON = 'ndjson'
+CT_EXPORT_FORMAT_CSV = 'csv'
+CT_EXPORT_FORMATS_LIST = {
+    CT_EXPORT_FORMAT_PARQUET,
+    CT_EXPORT_FORMAT_ARROW,
+    CT_EXPORT_FORMAT_NDJSON,
+    CT_EXPORT_FORMAT_CSV,
+}
+CT_EXPORT_FILE_EXTENSIONS = {
+    CT_EXPORT_FORMAT_PARQUET: 'parquet',
+    CT_EXPORT_FORMAT_ARROW: 'arrow',
+    CT_EXPORT_FORMAT_NDJSON: 'ndjson',
+    CT_EXPORT_FORMAT_CSV: 'csv',
+}
+# File name of the export of the métiers with their relations
+CT_DENORMALIZED_METIER_NAME = 'metier_denormalized'
+
+# Rows per insert batch of the dumps, dumps are gzip NDJSON files listed with their checksums in a manifest
+CT_DUMP_BATCH_SIZE = 10000
+CT_DUMP_FORMAT_VERSION = 1
+CT_DUMP_MANIFEST_FILE = 'manifest.json'
+
+# Delay in seconds between two progress logs of the running sync jobs
+CT_SYNC_PROGRESS_LOG_INTERVAL = 30
+
+# Similarity metrics of the skill matching, profiles scored at once by one sparse product
+CT_MATCHING_METRIC_COSINE = 'cosine'
+CT_MATCHING_METRIC_JACCARD = 'jaccard'
+CT_MATCHING_METRICS_LIST = {CT_MATCHING_METRIC_COSINE, CT_MATCHING_METRIC_JACCARD}
+CT_MATCHING_BATCH_SIZE = 1024
+# Maximum number of profiles of one matching request of the API
+CT_MATCHING_MAX_PROFILES = 10000
+
+# Neighbours stored per element by the similarity index, and elements scored per sparse product
+CT_SIMILARITY_TOP_N = 20
+CT_SIMILARITY_BATCH_SIZE = 512
+# Weight of each feature in the similarity, a weighted mean of the cosine similarities of the features
+CT_SIMILARITY_FEATURE_WEIGHTS = {'competence': 0.6, 'theme': 0.2, 'domaine': 0.15, 'grandDomaine': 0.05}
+
+# Transitions of the mobility graph, from the proches and envisageables relations
+CT_MOBILITY_EDGE_PROCHE = 'proche'
+CT_MOBILITY_EDGE_ENVISAGEABLE = 'envisageable'
+CT_MOBILITY_EDGE_KINDS_LIST = [CT_MOBILITY_EDGE_PROCHE, CT_MOBILITY_EDGE_ENVISAGEABLE]
+# Maximum number of transitions of a reachability query of the API
+CT_MOBILITY_MAX_HOPS = 6
+
+# Upper bounds in seconds of the latency histogram buckets
+CT_METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Delay in seconds between two writes of the metrics file of a sync
+CT_METRICS_EXPORT_INTERVAL = 15
+CT_METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Response headers giving the number of requests left in the current quota window, the first one found is used
+CT_FT_QUOTA_REMAINING_HEADERS = ('X-RateLimit-Remaining', 'RateLimit-Remaining', 'X-RateLimit-Remaining-Second')
+
 CT_CONFIG_FILE_RELATIVE_PATH = "./server_cfg.ini"
 CT_SQLITE_FILE_RELATIVE_PATH = "./db/rome.db"
+CT_SNAPSHOT_FILE_RELATIVE_PATH = "./db/rome.snapshot"
+CT_HTTP_CACHE_FILE_RELATIVE_PATH = "./db/ft_http_cache.db"
+CT_TOKEN_CACHE_FILE_RELATIVE_PATH = "./db/ft_token_cache.json"
 
 #
 # LOGIN MESSAGES
@@ -52,7 +135,41 @@ CT_ENV_UNITEID_GENERIC_PASSWD = 'MY_API_UNITEID_GENERIC_PASSWD'
 CT_ENV_DB_ENGINE_ECHO = 'MY_API_DB_ENGINE_ECHO'
 CT_ENV_DB_ENGINE_CREATE_ALL = 'MY_API_DB_ENGINE_CREATE_ALL'
 CT_ENV_DB_DRIVER = 'MY_API_DB_ENGINE_DRIVER'
+CT_ENV_DB_BATCH_SIZE = 'MY_API_DB_BATCH_SIZE'
+CT_ENV_DB_FILE_PATH = 'MY_API_DB_FILE_PATH'
+CT_ENV_DB_JOURNAL_MODE = 'MY_API_DB_JOURNAL_MODE'
+CT_ENV_DB_SYNCHRONOUS = 'MY_API_DB_SYNCHRONOUS'
+CT_ENV_DB_CACHE_SIZE = 'MY_API_DB_CACHE_SIZE'
+CT_ENV_DB_MMAP_SIZE = 'MY_API_DB_MMAP_SIZE'
+CT_ENV_DB_BUSY_TIMEOUT = 'MY_API_DB_BUSY_TIMEOUT'
+CT_ENV_DB_READ_POOL_SIZE = 'MY_API_DB_READ_POOL_SIZE'
+CT_ENV_CACHE_MAXSIZE = 'MY_API_CACHE_MAXSIZE'
+CT_ENV_CACHE_TTL = 'MY_API_CACHE_TTL'
+CT_ENV_CACHE_GENERATION_CHECK_INTERVAL = 'MY_API_CACHE_GENERATION_CHECK_INTERVAL'
+CT_ENV_FT_POOL_SIZE = 'MY_API_FT_POOL_SIZE'
+CT_ENV_FT_TRANSPORT_RETRIES = 'MY_API_FT_TRANSPORT_RETRIES'
+CT_ENV_FT_REQUEST_TIMEOUT = 'MY_API_FT_REQUEST_TIMEOUT'
+CT_ENV_FT_MAX_IN_FLIGHT = 'MY_API_FT_MAX_IN_FLIGHT'
+CT_ENV_FT_RATE_LIMIT = 'MY_API_FT_RATE_LIMIT'
+CT_ENV_FT_RATE_LIMIT_BURST = 'MY_API_FT_RATE_LIMIT_BURST'
+CT_ENV_FT_RATE_LIMIT_MIN = 'MY_API_FT_RATE_LIMIT_MIN'
+CT_ENV_FT_RATE_LIMIT_RETRIES = 'MY_API_FT_RATE_LIMIT_RETRIES'
+CT_ENV_FT_MAX_PARALLEL_JOBS = 'MY_API_FT_MAX_PARALLEL_JOBS'
+CT_ENV_FT_HTTP_CACHE_MODE = 'MY_API_FT_HTTP_CACHE_MODE'
+CT_ENV_FT_HTTP_CACHE_TTL = 'MY_API_FT_HTTP_CACHE_TTL'
+CT_ENV_FT_TOKEN_CACHE = 'MY_API_FT_TOKEN_CACHE'
+CT_ENV_FT_TOKEN_REFRESH_MARGIN = 'MY_API_FT_TOKEN_REFRESH_MARGIN'
+CT_ENV_FT_API_BASE_URL = 'MY_API_FT_API_BASE_URL'
+CT_ENV_FT_OAUTH_URL = 'MY_API_FT_OAUTH_URL'
 
+CT_DB_JOURNAL_MODES_LIST = {'wal', 'delete', 'truncate', 'persist', 'memory', 'off'}
+CT_DB_SYNCHRONOUS_LIST = {'off', 'normal', 'full', 'extra'}
+CT_HTTP_CACHE_MODE_OFF = 'off'
+CT_HTTP_CACHE_MODE_RECORD = 'record'
+CT_HTTP_CACHE_MODE_REPLAY = 'replay'
+CT_HTTP_CACHE_MODE_TTL = 'ttl'
+CT_HTTP_CACHE_MODES_LIST = {CT_HTTP_CACHE_MODE_OFF, CT_HTTP_CACHE_MODE_RECORD, CT_HTTP_CACHE_MODE_REPLAY,
+                            CT_HTTP_CACHE_MODE_TTL}
 CT_ENV_EXECUTION_MODES_LIST = {CT_EXECUTION_MODE_PRODUCTION,
                                CT_EXECUTION_MODE_DEVELOPMENT,
                                CT_EXECUTION_MODE_TEST}
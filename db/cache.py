@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class ReadThroughCache:
+    """
+    Bounded LRU cache with time to live, loading missing keys through loader.
+    The whole cache is dropped when the data generation returned by generation_func changes,
+    generation_func being called at most once every generation_check_interval seconds
+    so that hot lookups never reach the database.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Any], maxsize: int = 4096, ttl: float = 300.0,
+                 generation_func: Callable[[], int] = None, generation_check_interval: float = 5.0):
+        """
+        :param loader: called with the key on a miss, its result is cached even when None
+        :param maxsize: maximum number of cached keys, the least recently used key is evicted first
+        :param ttl: lifetime in seconds of a cached value, 0 or less to disable expiration
+        :param generation_func: returns the current data generation, None to only rely on ttl and invalidate()
+        :param generation_check_interval: minimum delay in seconds between two generation_func calls
+        """
+        self.loader = loader
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.generation_func = generation_func
+        self.generation_check_interval = generation_check_interval
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.__values = OrderedDict()
+        self.__next_generation_check = 0.0
+        self.__lock = threading.Lock()
+
+    def __check_generation__(self, now: float):
+        if self.generation_func is None or now < self.__next_generation_check:
+            return
+        self.__next_generation_check = now + self.generation_check_interval
+        generation = self.generation_func()
+        with self.__lock:
+            if generation != self.generation:
+                if self.generation is not None:
+                    self.__values.clear()
+                    self.invalidations += 1
+                self.generation = generation
+
+    def get(self, key: Hashable) -> Any:
+        now = time.monotonic()
+        self.__check_generation__(now)
+        with self.__lock:
+            if key in self.__values:
+                value, expires_at = self.__values[key]
+                if self.ttl <= 0 or now < expires_at:
+                    self.__values.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.__values[key]
+                self.expirations += 1
+            self.misses += 1
+            invalidations, generation = self.invalidations, self.generation
+        value = self.loader(key)
+        with self.__lock:
+            if self.invalidations != invalidations or self.generation != generation:
+                # Loaded before an invalidation or a generation change, possibly stale: returned but not cached
+                return value
+            self.__values[key] = (value, now + self.ttl)
+            self.__values.move_to_end(key)
+            while len(self.__values) > self.maxsize:
+                self.__values.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self):
+        with self.__lock:
+            self.__values.clear()
+            self.invalidations += 1
+            self.__next_generation_check = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.__values),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'invalidations': self.invalidations,
+                    'generation': self.generation}
+
+
+class GenerationCachedValue:
+    """
+    Single value expensive to build, such as an in-memory index of the referential,
+    rebuilt on first use after the data generation returned by generation_func changed.
+    generation_func is called at most once every generation_check_interval seconds.
+    """
+
+    def __init__(self, builder: Callable[[], Any], generation_func: Callable[[], int] = None,
+                 generation_check_interval: float = 5.0):
+        """
+        :param builder: builds the value, concurrent callers wait for a single build
+        :param generation_func: returns the current data generation, None to only rebuild on invalidate()
+        :param generation_check_interval: minimum delay in seconds between two generation_func calls
+        """
+        self.builder = builder
+        self.generation_func = generation_func
+        self.generation_check_interval = generation_check_interval
+        self.generation = None
+        self.builds = 0
+        self.__value = None
+        self.__built = False
+        self.__next_generation_check = 0.0
+        self.__build_lock = threading.Lock()
+
+    def get(self) -> Any:
+        now = time.monotonic()
+        if self.__built and (self.generation_func is None or now < self.__next_generation_check):
+            return self.__value
+        with self.__build_lock:
+            generation = self.generation_func() if self.generation_func is not None else None
+            self.__next_generation_check = time.monotonic() + self.generation_check_interval
+            if not self.__built or generation != self.generation:
+                self.__value = self.builder()
+                self.__built = True
+                self.generation = generation
+                self.builds += 1
+            return self.__value
+
+    def invalidate(self):
+        with self.__build_lock:
+            self.__built = False
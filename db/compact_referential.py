@@ -0,0 +1,267 @@
+import json
+import mmap
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Boolean, inspect, select
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel
+
+from schemas import rome_schemas
+from server_cfg import general_logger, SNAPSHOT_FILE_PATH
+
+CT_SNAPSHOT_MAGIC = b'ROMESNP1'
+CT_SNAPSHOT_ALIGNMENT = 8
+CT_COLUMN_KIND_STR = 'str'
+CT_COLUMN_KIND_BOOL = 'bool'
+
+
+def rome_table_schemas() -> List[Any]:
+    return [value for value in vars(rome_schemas).values()
+            if isinstance(value, type) and issubclass(value, SQLModel) and hasattr(value, '__table__')]
+
+
+class StrColumn:
+    """
+    String column stored as offsets in a UTF-8 blob plus a null mask, either in memory or in a memory map
+    """
+    __slots__ = ('offsets', 'nulls', 'blob')
+
+    def __init__(self, offsets: Sequence[int], nulls: Sequence[int], blob: Any):
+        self.offsets = offsets
+        self.nulls = nulls
+        self.blob = blob
+
+    @classmethod
+    def from_values(cls, values: Sequence[Optional[str]]) -> 'StrColumn':
+        offsets = array('I', [0])
+        nulls = array('b')
+        encoded = bytearray()
+        for value in values:
+            nulls.append(1 if value is None else 0)
+            if value is not None:
+                encoded += str(value).encode('utf-8')
+            offsets.append(len(encoded))
+        return cls(offsets=offsets, nulls=nulls, blob=bytes(encoded))
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        if self.nulls[index]:
+            return None
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def buffers(self) -> List[Tuple[str, bytes]]:
+        return [('offsets', bytes(self.offsets)), ('nulls', bytes(self.nulls)), ('blob', bytes(self.blob))]
+
+
+class BoolColumn:
+    """
+    Nullable boolean column stored as int8, -1 meaning None
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values: Sequence[int]):
+        self.values = values
+
+    @classmethod
+    def from_values(cls, values: Sequence[Optional[bool]]) -> 'BoolColumn':
+        return cls(array('b', [-1 if value is None else int(bool(value)) for value in values]))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index: int) -> Optional[bool]:
+        value = self.values[index]
+        return None if value < 0 else bool(value)
+
+    def buffers(self) -> List[Tuple[str, bytes]]:
+        return [('values', bytes(self.values))]
+
+
+class CompactRecord:
+    """
+    Read-only view of one row, column values are read from the table on access
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: 'CompactTable', index: int):
+        self.table = table
+        self.index = index
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self.table.columns[name][self.index]
+        except KeyError:
+            raise AttributeError(f"Table {self.table.name} has no column '{name}'")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: column[self.index] for name, column in self.table.columns.items()}
+
+    def __repr__(self):
+        return f"CompactRecord({self.table.name}, {self.as_dict()})"
+
+
+class CompactTable:
+    """
+    Column-oriented read-only table whose rows are sorted by primary key.
+    index maps the first primary key column value to its row for single key tables,
+    and to the (start, stop) range of its rows for link tables with a composite key
+    """
+    __slots__ = ('name', 'key_columns', 'columns', 'index', 'row_count')
+
+    def __init__(self, name: str, key_columns: Sequence[str], columns: Dict[str, Any], row_count: int):
+        self.name = name
+        self.key_columns = tuple(key_columns)
+        self.columns = columns
+        self.row_count = row_count
+        self.index = self.__build_index__()
+
+    def __build_index__(self) -> Dict[str, Any]:
+        keys = self.columns[self.key_columns[0]]
+        index = {}
+        if len(self.key_columns) == 1:
+            for row in range(self.row_count):
+                index[sys.intern(keys[row])] = row
+        else:
+            for row in range(self.row_count):
+                key = sys.intern(keys[row])
+                start, _ = index.get(key, (row, row))
+                index[key] = (start, row + 1)
+        return index
+
+    def __len__(self):
+        return self.row_count
+
+    def __iter__(self) -> Iterator[CompactRecord]:
+        return (CompactRecord(self, row) for row in range(self.row_count))
+
+    def get(self, code: str) -> Optional[CompactRecord]:
+        """
+        Row of a single key table by code
+        """
+        row = self.index.get(code)
+        if row is None:
+            return None
+        if isinstance(row, tuple):
+            raise TypeError(f"Table {self.name} has a composite key, use related()")
+        return CompactRecord(self, row)
+
+    def related(self, code: str) -> List[CompactRecord]:
+        """
+        Rows of a link table whose first key column is code
+        """
+        start, stop = self.index.get(code, (0, 0))
+        return [CompactRecord(self, row) for row in range(start, stop)]
+
+
+class CompactReferential:
+    """
+    Compact in-process snapshot of every table of rome_schemas, built from the database
+    or loaded from a snapshot file that several worker processes can memory-map and share
+    """
+
+    def __init__(self, tables: Dict[str, CompactTable], snapshot_map: mmap.mmap = None):
+        self.tables = tables
+        self.__snapshot_map = snapshot_map
+
+    def __getitem__(self, table_name: str) -> CompactTable:
+        return self.tables[table_name]
+
+    @classmethod
+    def from_database(cls, engine: Engine) -> 'CompactReferential':
+        tables = {}
+        with engine.connect() as connection:
+            existing_tables = set(inspect(connection).get_table_names())
+            for schema in rome_table_schemas():
+                table = schema.__table__
+                key_columns = [column.name for column in table.primary_key.columns]
+                rows = []
+                if table.name in existing_tables:
+                    rows = connection.execute(select(table).order_by(*table.primary_key.columns)).all()
+                columns = {}
+                for position, column in enumerate(table.columns):
+                    values = [row[position] for row in rows]
+                    if isinstance(column.type, Boolean):
+                        columns[column.name] = BoolColumn.from_values(values)
+                    else:
+                        columns[column.name] = StrColumn.from_values(values)
+                tables[table.name] = CompactTable(name=table.name, key_columns=key_columns, columns=columns,
+                                                  row_count=len(rows))
+        return cls(tables)
+
+    def save(self, path: str = SNAPSHOT_FILE_PATH):
+        """
+        Write the snapshot file: magic, header length, JSON header then aligned column buffers
+        """
+        header = {'byteorder': sys.byteorder, 'tables': {}}
+        chunks = []
+        position = 0
+        for table in self.tables.values():
+            table_header = {'key_columns': table.key_columns, 'rows': table.row_count, 'columns': {}}
+            for name, column in table.columns.items():
+                kind = CT_COLUMN_KIND_BOOL if isinstance(column, BoolColumn) else CT_COLUMN_KIND_STR
+                buffers = {}
+                for buffer_name, data in column.buffers():
+                    padding = -position % CT_SNAPSHOT_ALIGNMENT
+                    chunks.append(b'\0' * padding)
+                    position += padding
+                    buffers[buffer_name] = [position, position + len(data)]
+                    chunks.append(data)
+                    position += len(data)
+                table_header['columns'][name] = {'kind': kind, 'buffers': buffers}
+            header['tables'][table.name] = table_header
+        encoded_header = json.dumps(header).encode('utf-8')
+        prefix_length = len(CT_SNAPSHOT_MAGIC) + 8 + len(encoded_header)
+        header_padding = b'\0' * (-prefix_length % CT_SNAPSHOT_ALIGNMENT)
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(CT_SNAPSHOT_MAGIC)
+            snapshot_file.write(len(encoded_header + header_padding).to_bytes(8, 'little'))
+            snapshot_file.write(encoded_header + header_padding)
+            for chunk in chunks:
+                snapshot_file.write(chunk)
+
+    @classmethod
+    def load(cls, path: str = SNAPSHOT_FILE_PATH) -> 'CompactReferential':
+        """
+        Memory-map a snapshot file, column values are decoded on access from the shared pages
+        """
+        with open(path, 'rb') as snapshot_file:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(snapshot_map)
+        if bytes(view[:len(CT_SNAPSHOT_MAGIC)]) != CT_SNAPSHOT_MAGIC:
+            raise ValueError(f"File {path} is not a ROME snapshot")
+        header_start = len(CT_SNAPSHOT_MAGIC) + 8
+        header_length = int.from_bytes(view[len(CT_SNAPSHOT_MAGIC):header_start], 'little')
+        header = json.loads(bytes(view[header_start:header_start + header_length]).rstrip(b'\0'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"Snapshot {path} was written on a {header['byteorder']} endian machine")
+        data = view[header_start + header_length:]
+
+        def buffer(bounds: List[int]) -> memoryview:
+            return data[bounds[0]:bounds[1]]
+
+        tables = {}
+        for table_name, table_header in header['tables'].items():
+            columns = {}
+            for name, column_header in table_header['columns'].items():
+                buffers = column_header['buffers']
+                if column_header['kind'] == CT_COLUMN_KIND_BOOL:
+                    columns[name] = BoolColumn(buffer(buffers['values']).cast('b'))
+                else:
+                    columns[name] = StrColumn(offsets=buffer(buffers['offsets']).cast('I'),
+                                              nulls=buffer(buffers['nulls']).cast('b'),
+                                              blob=buffer(buffers['blob']))
+            tables[table_name] = CompactTable(name=table_name, key_columns=table_header['key_columns'],
+                                              columns=columns, row_count=table_header['rows'])
+        return cls(tables, snapshot_map=snapshot_map)
+
+
+if __name__ == '__main__':
+    from db.data_access import engine
+
+    referential = CompactReferential.from_database(engine)
+    referential.save(SNAPSHOT_FILE_PATH)
+    general_logger.info(f"Snapshot of {len(referential.tables)} tables written in {SNAPSHOT_FILE_PATH}")
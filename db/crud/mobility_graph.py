@@ -0,0 +1,294 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from constants import CT_MOBILITY_EDGE_ENVISAGEABLE, CT_MOBILITY_EDGE_KINDS_LIST, CT_MOBILITY_EDGE_PROCHE
+from db.cache import GenerationCachedValue
+from db.crud.sync_state import current_generation
+from db.data_access import read_engine
+from schemas import rome_schemas
+from schemas.core_schemas import OurBaseModel
+from server_cfg import general_logger, CACHE_GENERATION_CHECK_INTERVAL
+
+
+class MobilityStep(OurBaseModel):
+    """
+    Element reached after hops transitions
+    """
+    code: str
+    libelle: str
+    hops: int
+
+
+def metier_grand_domaines() -> Any:
+    metier_domaine = rome_schemas.MetierDomaineLink.__table__
+    domaine_grand_domaine = rome_schemas.DomaineGrandDomaineLink.__table__
+    return (select(metier_domaine.c.codeMetier, domaine_grand_domaine.c.codeGrandDomaine)
+            .join(domaine_grand_domaine, domaine_grand_domaine.c.codeDomaine == metier_domaine.c.codeDomaine))
+
+
+def appellation_grand_domaines() -> Any:
+    metier_appellation = rome_schemas.MetierAppellationLink.__table__
+    metier_domaine = rome_schemas.MetierDomaineLink.__table__
+    domaine_grand_domaine = rome_schemas.DomaineGrandDomaineLink.__table__
+    return (select(metier_appellation.c.codeAppellation, domaine_grand_domaine.c.codeGrandDomaine)
+            .join(metier_domaine, metier_domaine.c.codeMetier == metier_appellation.c.codeMetier)
+            .join(domaine_grand_domaine, domaine_grand_domaine.c.codeDomaine == metier_domaine.c.codeDomaine))
+
+
+@dataclass(frozen=True)
+class MobilityKind:
+    """
+    Elements linked by the mobility graph
+    :param schema: table of the elements, the nodes
+    :param edges: (link table, source column, target column) of each transition kind of CT_MOBILITY_EDGE_KINDS_LIST
+    :param grand_domaines: statement selecting (element code, grand domaine code) pairs
+    """
+    schema: Any
+    edges: Dict[str, Tuple[Any, str, str]]
+    grand_domaines: Callable[[], Any]
+
+
+MOBILITY_KINDS = {
+    'metier': MobilityKind(rome_schemas.Metier, {
+        CT_MOBILITY_EDGE_PROCHE: (rome_schemas.MetierProcheLink, 'codeMetier', 'codeMetierProche'),
+        CT_MOBILITY_EDGE_ENVISAGEABLE: (rome_schemas.MetierEnvisageableLink, 'codeMetier', 'codeMetierEnvisageable'),
+    }, metier_grand_domaines),
+    'appellation': MobilityKind(rome_schemas.Appellation, {
+        CT_MOBILITY_EDGE_PROCHE: (rome_schemas.AppellationProcheLink, 'codeAppellation', 'codeAppellationProche'),
+        CT_MOBILITY_EDGE_ENVISAGEABLE: (rome_schemas.AppellationEnvisageableLink, 'codeAppellation',
+                                        'codeAppellationEnvisageable'),
+    }, appellation_grand_domaines),
+}
+
+
+class MobilityGraph:
+    """
+    Directed graph of the transitions between elements, in CSR form: the targets of node i are
+    indices[indptr[i]:indptr[i + 1]], edge_kinds holds the bits of the transition kinds of each edge.
+    Searches expand a whole BFS level at once with array operations, without SQL nor Python loops over edges.
+    """
+
+    def __init__(self, codes: Sequence[str], labels: Sequence[str], edges: Dict[str, Sequence[Tuple[str, str]]],
+                 transition_ecologique: Sequence[Optional[bool]], transition_numerique: Sequence[Optional[bool]],
+                 grand_domaines: Dict[str, str]):
+        """
+        :param codes: codes of the nodes
+        :param labels: labels of the nodes, in the order of codes
+        :param edges: (source code, target code) pairs by transition kind, pairs of unknown codes are ignored
+        :param transition_ecologique: flags of the nodes, in the order of codes, None counts as False
+        :param transition_numerique: flags of the nodes, in the order of codes, None counts as False
+        :param grand_domaines: grand domaine code by node code
+        """
+        self.codes = list(codes)
+        self.labels = list(labels)
+        self.index = {code: position for position, code in enumerate(self.codes)}
+        node_count = len(self.codes)
+        sources, targets, bits = [], [], []
+        for bit, edge_kind in enumerate(CT_MOBILITY_EDGE_KINDS_LIST):
+            for source, target in edges.get(edge_kind, ()):
+                if source in self.index and target in self.index and source != target:
+                    sources.append(self.index[source])
+                    targets.append(self.index[target])
+                    bits.append(1 << bit)
+        # One edge per (source, target), carrying the bits of all its transition kinds
+        keys = np.asarray(sources, dtype=np.int64) * node_count + np.asarray(targets, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        keys, bits = keys[order], np.asarray(bits, dtype=np.uint8)[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        self.edge_kinds = np.bitwise_or.reduceat(bits, starts) if len(bits) else bits
+        self.indices = (unique_keys % max(node_count, 1)).astype(np.int32)
+        self.indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(unique_keys // max(node_count, 1), minlength=node_count), out=self.indptr[1:])
+        # Same edges by target, followed backwards by the path searches
+        edge_sources = (unique_keys // max(node_count, 1)).astype(np.int32)
+        by_target = np.argsort(self.indices, kind='stable')
+        self.reverse_indices = edge_sources[by_target]
+        self.reverse_edge_kinds = self.edge_kinds[by_target]
+        self.reverse_indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=node_count), out=self.reverse_indptr[1:])
+        self.transition_ecologique = np.asarray([bool(flag) for flag in transition_ecologique], dtype=bool)
+        self.transition_numerique = np.asarray([bool(flag) for flag in transition_numerique], dtype=bool)
+        grand_domaine_codes = sorted(set(grand_domaines.values()))
+        self.grand_domaine_index = {code: position for position, code in enumerate(grand_domaine_codes)}
+        # -1 for the nodes without grand domaine
+        self.grand_domaines = np.asarray([self.grand_domaine_index.get(grand_domaines.get(code), -1)
+                                          for code in self.codes], dtype=np.int32)
+
+    @classmethod
+    def from_engine(cls, engine: Engine, kind: str) -> 'MobilityGraph':
+        mobility_kind = MOBILITY_KINDS[kind]
+        element = mobility_kind.schema.__table__
+        with engine.connect() as connection:
+            nodes = connection.execute(select(element.c.code, element.c.libelle, element.c.transitionEcologique,
+                                              element.c.transitionNumerique).order_by(element.c.code)).all()
+            edges = {}
+            for edge_kind, (link, source_column, target_column) in mobility_kind.edges.items():
+                link_table = link.__table__
+                edges[edge_kind] = connection.execute(select(link_table.c[source_column],
+                                                             link_table.c[target_column])).all()
+            grand_domaines = dict(connection.execute(mobility_kind.grand_domaines()).all())
+        graph = cls(codes=[node[0] for node in nodes], labels=[node[1] for node in nodes], edges=edges,
+                    transition_ecologique=[node[2] for node in nodes], transition_numerique=[node[3] for node in nodes],
+                    grand_domaines=grand_domaines)
+        general_logger.info(f"Mobility graph of {kind} built: {len(graph.codes)} nodes, {len(graph.indices)} edges")
+        return graph
+
+    def position(self, code: str) -> int:
+        position = self.index.get(code)
+        if position is None:
+            raise ValueError(f"Unknown code '{code}' in the mobility graph")
+        return position
+
+    def edge_mask(self, edge_kinds: Sequence[str] = None) -> int:
+        """
+        :param edge_kinds: transition kinds to follow, all of them when None
+        """
+        if edge_kinds is None:
+            edge_kinds = CT_MOBILITY_EDGE_KINDS_LIST
+        mask = 0
+        for edge_kind in edge_kinds:
+            if edge_kind not in CT_MOBILITY_EDGE_KINDS_LIST:
+                raise ValueError(f"Unknown transition kind '{edge_kind}', use one of {CT_MOBILITY_EDGE_KINDS_LIST}")
+            mask |= 1 << CT_MOBILITY_EDGE_KINDS_LIST.index(edge_kind)
+        return mask
+
+    def node_filter(self, transition_ecologique: bool = None, transition_numerique: bool = None,
+                    grand_domaine: str = None) -> Optional[np.ndarray]:
+        """
+        Nodes a path may go through, None when every node may
+        :param grand_domaine: code of the grand domaine of the nodes, no node may when it is unknown
+        """
+        allowed = None
+        if transition_ecologique is not None:
+            allowed = self.transition_ecologique == transition_ecologique
+        if transition_numerique is not None:
+            nodes = self.transition_numerique == transition_numerique
+            allowed = nodes if allowed is None else allowed & nodes
+        if grand_domaine is not None:
+            if grand_domaine in self.grand_domaine_index:
+                nodes = self.grand_domaines == self.grand_domaine_index[grand_domaine]
+            else:
+                nodes = np.zeros(len(self.codes), dtype=bool)
+            allowed = nodes if allowed is None else allowed & nodes
+        return allowed
+
+    def __expand__(self, frontier: np.ndarray, edge_mask: int, allowed: Optional[np.ndarray], visited: np.ndarray,
+                   backwards: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Follow every edge leaving the frontier at once
+        :param backwards: follow the edges from their target to their source
+        :return: sources and targets of the edges reaching unvisited allowed nodes, one edge per target
+        """
+        if backwards:
+            indptr, indices, edge_kinds = self.reverse_indptr, self.reverse_indices, self.reverse_edge_kinds
+        else:
+            indptr, indices, edge_kinds = self.indptr, self.indices, self.edge_kinds
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return frontier[:0], frontier[:0]
+        # Positions of the edges of all frontier nodes, concatenated
+        edge_positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        targets = indices[edge_positions]
+        sources = np.repeat(frontier, counts)
+        kept = ~visited[targets]
+        if edge_mask != (1 << len(CT_MOBILITY_EDGE_KINDS_LIST)) - 1:
+            kept &= (edge_kinds[edge_positions] & edge_mask) != 0
+        if allowed is not None:
+            kept &= allowed[targets]
+        targets, first_edges = np.unique(targets[kept], return_index=True)
+        sources = sources[kept][first_edges]
+        visited[targets] = True
+        return sources, targets
+
+    def reachable(self, code: str, max_hops: int, edge_kinds: Sequence[str] = None,
+                  allowed: np.ndarray = None) -> List[Tuple[int, int]]:
+        """
+        Nodes reachable from code within max_hops transitions, going only through allowed nodes
+        :param allowed: nodes a path may go through, as returned by node_filter
+        :return: (node position, number of transitions) pairs by increasing transitions then code
+        """
+        edge_mask = self.edge_mask(edge_kinds)
+        visited = np.zeros(len(self.codes), dtype=bool)
+        frontier = np.asarray([self.position(code)], dtype=np.int32)
+        visited[frontier] = True
+        reached = []
+        for hops in range(1, max_hops + 1):
+            _, frontier = self.__expand__(frontier, edge_mask, allowed, visited)
+            if len(frontier) == 0:
+                break
+            reached.extend((position, hops) for position in frontier.tolist())
+        return reached
+
+    def shortest_path(self, source: str, target: str, edge_kinds: Sequence[str] = None,
+                      allowed: np.ndarray = None, max_hops: int = None) -> Optional[List[int]]:
+        """
+        Path with the fewest transitions from source to target, whose intermediate nodes are all allowed.
+        Bidirectional BFS: the smaller frontier of the searches from source and to target is expanded
+        by a whole level, until a node is reached by both.
+        :param allowed: nodes a path may go through, as returned by node_filter
+        :param max_hops: longest path searched, unbounded when None
+        :return: node positions from source to target, None when there is no such path
+        """
+        edge_mask = self.edge_mask(edge_kinds)
+        source_position, target_position = self.position(source), self.position(target)
+        if source_position == target_position:
+            return [source_position]
+        if allowed is not None:
+            allowed = allowed.copy()
+            allowed[[source_position, target_position]] = True
+        node_count = len(self.codes)
+        # Index 0 searches from the source along the edges, index 1 from the target against them
+        frontiers = [np.asarray([source_position], dtype=np.int32), np.asarray([target_position], dtype=np.int32)]
+        visited = [np.zeros(node_count, dtype=bool), np.zeros(node_count, dtype=bool)]
+        parents = [np.full(node_count, -1, dtype=np.int32), np.full(node_count, -1, dtype=np.int32)]
+        depths = [np.full(node_count, -1, dtype=np.int32), np.full(node_count, -1, dtype=np.int32)]
+        for side, position in enumerate((source_position, target_position)):
+            visited[side][position] = True
+            depths[side][position] = 0
+        levels = [0, 0]
+        while max_hops is None or levels[0] + levels[1] < max_hops:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            sources, frontier = self.__expand__(frontiers[side], edge_mask, allowed, visited[side],
+                                                backwards=side == 1)
+            if len(frontier) == 0:
+                return None
+            levels[side] += 1
+            frontiers[side] = frontier
+            parents[side][frontier] = sources
+            depths[side][frontier] = levels[side]
+            met = frontier[depths[1 - side][frontier] >= 0]
+            if len(met):
+                # Fewest transitions through the meeting node, the first one on ties
+                middle = int(met[np.argmin(depths[1 - side][met])])
+                path = [middle]
+                while path[-1] != source_position:
+                    path.append(int(parents[0][path[-1]]))
+                path.reverse()
+                while path[-1] != target_position:
+                    path.append(int(parents[1][path[-1]]))
+                return path
+        return None
+
+    def steps(self, positions: Sequence[int], hops: Sequence[int]) -> List[MobilityStep]:
+        return [MobilityStep(code=self.codes[position], libelle=self.labels[position], hops=hop)
+                for position, hop in zip(positions, hops)]
+
+
+mobility_graphs_cache = GenerationCachedValue(
+    builder=lambda: {kind: MobilityGraph.from_engine(read_engine, kind) for kind in MOBILITY_KINDS},
+    generation_func=lambda: current_generation(read_engine),
+    generation_check_interval=CACHE_GENERATION_CHECK_INTERVAL)
+
+
+def mobility_graph(kind: str) -> MobilityGraph:
+    """
+    Graph of the stored relations, rebuilt on first use after a sync changed the data generation
+    :param kind: key of MOBILITY_KINDS
+    """
+    return mobility_graphs_cache.get()[kind]
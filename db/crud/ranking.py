@@ -0,0 +1,23 @@
+from typing import Tuple
+
+import numpy as np
+
+
+def top_k_columns(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Columns of the k best scores of each row, by decreasing score then increasing column,
+    also at the cut: among equal scores the first columns are kept, so that results never depend on the batch
+    :param k: number of columns to keep, at most the number of columns of scores
+    :return: row x k matrices of the columns and of their scores
+    """
+    if k < scores.shape[1]:
+        kth_scores = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        above = scores > kth_scores[:, None]
+        tied = scores == kth_scores[:, None]
+        kept = above | (tied & (np.cumsum(tied, axis=1) <= (k - above.sum(axis=1))[:, None]))
+        columns = np.nonzero(kept)[1].reshape(scores.shape[0], k)
+    else:
+        columns = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    values = np.take_along_axis(scores, columns, axis=1)
+    order = np.lexsort((columns, -values), axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(values, order, axis=1)
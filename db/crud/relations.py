@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List
+
+from sqlmodel import Session, delete
+
+from constants import CT_SQLITE_MAX_KEYS_PER_QUERY
+from db.crud.upsert import insert_or_ignore, upsert_batch
+from schemas import rome_schemas
+
+
+@dataclass(frozen=True)
+class Relation:
+    """
+    Relation of a *Read payload stored in a link table.
+    The foreign keys of the link tables are not enforced, the related element may not be downloaded yet.
+    :param field: key of the *Read payload holding the related element(s)
+    :param link: link table model
+    :param source_column: link column holding the code of the downloaded element
+    :param target_column: link column holding the code of the related element
+    :param target_schema: table where the related elements are stored from the nested payload,
+        None when they are downloaded by their own job and must not be overwritten by partial nested data
+    """
+    field: str
+    link: Any
+    source_column: str
+    target_column: str
+    target_schema: Any = None
+
+
+RELATIONS = {
+    rome_schemas.DomaineMetiers: [
+        Relation('grandDomaine', rome_schemas.DomaineGrandDomaineLink, 'codeDomaine', 'codeGrandDomaine'),
+    ],
+    rome_schemas.GrandDomaineMetiers: [
+        Relation('domaineProfessionnels', rome_schemas.DomaineGrandDomaineLink, 'codeGrandDomaine', 'codeDomaine'),
+    ],
+    rome_schemas.Metier: [
+        Relation('domaineProfessionnel', rome_schemas.MetierDomaineLink, 'codeMetier', 'codeDomaine'),
+        Relation('appellations', rome_schemas.MetierAppellationLink, 'codeMetier', 'codeAppellation'),
+        Relation('themes', rome_schemas.MetierThemeLink, 'codeMetier', 'codeTheme'),
+        Relation('competencesMobilisees', rome_schemas.MetierCompetenceLink, 'codeMetier', 'codeCompetence',
+                 rome_schemas.Competence),
+        Relation('divisionsNaf', rome_schemas.MetierDivisionNafLink, 'codeMetier', 'codeDivisionNaf',
+                 rome_schemas.DivisionNaf),
+        Relation('formacodes', rome_schemas.MetierFormacodeLink, 'codeMetier', 'codeFormacode',
+                 rome_schemas.Formacode),
+        Relation('contextesTravail', rome_schemas.MetierContexteTravailLink, 'codeMetier', 'codeContexteTravail',
+                 rome_schemas.ContexteTravail),
+        Relation('metiersProches', rome_schemas.MetierProcheLink, 'codeMetier', 'codeMetierProche'),
+        Relation('metiersEnvisageables', rome_schemas.MetierEnvisageableLink, 'codeMetier', 'codeMetierEnvisageable'),
+        Relation('appellationsProches', rome_schemas.MetierAppellationProcheLink, 'codeMetier',
+                 'codeAppellationProche'),
+        Relation('appellationsEnvisageables', rome_schemas.MetierAppellationEnvisageableLink, 'codeMetier',
+                 'codeAppellationEnvisageable'),
+    ],
+    rome_schemas.Appellation: [
+        Relation('metier', rome_schemas.MetierAppellationLink, 'codeAppellation', 'codeMetier'),
+        Relation('competencesCles', rome_schemas.AppellationCompetenceLink, 'codeAppellation', 'codeCompetence',
+                 rome_schemas.Competence),
+        Relation('metiersProches', rome_schemas.AppellationMetierProcheLink, 'codeAppellation', 'codeMetierProche'),
+        Relation('metiersEnvisageables', rome_schemas.AppellationMetierEnvisageableLink, 'codeAppellation',
+                 'codeMetierEnvisageable'),
+        Relation('appellationsProches', rome_schemas.AppellationProcheLink, 'codeAppellation',
+                 'codeAppellationProche'),
+        Relation('appellationsEnvisageables', rome_schemas.AppellationEnvisageableLink, 'codeAppellation',
+                 'codeAppellationEnvisageable'),
+    ],
+}
+
+
+def related_elements(element: Dict[str, Any], field: str) -> List[Dict[str, Any]]:
+    related = element.get(field)
+    if related is None:
+        return []
+    return related if isinstance(related, list) else [related]
+
+
+def delete_links(session: Session, relation: Relation, codes: List[str]):
+    source_column = relation.link.__table__.c[relation.source_column]
+    for start in range(0, len(codes), CT_SQLITE_MAX_KEYS_PER_QUERY):
+        chunk = codes[start:start + CT_SQLITE_MAX_KEYS_PER_QUERY]
+        session.exec(delete(relation.link).where(source_column.in_(chunk)))
+
+
+def write_relations(session: Session, schema: Any, elements: Dict[str, Dict[str, Any]]):
+    """
+    Replace the links of downloaded elements in the transaction of their batch, without committing
+    :param schema: table of the downloaded elements, selects the relations to store
+    :param elements: validated *Read payloads by code, as built by schemas.row_adapters
+    """
+    if not elements:
+        return
+    codes = list(elements)
+    for relation in RELATIONS.get(schema, []):
+        delete_links(session=session, relation=relation, codes=codes)
+        link_rows = []
+        target_rows = []
+        for code, element in elements.items():
+            for related in related_elements(element, relation.field):
+                link_rows.append({relation.source_column: code, relation.target_column: related['code']})
+                if relation.target_schema is not None:
+                    target_rows.append({column: related.get(column) for column in relation.target_schema.model_fields})
+        insert_or_ignore(session=session, table=relation.link.__table__, rows=link_rows)
+        if target_rows:
+            upsert_batch(session=session, table=relation.target_schema.__table__, rows=target_rows,
+                         update_existing=False)
+
+
+def delete_relations(session: Session, schema: Any, codes: Iterable[str]):
+    """
+    Delete the links of elements removed from the referential, without committing
+    """
+    codes = list(codes)
+    for relation in RELATIONS.get(schema, []):
+        delete_links(session=session, relation=relation, codes=codes)
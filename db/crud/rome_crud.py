@@ -1,58 +1,213 @@
-import time
-from typing import Callable, Any
+import argparse
+import functools
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Dict, Iterable, Iterator, List, Tuple
 
 import sqlmodel
-from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session
-from db.data_access import get_session, create_db_and_tables
+from sqlmodel import Session, select
+from db.data_access import session_scope, create_db_and_tables
+from db.crud.upsert import upsert_rows, UpsertReport
+from db.crud.sync_scheduler import JobProgress, JobScheduler, SyncJob
+from db.crud.relations import RELATIONS, write_relations, delete_relations
+from db.crud.sync_state import start_job, finish_job, is_job_completed, fetched_codes, record_codes, \
+    list_entry_hash, previous_hashes, delete_codes
+from apis.http_cache import HttpResponseCache
+from apis.metrics import Counter, periodic_export
 from apis.rome_apis import FranceTravailClient
 from schemas import rome_schemas
-from server_cfg import general_logger
+from schemas.row_adapters import row_adapter
+from constants import CT_HTTP_CACHE_MODES_LIST
+from server_cfg import general_logger, FT_MAX_IN_FLIGHT, FT_POOL_SIZE, DB_BATCH_SIZE, FT_HTTP_CACHE_MODE, \
+    FT_HTTP_CACHE_TTL, HTTP_CACHE_FILE_PATH, FT_MAX_PARALLEL_JOBS
 
 
-def download_one(session: Session, name: str, get_func: Callable, schema: Any):
-    time.sleep(2)
-    elements_list = get_func()
-    general_logger.info(f"Got list of {name} with {len(elements_list.root)} elements")
-    for index, element in enumerate(elements_list):
-        time.sleep(0.5)
-        try:
-            ft_element = get_func(code=element.code)
-        except OverflowError:
-            general_logger.warning("Exceed requests quota, wait for 2 seconds...")
-            time.sleep(2)
-            ft_element = get_func(code=element.code)
-        db_element = schema(**ft_element.model_dump())
-        session.add(db_element)
+sync_rows = Counter('sync_job_rows_total', "Rows of the sync jobs by result: inserted, updated, skipped or deleted",
+                    ('job', 'result'))
+
+
+def fetch_details(get_func: Callable, codes: Iterable[str],
+                  max_in_flight: int = FT_MAX_IN_FLIGHT) -> Iterator[Tuple[str, Any]]:
+    """
+    Fetch the detail of each code with at most max_in_flight requests running at once,
+    quota pacing and 429 retries being handled by the rate limiter of the client
+    :param get_func: client function called as get_func(code=...)
+    :param codes: codes to fetch, consumed lazily
+    :param max_in_flight: maximum number of concurrent requests, 1 means serial fetching
+    :return: iterator of (code, detail) in the same order as codes
+    """
+    max_in_flight = max(1, max_in_flight)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='ft-detail') as executor:
         try:
-            session.commit()
-            general_logger.info(f"Element {name} with code={element.code} downloaded in database")
-        except IntegrityError:
-            general_logger.warning(f"Download element {name} with code={element.code} caused Integrity Error, element skipped")
-            session.rollback()
-    else:
-        general_logger.info(f"List of {name} with {len(elements_list.root)} elements finished")
-
-
-def download_all(session: Session):
-    ft_client = FranceTravailClient(load_credentials_from_env=True)
-    jobs = [
-        ('Domaines', ft_client.get_domaines, rome_schemas.DomaineMetiers),
-        ('GrandsDomaines', ft_client.get_grands_domaines, rome_schemas.GrandDomaineMetiers),
-        ('Thèmes', ft_client.get_themes, rome_schemas.Theme),
-        ('Métiers', ft_client.get_metiers, rome_schemas.Metier),
-        ('Appellations', ft_client.get_appellations, rome_schemas.Appellation),
-    ]
-    for (name, get_func, schema) in jobs:
-        general_logger.info(f"Start job to download {name}")
-        download_one(session, name, get_func, schema)
-        general_logger.info(f"End of job for {name}")
+            for code in codes:
+                in_flight.append((code, executor.submit(get_func, code=code)))
+                if len(in_flight) >= max_in_flight:
+                    code, future = in_flight.popleft()
+                    yield code, future.result()
+            while in_flight:
+                code, future = in_flight.popleft()
+                yield code, future.result()
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+def download_one(session: Session, name: str, get_func: Callable, schema: Any, read_schema: Any,
+                 max_in_flight: int = FT_MAX_IN_FLIGHT, batch_size: int = DB_BATCH_SIZE, resume: bool = False,
+                 delta: bool = False, progress: JobProgress = None) -> UpsertReport:
+    """
+    Download the list of a ROME entity then the detail of its elements into the table of schema,
+    the detail of an element being only requested when its list entry misses a column or a relation
+    :param read_schema: *Read model of the list entries and details, each payload is validated once against it
+    :param resume: skip the elements already downloaded by an interrupted run of the job
+    :param delta: only fetch new or changed elements of the list and delete the elements that disappeared
+    :param progress: updated with the number of elements to write and written so far
+    """
+    job_state = start_job(session=session, job=name, resume=resume)
+    adapter = row_adapter(read_schema=read_schema, table_schema=schema)
+    # Entries of the list holding every column and relation stored for the job are written from the list,
+    # only the other ones need a detail request
+    needed_fields = set(schema.model_fields) | {relation.field for relation in RELATIONS.get(schema, [])}
+    list_payloads = {}
+    hashes = {}
+    for item in get_func(stream=True, raw=True):
+        payload = adapter.validate_python(item)
+        hashes[payload['code']] = list_entry_hash(payload)
+        if needed_fields <= payload.keys():
+            list_payloads[payload['code']] = payload
+    general_logger.info(f"Got list of {name} with {len(hashes)} elements, {len(list_payloads)} of them complete")
+    skip_codes = fetched_codes(session=session, job_state=job_state, schema=schema) if resume else set()
+    if skip_codes:
+        general_logger.info(f"Resume {name}: skip {len(skip_codes)} elements already downloaded")
+    report = UpsertReport()
+    if delta:
+        known_hashes = previous_hashes(session=session, job=name)
+        stored_codes = set(session.exec(select(schema.code)).all())
+        unchanged_codes = {code for code, list_hash in hashes.items()
+                           if code in stored_codes and known_hashes.get(code) == list_hash}
+        general_logger.info(f"Delta {name}: {len(hashes) - len(unchanged_codes)} new or changed elements")
+        skip_codes |= unchanged_codes
+        report.skipped += len(unchanged_codes)
+    detail_codes = (code for code in hashes if code not in skip_codes and code not in list_payloads)
+    if progress is None:
+        progress = JobProgress(name)
+    progress.start(total=sum(1 for code in hashes if code not in skip_codes))
+
+    # Downloaded elements waiting for their batch to be written, to store their relations along
+    pending_elements = {}
+
+    def get_raw_detail(code: str) -> bytes:
+        return get_func(code=code, raw=True)
+
+    def rows():
+        for code, payload in list_payloads.items():
+            if code not in skip_codes:
+                pending_elements[code] = payload
+                progress.advance()
+                yield adapter.row(payload)
+        for code, content in fetch_details(get_func=get_raw_detail, codes=detail_codes, max_in_flight=max_in_flight):
+            payload = adapter.validate_json(content)
+            pending_elements[code] = payload
+            progress.advance()
+            yield adapter.row(payload)
+
+    def checkpoint(batch_session: Session, batch: List[dict]):
+        batch_codes = [row['code'] for row in batch]
+        write_relations(session=batch_session, schema=schema,
+                        elements={code: pending_elements.pop(code) for code in dict.fromkeys(batch_codes)})
+        record_codes(session=batch_session, job=name, codes=batch_codes, hashes=hashes)
+
+    report += upsert_rows(session=session, schema=schema, rows=rows(), batch_size=batch_size, on_batch=checkpoint)
+    if delta:
+        vanished_codes = stored_codes - hashes.keys()
+        delete_relations(session=session, schema=schema, codes=vanished_codes)
+        report.deleted += delete_codes(session=session, job=name, schema=schema, codes=vanished_codes)
+    finish_job(session=session, job=name)
+    general_logger.info(f"List of {name} with {len(hashes)} elements finished: {report}")
+    return report
+
+
+def download_job(name: str, get_func: Callable, schema: Any, read_schema: Any, progress: JobProgress,
+                 max_in_flight: int = FT_MAX_IN_FLIGHT, batch_size: int = DB_BATCH_SIZE, resume: bool = False,
+                 delta: bool = False) -> UpsertReport:
+    """
+    Run download_one in its own session, jobs running in parallel must not share a session
+    """
+    with session_scope() as session:
+        if resume and is_job_completed(session=session, job=name):
+            general_logger.info(f"Job to download {name} already completed, skipped")
+            return UpsertReport()
+        report = download_one(session, name, get_func, schema, read_schema, max_in_flight=max_in_flight,
+                              batch_size=batch_size, resume=resume, delta=delta, progress=progress)
+    for result in ('inserted', 'updated', 'skipped', 'deleted'):
+        sync_rows.inc(getattr(report, result), job=name, result=result)
+    return report
+
+
+def download_all(max_in_flight: int = FT_MAX_IN_FLIGHT, batch_size: int = DB_BATCH_SIZE, resume: bool = False,
+                 delta: bool = False, http_cache_mode: str = FT_HTTP_CACHE_MODE,
+                 max_parallel_jobs: int = FT_MAX_PARALLEL_JOBS,
+                 ft_client: FranceTravailClient = None) -> Dict[str, UpsertReport]:
+    """
+    Download every ROME entity, one job per entity. Jobs whose dependencies are completed run in parallel
+    and share the client, hence its rate limiter and quota budget.
+    :param http_cache_mode: mode of the on-disk response cache, replay runs a whole sync offline from a recorded one
+    :param max_parallel_jobs: maximum number of jobs running at once, 1 runs them one after another
+    :param ft_client: client to use, left open, instead of one built from the environment credentials
+        (http_cache_mode is then ignored in favour of the cache of the client)
+    :return: report of each job
+    """
+    if ft_client is None:
+        http_cache = HttpResponseCache(path=HTTP_CACHE_FILE_PATH, mode=http_cache_mode, ttl=FT_HTTP_CACHE_TTL)
+        pool_size = max(FT_POOL_SIZE, max_in_flight * max(1, max_parallel_jobs))
+        client_scope = FranceTravailClient(load_credentials_from_env=True, pool_size=pool_size, http_cache=http_cache)
     else:
+        http_cache = ft_client.http_cache
+        client_scope = nullcontext(ft_client)
+    with client_scope as ft_client:
+        # (name, client function, table, *Read model, jobs to complete first)
+        jobs = [
+            ('GrandsDomaines', ft_client.get_grands_domaines, rome_schemas.GrandDomaineMetiers,
+             rome_schemas.GrandDomaineMetiersRead, ()),
+            ('Domaines', ft_client.get_domaines, rome_schemas.DomaineMetiers, rome_schemas.DomaineMetiersRead,
+             ('GrandsDomaines',)),
+            ('Thèmes', ft_client.get_themes, rome_schemas.Theme, rome_schemas.ThemeRead, ()),
+            ('Métiers', ft_client.get_metiers, rome_schemas.Metier, rome_schemas.MetierRead, ('Domaines',)),
+            ('Appellations', ft_client.get_appellations, rome_schemas.Appellation, rome_schemas.AppellationRead,
+             ('Métiers',)),
+        ]
+        scheduler = JobScheduler(
+            jobs=[SyncJob(name=name,
+                          run=functools.partial(download_job, name, get_func, schema, read_schema,
+                                                max_in_flight=max_in_flight, batch_size=batch_size, resume=resume,
+                                                delta=delta),
+                          depends_on=depends_on)
+                  for (name, get_func, schema, read_schema, depends_on) in jobs],
+            max_parallel_jobs=max_parallel_jobs)
+        reports = scheduler.run()
         general_logger.info(f"All of the {len(jobs)} jobs are finished")
-
+        if http_cache.enabled:
+            general_logger.info(f"HTTP cache {http_cache.stats()}")
+    return reports
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Download the ROME v4 referential from France Travail APIs")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip completed jobs and elements already downloaded by an interrupted run")
+    parser.add_argument('--delta', action='store_true',
+                        help="only download new or changed elements and delete the ones removed from the referential")
+    parser.add_argument('--http-cache', choices=sorted(CT_HTTP_CACHE_MODES_LIST), default=FT_HTTP_CACHE_MODE,
+                        help="on-disk cache of API responses: record a sync, replay it without network, "
+                             "or reuse responses younger than the configured TTL")
+    parser.add_argument('--parallel-jobs', type=int, default=FT_MAX_PARALLEL_JOBS,
+                        help="maximum number of independent jobs running at once")
+    parser.add_argument('--metrics-file',
+                        help="write the API and sync metrics in Prometheus text format to this file during the run")
+    args = parser.parse_args()
     create_db_and_tables()
-    session = get_session()
-    download_all(session)
+    with periodic_export(args.metrics_file) if args.metrics_file else nullcontext():
+        download_all(resume=args.resume, delta=args.delta, http_cache_mode=args.http_cache,
+                     max_parallel_jobs=args.parallel_jobs)
@@ -0,0 +1,199 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List
+
+from sqlalchemy import DateTime, Table, create_engine, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from constants import CT_DUMP_BATCH_SIZE, CT_DUMP_FORMAT_VERSION, CT_DUMP_MANIFEST_FILE
+from db.compact_referential import rome_table_schemas
+from db.crud.rome_search import create_search_index
+from schemas import sync_schemas
+from server_cfg import general_logger, SQLITE_FILE_PATH
+
+
+def dump_tables() -> List[Table]:
+    """
+    Tables of the referential and the sync state, so that a seeded database can go on with delta syncs
+    """
+    schemas = rome_table_schemas() + [sync_schemas.SyncJobState, sync_schemas.SyncCodeState,
+                                      sync_schemas.SyncGeneration]
+    return [schema.__table__ for schema in schemas]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as dump_file:
+        for block in iter(lambda: dump_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def json_default(value: Any) -> str:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Value {value!r} of type {type(value).__name__} can not be dumped")
+
+
+def dump_referential(engine: Engine, output_dir: str, batch_size: int = CT_DUMP_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Write one gzip compressed NDJSON file per table plus a manifest with the row counts and checksums.
+    Files are reproducible: rows are in primary key order and gzip headers carry no timestamp.
+    :return: the manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'format_version': CT_DUMP_FORMAT_VERSION,
+                'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'tables': {}}
+    with engine.connect() as connection:
+        existing_tables = set(inspect(connection).get_table_names())
+        for table in dump_tables():
+            if table.name not in existing_tables:
+                continue
+            file_name = f"{table.name}.ndjson.gz"
+            path = os.path.join(output_dir, file_name)
+            names = [column.name for column in table.columns]
+            rows = 0
+            statement = select(table).order_by(*table.primary_key.columns)
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            with open(path, 'wb') as raw_file, \
+                    gzip.GzipFile(filename='', mode='wb', fileobj=raw_file, mtime=0) as dump_file:
+                for partition in result.partitions(batch_size):
+                    lines = [json.dumps(dict(zip(names, row)), ensure_ascii=False, default=json_default) + '\n'
+                             for row in partition]
+                    dump_file.write(''.join(lines).encode('utf-8'))
+                    rows += len(partition)
+            manifest['tables'][table.name] = {'file': file_name, 'rows': rows, 'sha256': file_sha256(path)}
+            general_logger.info(f"Table {table.name} dumped in {path}: {rows} rows")
+    with open(os.path.join(output_dir, CT_DUMP_MANIFEST_FILE), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def read_manifest(dump_dir: str) -> Dict[str, Any]:
+    """
+    Read the manifest and check every file against its checksum before anything is loaded
+    """
+    with open(os.path.join(dump_dir, CT_DUMP_MANIFEST_FILE), 'r', encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('format_version') != CT_DUMP_FORMAT_VERSION:
+        raise ValueError(f"Dump format version {manifest.get('format_version')} is not supported, "
+                         f"expected {CT_DUMP_FORMAT_VERSION}")
+    for table_name, entry in manifest['tables'].items():
+        checksum = file_sha256(os.path.join(dump_dir, entry['file']))
+        if checksum != entry['sha256']:
+            raise ValueError(f"Dump file {entry['file']} of table {table_name} is corrupted, checksum mismatch")
+    return manifest
+
+
+def read_batches(path: str, table: Table, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    # Date columns may be decorated types, such as the UTC aware ones of sqlmodel, check what they store
+    datetime_columns = [column.name for column in table.columns
+                        if isinstance(getattr(column.type, 'impl', column.type), DateTime)]
+    batch = []
+    with gzip.open(path, 'rt', encoding='utf-8') as dump_file:
+        for line in dump_file:
+            row = json.loads(line)
+            for name in datetime_columns:
+                if row.get(name) is not None:
+                    row[name] = datetime.datetime.fromisoformat(row[name])
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def load_tables(connection: Connection, dump_dir: str, manifest: Dict[str, Any], batch_size: int):
+    tables = {table.name: table for table in dump_tables()}
+    unknown = set(manifest['tables']) - tables.keys()
+    if unknown:
+        raise ValueError(f"Dump holds unknown tables {sorted(unknown)}")
+    # Tables first without their secondary indexes, filled in primary key order, then indexed once
+    for table in tables.values():
+        connection.execute(CreateTable(table))
+    for table_name, entry in manifest['tables'].items():
+        table = tables[table_name]
+        rows = 0
+        for batch in read_batches(path=os.path.join(dump_dir, entry['file']), table=table, batch_size=batch_size):
+            connection.execute(table.insert(), batch)
+            rows += len(batch)
+        if rows != entry['rows']:
+            raise ValueError(f"Table {table_name} loaded {rows} rows, the manifest announces {entry['rows']}")
+        general_logger.info(f"Table {table_name} loaded: {rows} rows")
+    for table in tables.values():
+        for index in table.indexes:
+            index.create(connection)
+    create_search_index(connection=connection, rebuild=True)
+    connection.execute(text("ANALYZE"))
+
+
+def load_referential(dump_dir: str, db_file_path: str = SQLITE_FILE_PATH, replace: bool = False,
+                     batch_size: int = CT_DUMP_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Seed a SQLite database from a dump, without any API call.
+    The database is built in a temporary file with durability pragmas relaxed, one transaction and bulk inserts,
+    then moved in place: a failed load never leaves a half-filled database.
+    :param db_file_path: database to create, must not exist unless replace is set
+    :param replace: replace an existing database, no process must have it open
+    :return: number of loaded rows by table
+    """
+    if os.path.exists(db_file_path) and not replace:
+        raise FileExistsError(f"Database {db_file_path} already exists, use replace to overwrite it")
+    started_at = time.monotonic()
+    manifest = read_manifest(dump_dir)
+    loading_path = f"{db_file_path}.loading"
+    for path in (loading_path, f"{loading_path}-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    loading_engine = create_engine(f"sqlite:///{loading_path}")
+    try:
+        with loading_engine.connect() as connection:
+            for pragma in ("journal_mode=OFF", "synchronous=OFF", "locking_mode=EXCLUSIVE", "cache_size=-262144",
+                           "temp_store=MEMORY"):
+                connection.execute(text(f"PRAGMA {pragma}"))
+            connection.commit()
+            with connection.begin():
+                load_tables(connection=connection, dump_dir=dump_dir, manifest=manifest, batch_size=batch_size)
+            # Persistent journal mode of the database, as set by the application engine
+            connection.execute(text("PRAGMA journal_mode=WAL"))
+            connection.commit()
+    except BaseException:
+        loading_engine.dispose()
+        os.remove(loading_path)
+        raise
+    finally:
+        loading_engine.dispose()
+    for path in (f"{db_file_path}-wal", f"{db_file_path}-shm", f"{db_file_path}-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.replace(loading_path, db_file_path)
+    loaded = {table_name: entry['rows'] for table_name, entry in manifest['tables'].items()}
+    general_logger.info(f"Database {db_file_path} seeded with {sum(loaded.values())} rows "
+                        f"in {time.monotonic() - started_at:.1f} seconds")
+    return loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dump the ROME database or seed a new one from a dump")
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump_parser = commands.add_parser('dump', help="write a dump of the database")
+    dump_parser.add_argument('dump_dir', help="directory of the dump files")
+    load_parser = commands.add_parser('load', help="create a database from a dump")
+    load_parser.add_argument('dump_dir', help="directory of the dump files")
+    load_parser.add_argument('--db', default=SQLITE_FILE_PATH, help="path of the database to create")
+    load_parser.add_argument('--replace', action='store_true', help="replace an existing database")
+    args = parser.parse_args()
+    if args.command == 'dump':
+        from db.data_access import read_engine
+
+        dump_referential(engine=read_engine, output_dir=args.dump_dir)
+    else:
+        load_referential(dump_dir=args.dump_dir, db_file_path=args.db, replace=args.replace)
@@ -0,0 +1,257 @@
+import argparse
+import csv
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import Boolean, Table, func, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from constants import CT_DENORMALIZED_METIER_NAME, CT_EXPORT_BATCH_SIZE, CT_EXPORT_FILE_EXTENSIONS, \
+    CT_EXPORT_FORMATS_LIST, CT_EXPORT_FORMAT_ARROW, CT_EXPORT_FORMAT_CSV, CT_EXPORT_FORMAT_NDJSON, \
+    CT_EXPORT_FORMAT_PARQUET
+from db.compact_referential import rome_table_schemas
+from db.crud.relations import RELATIONS
+from schemas import rome_schemas
+from server_cfg import general_logger
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # Optional dependency, only needed by the Parquet and Arrow formats
+    pyarrow = None
+
+
+class ExportColumn:
+    """
+    :param name: column name in the export
+    :param kind: 'str', 'bool' or 'relation' for a JSON array of {code, libelle} objects
+    """
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+
+    def arrow_type(self):
+        if self.kind == 'bool':
+            return pyarrow.bool_()
+        if self.kind == 'relation':
+            return pyarrow.list_(pyarrow.struct([('code', pyarrow.string()), ('libelle', pyarrow.string())]))
+        return pyarrow.string()
+
+
+class BatchWriter(ABC):
+    """
+    Writes record batches given as a list of row tuples, in the order of columns
+    """
+
+    def __init__(self, path: str, columns: Sequence[ExportColumn]):
+        self.path = path
+        self.columns = list(columns)
+        self.rows = 0
+
+    @abstractmethod
+    def write(self, batch: List[tuple]):
+        pass
+
+    def close(self):
+        pass
+
+    def decode_relations(self, batch: List[tuple]) -> List[tuple]:
+        """
+        Relations are read as JSON arrays, decoded for the formats storing nested values
+        """
+        positions = [position for position, column in enumerate(self.columns) if column.kind == 'relation']
+        if not positions:
+            return batch
+        decoded = []
+        for row in batch:
+            row = list(row)
+            for position in positions:
+                row[position] = json.loads(row[position]) if row[position] else []
+            decoded.append(tuple(row))
+        return decoded
+
+
+class NdjsonWriter(BatchWriter):
+    def __init__(self, path: str, columns: Sequence[ExportColumn]):
+        super().__init__(path, columns)
+        self.file = open(path, 'w', encoding='utf-8', newline='\n')
+        self.names = [column.name for column in self.columns]
+
+    def write(self, batch: List[tuple]):
+        self.file.writelines(json.dumps(dict(zip(self.names, row)), ensure_ascii=False) + '\n'
+                             for row in self.decode_relations(batch))
+        self.rows += len(batch)
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter(BatchWriter):
+    """
+    Relations are kept as JSON arrays in their cells
+    """
+
+    def __init__(self, path: str, columns: Sequence[ExportColumn]):
+        super().__init__(path, columns)
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column.name for column in self.columns])
+
+    def write(self, batch: List[tuple]):
+        self.writer.writerows(batch)
+        self.rows += len(batch)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter(BatchWriter):
+    """
+    Parquet file, one row group per batch, or Arrow IPC file
+    """
+
+    def __init__(self, path: str, columns: Sequence[ExportColumn], parquet: bool):
+        if pyarrow is None:
+            raise ImportError("Parquet and Arrow exports need pyarrow, install it with: pip install pyarrow")
+        super().__init__(path, columns)
+        self.schema = pyarrow.schema([(column.name, column.arrow_type()) for column in self.columns])
+        if parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, batch: List[tuple]):
+        batch = self.decode_relations(batch)
+        arrays = [pyarrow.array([row[position] for row in batch], type=column.arrow_type())
+                  for position, column in enumerate(self.columns)]
+        self.writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+        self.rows += len(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+def batch_writer(path: str, export_format: str, columns: Sequence[ExportColumn]) -> BatchWriter:
+    if export_format == CT_EXPORT_FORMAT_PARQUET:
+        return ArrowWriter(path, columns, parquet=True)
+    if export_format == CT_EXPORT_FORMAT_ARROW:
+        return ArrowWriter(path, columns, parquet=False)
+    if export_format == CT_EXPORT_FORMAT_NDJSON:
+        return NdjsonWriter(path, columns)
+    if export_format == CT_EXPORT_FORMAT_CSV:
+        return CsvWriter(path, columns)
+    raise ValueError(f"Unknown export format '{export_format}', use one of {CT_EXPORT_FORMATS_LIST}")
+
+
+def table_columns(table: Table) -> List[ExportColumn]:
+    return [ExportColumn(column.name, 'bool' if isinstance(column.type, Boolean) else 'str')
+            for column in table.columns]
+
+
+def denormalized_metier_query() -> Tuple[Any, List[ExportColumn]]:
+    """
+    Métier rows with one JSON array column per relation, built by correlated subqueries on the indexed link tables
+    """
+    metier = rome_schemas.Metier.__table__
+    columns = table_columns(metier)
+    selected = list(metier.columns)
+    for relation in RELATIONS[rome_schemas.Metier]:
+        link = relation.link.__table__
+        target_column = link.c[relation.target_column]
+        target = list(target_column.foreign_keys)[0].column.table
+        json_object = func.json_object('code', target_column, 'libelle', target.c.libelle)
+        subquery = (select(func.json_group_array(json_object))
+                    .select_from(link.outerjoin(target, target.c.code == target_column))
+                    .where(link.c[relation.source_column] == metier.c.code)
+                    .scalar_subquery())
+        selected.append(subquery.label(relation.field))
+        columns.append(ExportColumn(relation.field, 'relation'))
+    return select(*selected).order_by(metier.c.code), columns
+
+
+def stream_batches(connection: Connection, statement: Any, batch_size: int) -> Iterator[List[tuple]]:
+    """
+    Plain row tuples by batches of batch_size, fetched with a server side cursor without building ORM objects
+    """
+    result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+    for partition in result.partitions(batch_size):
+        yield [tuple(row) for row in partition]
+
+
+def export_statement(connection: Connection, statement: Any, columns: Sequence[ExportColumn], path: str,
+                     export_format: str, batch_size: int) -> int:
+    writer = batch_writer(path=path, export_format=export_format, columns=columns)
+    try:
+        for batch in stream_batches(connection=connection, statement=statement, batch_size=batch_size):
+            writer.write(batch)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def export_referential(engine: Engine, output_dir: str, export_format: str = CT_EXPORT_FORMAT_PARQUET,
+                       table_names: Sequence[str] = None, batch_size: int = CT_EXPORT_BATCH_SIZE,
+                       denormalized_metiers: bool = False) -> Dict[str, int]:
+    """
+    Export the tables of rome_schemas, one file per table named after it, with constant memory use
+    :param output_dir: directory of the exported files, created if missing
+    :param export_format: one of CT_EXPORT_FORMATS_LIST
+    :param table_names: tables to export, every table present in the database when None
+    :param batch_size: number of rows per record batch, i.e. per Parquet row group
+    :param denormalized_metiers: also export the métiers with their relations as nested {code, libelle} lists
+    :return: number of exported rows by file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    extension = CT_EXPORT_FILE_EXTENSIONS.get(export_format)
+    if extension is None:
+        raise ValueError(f"Unknown export format '{export_format}', use one of {CT_EXPORT_FORMATS_LIST}")
+    exported = {}
+    with engine.connect() as connection:
+        existing_tables = set(inspect(connection).get_table_names())
+        tables = {schema.__table__.name: schema.__table__ for schema in rome_table_schemas()}
+        for name in table_names or sorted(tables):
+            if name not in tables:
+                raise ValueError(f"Unknown ROME table '{name}'")
+            if name not in existing_tables:
+                general_logger.warning(f"Table {name} is not in the database, not exported")
+                continue
+            table = tables[name]
+            path = os.path.join(output_dir, f"{name}.{extension}")
+            statement = select(table).order_by(*table.primary_key.columns)
+            exported[name] = export_statement(connection=connection, statement=statement,
+                                              columns=table_columns(table), path=path,
+                                              export_format=export_format, batch_size=batch_size)
+            general_logger.info(f"Table {name} exported in {path}: {exported[name]} rows")
+        if denormalized_metiers:
+            missing = {relation.link.__table__.name for relation in RELATIONS[rome_schemas.Metier]} - existing_tables
+            if missing:
+                raise ValueError(f"Denormalized métiers need the link tables {sorted(missing)}, run a sync first")
+            statement, columns = denormalized_metier_query()
+            path = os.path.join(output_dir, f"{CT_DENORMALIZED_METIER_NAME}.{extension}")
+            exported[CT_DENORMALIZED_METIER_NAME] = export_statement(
+                connection=connection, statement=statement, columns=columns, path=path,
+                export_format=export_format, batch_size=batch_size)
+            general_logger.info(f"Denormalized métiers exported in {path}: "
+                                f"{exported[CT_DENORMALIZED_METIER_NAME]} rows")
+    return exported
+
+
+if __name__ == '__main__':
+    from db.data_access import read_engine
+
+    parser = argparse.ArgumentParser(description="Export the ROME tables to columnar or line-oriented files")
+    parser.add_argument('output_dir', help="directory of the exported files")
+    parser.add_argument('--format', choices=sorted(CT_EXPORT_FORMATS_LIST), default=CT_EXPORT_FORMAT_PARQUET)
+    parser.add_argument('--tables', nargs='*', help="tables to export, all of them by default")
+    parser.add_argument('--batch-size', type=int, default=CT_EXPORT_BATCH_SIZE, help="rows per record batch")
+    parser.add_argument('--denormalized-metiers', action='store_true',
+                        help="also export the métiers with their relations")
+    args = parser.parse_args()
+    export_referential(engine=read_engine, output_dir=args.output_dir, export_format=args.format,
+                       table_names=args.tables, batch_size=args.batch_size,
+                       denormalized_metiers=args.denormalized_metiers)
@@ -0,0 +1,105 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, SQLModel, select
+
+from apis.metrics import Counter, Gauge, metrics_registry
+from constants import CT_DEFAULT_LIMIT
+from db.cache import ReadThroughCache
+from db.crud.sync_state import current_generation
+from db.data_access import read_engine
+from schemas import rome_schemas
+from server_cfg import CACHE_MAXSIZE, CACHE_TTL, CACHE_GENERATION_CHECK_INTERVAL
+
+# One read-through cache per table, created on first lookup
+reference_caches: Dict[str, ReadThroughCache] = {}
+reference_caches_lock = threading.Lock()
+
+
+def primary_key_column(schema: Any):
+    return list(schema.__table__.primary_key.columns)[0]
+
+
+def rome_tables() -> Dict[str, Any]:
+    """
+    ROME tables with a single primary key column, by table name
+    """
+    tables = {}
+    for value in vars(rome_schemas).values():
+        if isinstance(value, type) and issubclass(value, SQLModel) and hasattr(value, '__table__') \
+                and len(value.__table__.primary_key.columns) == 1:
+            tables[value.__table__.name] = value
+    return tables
+
+
+def read_one(session: Session, schema: Any, code: str) -> Optional[Any]:
+    return session.get(schema, code)
+
+
+def reference_cache(schema: Any) -> ReadThroughCache:
+    table_name = schema.__table__.name
+    with reference_caches_lock:
+        if table_name not in reference_caches:
+            def load(code: str):
+                with Session(read_engine) as session:
+                    return read_one(session=session, schema=schema, code=code)
+
+            reference_caches[table_name] = ReadThroughCache(
+                loader=load, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL,
+                generation_func=lambda: current_generation(read_engine),
+                generation_check_interval=CACHE_GENERATION_CHECK_INTERVAL)
+        return reference_caches[table_name]
+
+
+def read_one_cached(schema: Any, code: str) -> Optional[Any]:
+    """
+    Row of a ROME table by code through its read-through cache, hot codes do not reach SQLite
+    """
+    return reference_cache(schema).get(code)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {table_name: cache.stats() for table_name, cache in reference_caches.items()}
+
+
+read_cache_lookups = Counter('rome_read_cache_lookups_total', "Reference lookups by table and result: hit or miss",
+                             ('table', 'result'))
+read_cache_size = Gauge('rome_read_cache_size', "Rows held by the reference lookups cache", ('table',))
+
+
+def publish_cache_stats():
+    for table_name, stats in cache_stats().items():
+        read_cache_lookups.set_total(stats['hits'], table=table_name, result='hit')
+        read_cache_lookups.set_total(stats['misses'], table=table_name, result='miss')
+        read_cache_size.set(stats['size'], table=table_name)
+
+
+metrics_registry.add_collector(publish_cache_stats)
+
+
+def invalidate_caches():
+    for cache in reference_caches.values():
+        cache.invalidate()
+
+
+def read_page(session: Session, schema: Any, start_with_value: str = None, limit: int = CT_DEFAULT_LIMIT,
+              order_by_desc: bool = False) -> Tuple[List[Any], Optional[str]]:
+    """
+    Keyset pagination on the primary key: the page starts right after start_with_value,
+    so the cost of a page does not depend on its depth
+    :param start_with_value: primary key value of the last row of the previous page, None for the first page
+    :param limit: maximum number of rows, capped to CT_DEFAULT_LIMIT
+    :param order_by_desc: descending order of the primary key
+    :return: rows of the page and the start_with_value of the next page, None for the last page
+    """
+    limit = max(1, min(limit, CT_DEFAULT_LIMIT))
+    key = primary_key_column(schema)
+    statement = select(schema)
+    if start_with_value is not None:
+        statement = statement.where(key < start_with_value if order_by_desc else key > start_with_value)
+    statement = statement.order_by(key.desc() if order_by_desc else key).limit(limit + 1)
+    rows = session.exec(statement).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], key.name)
+    return rows, None
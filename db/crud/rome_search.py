@@ -0,0 +1,99 @@
+import re
+from typing import List, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session
+
+from constants import CT_SEARCH_COLUMN_WEIGHTS, CT_SEARCH_PREFIX_LENGTHS, CT_SEARCH_TABLES, CT_SEARCH_TOKENIZER
+from schemas.core_schemas import OurBaseModel
+
+
+class SearchResult(OurBaseModel):
+    kind: str
+    code: str
+    libelle: str
+    rank: float
+
+
+def fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+
+def search_index_ddl(table: str, columns: Sequence[str]) -> List[str]:
+    """
+    External content FTS5 table over the label columns of a table, kept in sync by triggers
+    so that every insert, upsert or delete of an ingestion updates the index incrementally
+    """
+    fts = fts_table(table)
+    quoted = ', '.join(f'"{column}"' for column in columns)
+    new_values = ', '.join(f'new."{column}"' for column in columns)
+    old_values = ', '.join(f'old."{column}"' for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({quoted}, content='{table}', content_rowid='rowid', "
+        f"tokenize='{CT_SEARCH_TOKENIZER}', prefix='{CT_SEARCH_PREFIX_LENGTHS}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {quoted}) VALUES (new.rowid, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {quoted}) VALUES ('delete', old.rowid, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {quoted}) VALUES (new.rowid, {new_values}); END",
+    ]
+
+
+def create_search_index(connection: Connection, rebuild: bool = False):
+    """
+    Create the FTS5 tables and their triggers, a new index is filled from the existing rows
+    :param rebuild: rebuild existing indexes from their tables
+    """
+    for table, columns in CT_SEARCH_TABLES.items():
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+                                    {'name': fts_table(table)}).first() is not None
+        for statement in search_index_ddl(table=table, columns=columns):
+            connection.execute(text(statement))
+        if rebuild or not exists:
+            connection.execute(text(f"INSERT INTO {fts_table(table)}({fts_table(table)}) VALUES ('rebuild')"))
+
+
+def create_search_indexes(engine: Engine, rebuild: bool = False):
+    with engine.begin() as connection:
+        create_search_index(connection=connection, rebuild=rebuild)
+
+
+def match_expression(query: str) -> str:
+    """
+    FTS5 query matching every word of the user text, the last one as a prefix for autocomplete
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_labels(session: Session, query: str, limit: int = 10,
+                  kinds: Sequence[str] = tuple(CT_SEARCH_TABLES)) -> List[SearchResult]:
+    """
+    Ranked full-text search of métiers and appellations by label, accent and case insensitive
+    :param query: user text, the last word can be incomplete
+    :param limit: maximum number of results
+    :param kinds: searched tables among CT_SEARCH_TABLES
+    :return: results ordered by relevance (lowest bm25 rank first)
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    weights = ', '.join(str(weight) for weight in CT_SEARCH_COLUMN_WEIGHTS)
+    selects = []
+    for kind in kinds:
+        if kind not in CT_SEARCH_TABLES:
+            raise ValueError(f"Unknown search kind '{kind}', use one of {list(CT_SEARCH_TABLES)}")
+        fts = fts_table(kind)
+        selects.append(f"SELECT '{kind}' AS kind, t.code AS code, t.libelle AS libelle, "
+                       f"bm25({fts}, {weights}) AS rank FROM {fts} JOIN {kind} AS t ON t.rowid = {fts}.rowid "
+                       f"WHERE {fts} MATCH :expression")
+    statement = text(f"{' UNION ALL '.join(selects)} ORDER BY rank LIMIT :limit")
+    rows = session.connection().execute(statement, {'expression': expression, 'limit': limit}).mappings()
+    return [SearchResult(**row) for row in rows]
@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Set
+
+import numpy as np
+import scipy.sparse
+from sqlalchemy import delete, func, select
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session
+
+from constants import CT_SIMILARITY_BATCH_SIZE, CT_SIMILARITY_FEATURE_WEIGHTS, CT_SIMILARITY_TOP_N, \
+    CT_SQLITE_MAX_KEYS_PER_QUERY
+from db.crud.ranking import top_k_columns
+from schemas import rome_schemas, similarity_schemas
+from schemas.core_schemas import ScoredElement
+from server_cfg import general_logger
+
+
+def metier_features() -> Dict[str, Any]:
+    metier_domaine = rome_schemas.MetierDomaineLink.__table__
+    domaine_grand_domaine = rome_schemas.DomaineGrandDomaineLink.__table__
+    competence = rome_schemas.MetierCompetenceLink.__table__
+    theme = rome_schemas.MetierThemeLink.__table__
+    return {
+        'competence': select(competence.c.codeMetier, competence.c.codeCompetence),
+        'theme': select(theme.c.codeMetier, theme.c.codeTheme),
+        'domaine': select(metier_domaine.c.codeMetier, metier_domaine.c.codeDomaine),
+        'grandDomaine': select(metier_domaine.c.codeMetier, domaine_grand_domaine.c.codeGrandDomaine)
+        .join(domaine_grand_domaine, domaine_grand_domaine.c.codeDomaine == metier_domaine.c.codeDomaine),
+    }
+
+
+def appellation_features() -> Dict[str, Any]:
+    """
+    Key competences of the appellation, themes and domains of its métier
+    """
+    metier_appellation = rome_schemas.MetierAppellationLink.__table__
+    metier_domaine = rome_schemas.MetierDomaineLink.__table__
+    domaine_grand_domaine = rome_schemas.DomaineGrandDomaineLink.__table__
+    competence = rome_schemas.AppellationCompetenceLink.__table__
+    theme = rome_schemas.MetierThemeLink.__table__
+    return {
+        'competence': select(competence.c.codeAppellation, competence.c.codeCompetence),
+        'theme': select(metier_appellation.c.codeAppellation, theme.c.codeTheme)
+        .join(theme, theme.c.codeMetier == metier_appellation.c.codeMetier),
+        'domaine': select(metier_appellation.c.codeAppellation, metier_domaine.c.codeDomaine)
+        .join(metier_domaine, metier_domaine.c.codeMetier == metier_appellation.c.codeMetier),
+        'grandDomaine': select(metier_appellation.c.codeAppellation, domaine_grand_domaine.c.codeGrandDomaine)
+        .join(metier_domaine, metier_domaine.c.codeMetier == metier_appellation.c.codeMetier)
+        .join(domaine_grand_domaine, domaine_grand_domaine.c.codeDomaine == metier_domaine.c.codeDomaine),
+    }
+
+
+@dataclass(frozen=True)
+class SimilarityKind:
+    """
+    Elements indexed by the similarity index
+    :param kind: name of the elements, key of their signatures
+    :param schema: table of the elements
+    :param neighbour_schema: table of the neighbours of the elements
+    :param source_column: neighbour column holding the code of the element
+    :param target_column: neighbour column holding the code of the similar element
+    :param features: statements selecting (element code, feature code) pairs, by feature name
+    """
+    kind: str
+    schema: Any
+    neighbour_schema: Any
+    source_column: str
+    target_column: str
+    features: Callable[[], Dict[str, Any]]
+
+
+SIMILARITY_KINDS = {
+    'metier': SimilarityKind('metier', rome_schemas.Metier, similarity_schemas.MetierSimilaire,
+                             'codeMetier', 'codeMetierSimilaire', metier_features),
+    'appellation': SimilarityKind('appellation', rome_schemas.Appellation, similarity_schemas.AppellationSimilaire,
+                                  'codeAppellation', 'codeAppellationSimilaire', appellation_features),
+}
+
+
+def chunks(values: Sequence[Any], size: int = CT_SQLITE_MAX_KEYS_PER_QUERY):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def feature_matrix(codes: Sequence[str], features: Dict[str, Dict[str, Set[str]]],
+                   weights: Dict[str, float] = CT_SIMILARITY_FEATURE_WEIGHTS) -> scipy.sparse.csr_matrix:
+    """
+    Element x feature matrix whose products are the weighted means of the cosine similarities of each feature:
+    every feature of an element is a unit vector scaled by the square root of its relative weight.
+    An element row only depends on the element, so that a change never alters the similarities of other pairs.
+    """
+    total_weight = sum(weights.values())
+    # Features side by side, each one after the columns of the previous ones
+    columns_by_feature, offset = {}, 0
+    for name in weights:
+        vocabulary = sorted(set().union(*features[name].values()))
+        columns_by_feature[name] = {value: offset + position for position, value in enumerate(vocabulary)}
+        offset += len(vocabulary)
+    rows, columns, data = [], [], []
+    for row, code in enumerate(codes):
+        for name, weight in weights.items():
+            values = features[name].get(code)
+            if not values:
+                continue
+            value = np.sqrt(weight / total_weight / len(values))
+            for feature_code in values:
+                rows.append(row)
+                columns.append(columns_by_feature[name][feature_code])
+                data.append(value)
+    return scipy.sparse.csr_matrix((np.asarray(data, dtype=np.float32), (rows, columns)),
+                                   shape=(len(codes), offset))
+
+
+def feature_signature(code: str, features: Dict[str, Dict[str, Set[str]]], top_n: int) -> str:
+    """
+    Hash of the features of an element, the weights and top_n, so that changing the settings rebuilds everything
+    """
+    parts = [f"top_n={top_n}"] + [f"weight:{name}={weight}" for name, weight in CT_SIMILARITY_FEATURE_WEIGHTS.items()]
+    for name in CT_SIMILARITY_FEATURE_WEIGHTS:
+        parts.extend(f"{name}:{value}" for value in sorted(features[name].get(code) or ()))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def top_neighbours(matrix: scipy.sparse.csr_matrix, rows: Sequence[int], top_n: int,
+                   batch_size: int = CT_SIMILARITY_BATCH_SIZE) -> Dict[int, List[tuple]]:
+    """
+    Best top_n other elements of each row, scored against all elements by one sparse product per batch
+    :return: (element position, score) pairs by decreasing score, elements sharing nothing are left out
+    """
+    neighbours = {}
+    transposed = matrix.T.tocsr()
+    top_n = min(top_n, matrix.shape[0] - 1)
+    for batch in chunks(list(rows), batch_size):
+        scores = (matrix[batch] @ transposed).toarray()
+        # An element is not its own neighbour
+        scores[np.arange(len(batch)), batch] = 0.0
+        if top_n <= 0:
+            neighbours.update((row, []) for row in batch)
+            continue
+        candidates, candidate_scores = top_k_columns(scores, top_n)
+        for row, positions, values in zip(batch, candidates.tolist(), candidate_scores.tolist()):
+            neighbours[row] = [(position, value) for position, value in zip(positions, values) if value > 0]
+    return neighbours
+
+
+def read_features(connection: Connection, similarity_kind: SimilarityKind) -> Dict[str, Dict[str, Set[str]]]:
+    features = {}
+    for name, statement in similarity_kind.features().items():
+        values = features[name] = {}
+        for code, feature_code in connection.execute(statement):
+            values.setdefault(code, set()).add(feature_code)
+    return features
+
+
+def affected_rows(connection: Connection, similarity_kind: SimilarityKind, matrix: scipy.sparse.csr_matrix,
+                  index: Dict[str, int], changed: Set[str], top_n: int) -> Set[int]:
+    """
+    Elements whose neighbours may differ after the changed elements: the changed ones,
+    those having a changed element among their stored neighbours,
+    and those to which a changed element is now at least as similar as their last stored neighbour
+    """
+    neighbours = similarity_kind.neighbour_schema.__table__
+    source, target = neighbours.c[similarity_kind.source_column], neighbours.c[similarity_kind.target_column]
+    affected = {index[code] for code in changed if code in index}
+    for codes in chunks(sorted(changed)):
+        statement = select(source).where(target.in_(codes)).distinct()
+        affected.update(index[code] for code in connection.execute(statement).scalars() if code in index)
+    # Score an element must reach to enter a list, 0 for lists not filled up to top_n
+    thresholds = np.zeros(matrix.shape[0], dtype=np.float32)
+    statement = select(source, func.count(), func.min(neighbours.c.score)).group_by(source)
+    for code, count, min_score in connection.execute(statement):
+        if code in index and count >= top_n:
+            thresholds[index[code]] = min_score
+    changed_rows = sorted(index[code] for code in changed if code in index)
+    transposed = matrix.T.tocsr()
+    for batch in chunks(changed_rows, CT_SIMILARITY_BATCH_SIZE):
+        scores = (matrix[batch] @ transposed).toarray()
+        reached = (scores > 0) & (scores >= thresholds[None, :])
+        affected.update(np.flatnonzero(reached.any(axis=0)).tolist())
+    return affected
+
+
+def refresh_kind(connection: Connection, similarity_kind: SimilarityKind, full: bool, top_n: int) -> int:
+    """
+    :return: number of elements whose neighbours have been computed
+    """
+    element = similarity_kind.schema.__table__
+    neighbours = similarity_kind.neighbour_schema.__table__
+    signatures = similarity_schemas.SimilaritySignature.__table__
+    codes = list(connection.execute(select(element.c.code).order_by(element.c.code)).scalars())
+    index = {code: position for position, code in enumerate(codes)}
+    features = read_features(connection, similarity_kind)
+    matrix = feature_matrix(codes, features)
+    new_signatures = {code: feature_signature(code, features, top_n) for code in codes}
+    stored_signatures = dict(connection.execute(select(signatures.c.code, signatures.c.signature)
+                                                .where(signatures.c.kind == similarity_kind.kind)).all())
+    changed = {code for code, signature in new_signatures.items() if stored_signatures.get(code) != signature}
+    removed = set(stored_signatures) - set(new_signatures)
+    if full or not stored_signatures:
+        rows = set(range(len(codes)))
+    elif not changed and not removed:
+        return 0
+    else:
+        rows = affected_rows(connection, similarity_kind, matrix, index, changed | removed, top_n)
+    computed = top_neighbours(matrix, sorted(rows), top_n)
+    source_column = neighbours.c[similarity_kind.source_column]
+    if full or not stored_signatures:
+        connection.execute(delete(neighbours))
+        connection.execute(delete(signatures).where(signatures.c.kind == similarity_kind.kind))
+    else:
+        for batch in chunks(sorted({codes[row] for row in rows} | removed)):
+            connection.execute(delete(neighbours).where(source_column.in_(batch)))
+        for batch in chunks(sorted(changed | removed)):
+            connection.execute(delete(signatures).where(signatures.c.kind == similarity_kind.kind,
+                                                        signatures.c.code.in_(batch)))
+    neighbour_rows = [{similarity_kind.source_column: codes[row], 'rang': rank,
+                       similarity_kind.target_column: codes[position], 'score': score}
+                      for row, row_neighbours in computed.items()
+                      for rank, (position, score) in enumerate(row_neighbours, start=1)]
+    if neighbour_rows:
+        connection.execute(neighbours.insert(), neighbour_rows)
+    signature_rows = [{'kind': similarity_kind.kind, 'code': code, 'signature': new_signatures[code]}
+                      for code in sorted(changed if not full and stored_signatures else new_signatures)]
+    if signature_rows:
+        connection.execute(signatures.insert(), signature_rows)
+    return len(rows)
+
+
+def refresh_similarity_index(engine: Engine, full: bool = False, top_n: int = CT_SIMILARITY_TOP_N,
+                             kinds: Sequence[str] = None) -> Dict[str, int]:
+    """
+    Build or refresh the top_n neighbours of the métiers and appellations, to be run after a sync.
+    An incremental refresh only recomputes the elements whose neighbours may have changed,
+    found from the feature signatures stored by the previous build.
+    :param full: recompute every element, the first build always is a full one
+    :param kinds: keys of SIMILARITY_KINDS to refresh, all of them when None
+    :return: number of recomputed elements by kind
+    """
+    refreshed = {}
+    for name in kinds or SIMILARITY_KINDS:
+        if name not in SIMILARITY_KINDS:
+            raise ValueError(f"Unknown similarity kind '{name}', use one of {sorted(SIMILARITY_KINDS)}")
+        similarity_kind = SIMILARITY_KINDS[name]
+        started_at = time.monotonic()
+        with engine.begin() as connection:
+            for schema in (similarity_kind.neighbour_schema, similarity_schemas.SimilaritySignature):
+                schema.__table__.create(connection, checkfirst=True)
+            refreshed[name] = refresh_kind(connection, similarity_kind, full=full, top_n=top_n)
+        general_logger.info(f"Similarity index of {name}: {refreshed[name]} elements recomputed "
+                            f"in {time.monotonic() - started_at:.1f} seconds")
+    return refreshed
+
+
+def similar_elements(session: Session, kind: str, code: str,
+                     limit: int = CT_SIMILARITY_TOP_N) -> List[ScoredElement]:
+    """
+    Precomputed neighbours of an element, read by one range scan of the primary key of the neighbours table
+    """
+    similarity_kind = SIMILARITY_KINDS[kind]
+    element = similarity_kind.schema.__table__
+    neighbours = similarity_kind.neighbour_schema.__table__
+    target = neighbours.c[similarity_kind.target_column]
+    statement = (select(target, element.c.libelle, neighbours.c.score)
+                 .join(element, element.c.code == target)
+                 .where(neighbours.c[similarity_kind.source_column] == code)
+                 .order_by(neighbours.c.rang)
+                 .limit(limit))
+    return [ScoredElement(code=similar_code, libelle=libelle, score=score)
+            for similar_code, libelle, score in session.execute(statement)]
+
+
+def similarity_index_built(session: Session, kind: str) -> bool:
+    """
+    Whether refresh_similarity_index has run for the kind, telling a missing index from an element without neighbours
+    """
+    signatures = similarity_schemas.SimilaritySignature.__table__
+    statement = select(signatures.c.code).where(signatures.c.kind == kind).limit(1)
+    return session.execute(statement).first() is not None
+
+
+if __name__ == '__main__':
+    from db.data_access import engine
+
+    parser = argparse.ArgumentParser(description="Build or refresh the similarity index of métiers and appellations")
+    parser.add_argument('--full', action='store_true', help="recompute every element instead of the changed ones")
+    parser.add_argument('--top-n', type=int, default=CT_SIMILARITY_TOP_N, help="neighbours stored per element")
+    parser.add_argument('--kinds', nargs='*', choices=sorted(SIMILARITY_KINDS), help="elements to index")
+    args = parser.parse_args()
+    refresh_similarity_index(engine=engine, full=args.full, top_n=args.top_n, kinds=args.kinds)
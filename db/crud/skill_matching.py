@@ -0,0 +1,152 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from constants import CT_MATCHING_BATCH_SIZE, CT_MATCHING_METRIC_COSINE, CT_MATCHING_METRICS_LIST
+from db.cache import GenerationCachedValue
+from db.crud.ranking import top_k_columns
+from db.crud.sync_state import current_generation
+from db.data_access import read_engine
+from schemas import rome_schemas
+from schemas.core_schemas import ScoredElement
+from server_cfg import general_logger, CACHE_GENERATION_CHECK_INTERVAL
+
+
+class SkillMatchingEngine:
+    """
+    Sparse métier x competence matrix, in CSR form, scoring every métier for a batch of candidate profiles
+    with one sparse matrix product. Competences are weighted by their smoothed inverse métier frequency,
+    so that a rare competence shared with a métier weighs more than one mobilised by most métiers.
+    """
+
+    def __init__(self, metier_codes: Sequence[str], metier_labels: Sequence[str],
+                 links: Sequence[Tuple[str, str]], idf: bool = True):
+        """
+        :param metier_codes: codes of the métiers, the rows of the matrix
+        :param metier_labels: labels of the métiers, in the order of metier_codes
+        :param links: (codeMetier, codeCompetence) pairs, pairs of unknown métiers are ignored
+        :param idf: weigh competences by their inverse métier frequency, all weights are 1 otherwise
+        """
+        self.metier_codes = list(metier_codes)
+        self.metier_labels = list(metier_labels)
+        self.metier_index = {code: position for position, code in enumerate(self.metier_codes)}
+        self.competence_index: Dict[str, int] = {}
+        rows, columns = [], []
+        for code_metier, code_competence in links:
+            row = self.metier_index.get(code_metier)
+            if row is None:
+                continue
+            rows.append(row)
+            columns.append(self.competence_index.setdefault(code_competence, len(self.competence_index)))
+        shape = (len(self.metier_codes), len(self.competence_index))
+        incidence = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+        # Duplicated links are summed by the constructor, back to a 0/1 matrix
+        incidence.data[:] = 1.0
+        metier_frequencies = np.asarray(incidence.sum(axis=0)).ravel()
+        if idf:
+            self.weights = (np.log((1.0 + shape[0]) / (1.0 + metier_frequencies)) + 1.0).astype(np.float32)
+            # Weight of a competence mobilised by no métier, the rarest there is
+            self.unknown_weight = float(np.log(1.0 + shape[0]) + 1.0)
+        else:
+            self.weights = np.ones(shape[1], dtype=np.float32)
+            self.unknown_weight = 1.0
+        weighted = incidence @ scipy.sparse.diags(self.weights, format='csr')
+        # Competence x métier, the right operand of every product
+        self.weighted_transposed = weighted.T.tocsr()
+        self.squared_transposed = (weighted.multiply(weighted)).T.tocsr()
+        self.metier_weight_sums = np.asarray(weighted.sum(axis=1), dtype=np.float32).ravel()
+        self.metier_norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1), dtype=np.float32).ravel())
+
+    @classmethod
+    def from_engine(cls, engine: Engine, idf: bool = True) -> 'SkillMatchingEngine':
+        metier = rome_schemas.Metier.__table__
+        link = rome_schemas.MetierCompetenceLink.__table__
+        with engine.connect() as connection:
+            metiers = connection.execute(select(metier.c.code, metier.c.libelle).order_by(metier.c.code)).all()
+            links = connection.execute(select(link.c.codeMetier, link.c.codeCompetence)).all()
+        matching_engine = cls(metier_codes=[code for code, _ in metiers], metier_labels=[label for _, label in metiers],
+                              links=links, idf=idf)
+        general_logger.info(f"Skill matching engine built: {len(metiers)} métiers, "
+                            f"{len(matching_engine.competence_index)} competences, {len(links)} links")
+        return matching_engine
+
+    def profile_matrix(self, profiles: Sequence[Sequence[str]]) -> Tuple[scipy.sparse.csr_matrix, np.ndarray]:
+        """
+        0/1 profile x competence matrix, competences mobilised by no métier can not match and are left out
+        :return: the matrix and the number of left out competences of each profile
+        """
+        indptr, indices, unknown_counts = [0], [], []
+        for profile in profiles:
+            codes = set(profile)
+            columns = {self.competence_index[code] for code in codes if code in self.competence_index}
+            indices.extend(sorted(columns))
+            indptr.append(len(indices))
+            unknown_counts.append(len(codes) - len(columns))
+        data = np.ones(len(indices), dtype=np.float32)
+        matrix = scipy.sparse.csr_matrix((data, np.asarray(indices, dtype=np.int32),
+                                          np.asarray(indptr, dtype=np.int64)),
+                                         shape=(len(profiles), len(self.competence_index)))
+        return matrix, np.asarray(unknown_counts, dtype=np.float32)
+
+    def score(self, profiles: Sequence[Sequence[str]], metric: str = CT_MATCHING_METRIC_COSINE) -> np.ndarray:
+        """
+        :param profiles: candidate profiles, each one a collection of competence codes
+        :param metric: weighted cosine or weighted Jaccard, one of CT_MATCHING_METRICS_LIST
+        :return: dense profile x métier matrix of scores between 0 and 1
+        """
+        if metric not in CT_MATCHING_METRICS_LIST:
+            raise ValueError(f"Unknown matching metric '{metric}', use one of {sorted(CT_MATCHING_METRICS_LIST)}")
+        matrix, unknown_counts = self.profile_matrix(profiles)
+        # Competences unknown to the métiers match none of them but still weigh in the profile
+        unknown_weights = unknown_counts * self.unknown_weight
+        if metric == CT_MATCHING_METRIC_COSINE:
+            # Sum of the squared weights of the shared competences, over the product of the weighted norms
+            shared = (matrix @ self.squared_transposed).toarray()
+            profile_norms = np.sqrt(matrix @ (self.weights * self.weights) + unknown_weights * self.unknown_weight)
+            denominators = profile_norms[:, None] * self.metier_norms[None, :]
+        else:
+            # Weight of the shared competences over the weight of their union
+            shared = (matrix @ self.weighted_transposed).toarray()
+            profile_sums = matrix @ self.weights + unknown_weights
+            denominators = profile_sums[:, None] + self.metier_weight_sums[None, :] - shared
+        return np.divide(shared, denominators, out=np.zeros_like(shared), where=denominators > 0)
+
+    def top_k(self, profiles: Sequence[Sequence[str]], k: int = 10, metric: str = CT_MATCHING_METRIC_COSINE,
+              min_score: float = 0.0, batch_size: int = CT_MATCHING_BATCH_SIZE) -> List[List[Tuple[int, float]]]:
+        """
+        Best k métiers of every profile, scored by batches of batch_size profiles to bound the dense score matrix
+        :param min_score: métiers scoring this or less are left out, so that unrelated métiers never match
+        :return: for each profile, (métier position, score) pairs by decreasing score
+        """
+        results = []
+        k = min(k, len(self.metier_codes))
+        if k <= 0:
+            return [[] for _ in profiles]
+        for start in range(0, len(profiles), batch_size):
+            scores = self.score(profiles[start:start + batch_size], metric=metric)
+            candidates, candidate_scores = top_k_columns(scores, k)
+            for positions, values in zip(candidates.tolist(), candidate_scores.tolist()):
+                results.append([(position, value) for position, value in zip(positions, values) if value > min_score])
+        return results
+
+    def match(self, profiles: Sequence[Sequence[str]], k: int = 10, metric: str = CT_MATCHING_METRIC_COSINE,
+              min_score: float = 0.0) -> List[List[ScoredElement]]:
+        return [[ScoredElement(code=self.metier_codes[position], libelle=self.metier_labels[position], score=value)
+                 for position, value in matches]
+                for matches in self.top_k(profiles, k=k, metric=metric, min_score=min_score)]
+
+
+matching_engine_cache = GenerationCachedValue(
+    builder=lambda: SkillMatchingEngine.from_engine(read_engine),
+    generation_func=lambda: current_generation(read_engine),
+    generation_check_interval=CACHE_GENERATION_CHECK_INTERVAL)
+
+
+def matching_engine() -> SkillMatchingEngine:
+    """
+    Engine of the stored referential, rebuilt on first use after a sync changed the data generation
+    """
+    return matching_engine_cache.get()
@@ -0,0 +1,200 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from apis.metrics import Counter, Gauge, metrics_registry
+from constants import CT_SYNC_PROGRESS_LOG_INTERVAL
+from server_cfg import general_logger
+
+sync_elements = Counter('sync_job_elements_total', "Elements written by the sync jobs", ('job',))
+sync_throughput = Gauge('sync_job_elements_per_second', "Average write speed of the sync jobs", ('job',))
+sync_progress_ratio = Gauge('sync_job_progress_ratio', "Share of the elements of the sync jobs written so far",
+                            ('job',))
+sync_eta = Gauge('sync_job_eta_seconds', "Estimated remaining seconds of the running sync jobs", ('job',))
+sync_duration = Gauge('sync_job_duration_seconds', "Elapsed seconds of the sync jobs", ('job',))
+
+
+class JobProgress:
+    """
+    Thread-safe progress of one job: number of elements to write, written so far, and the derived ETA
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.total = None
+        self.done = 0
+        self.started_at = None
+        self.finished_at = None
+        self.__lock = threading.Lock()
+
+    def start(self, total: int):
+        with self.__lock:
+            self.total = total
+            self.done = 0
+            self.started_at = time.monotonic()
+
+    def advance(self, count: int = 1):
+        with self.__lock:
+            self.done += count
+        sync_elements.inc(count, job=self.job)
+
+    def finish(self):
+        with self.__lock:
+            self.finished_at = time.monotonic()
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def rate(self) -> float:
+        """
+        Elements written per second since the start of the job
+        """
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """
+        Remaining seconds at the average speed of the job so far, None until the first element is written
+        """
+        with self.__lock:
+            if self.total is None or self.done == 0:
+                return None
+            return self.elapsed() / self.done * max(0, self.total - self.done)
+
+    def __str__(self):
+        if self.total is None:
+            return f"{self.job}: listing"
+        eta = self.eta()
+        eta_text = '?' if eta is None else f"{eta:.0f}s"
+        percent = self.done / self.total if self.total else 1.0
+        return f"{self.job}: {self.done}/{self.total} ({percent:.0%}) in {self.elapsed():.0f}s " \
+               f"at {self.rate():.1f}/s, ETA {eta_text}"
+
+    def publish(self):
+        """
+        Copy the progress into the sync job gauges
+        """
+        if self.total is None:
+            return
+        eta = self.eta()
+        sync_throughput.set(self.rate(), job=self.job)
+        sync_progress_ratio.set(self.done / self.total if self.total else 1.0, job=self.job)
+        sync_eta.set(0.0 if self.finished_at is not None else (eta if eta is not None else -1.0), job=self.job)
+        sync_duration.set(self.elapsed(), job=self.job)
+
+
+@dataclass(frozen=True)
+class SyncJob:
+    """
+    :param name: unique name of the job
+    :param run: called as run(progress) in a worker thread, its result is returned by JobScheduler.run()
+    :param depends_on: names of the jobs that must be completed before this one starts
+    """
+    name: str
+    run: Callable[[JobProgress], Any]
+    depends_on: Tuple[str, ...] = ()
+
+
+class JobScheduler:
+    """
+    Run jobs in parallel as soon as their dependencies are completed, at most max_parallel_jobs at once.
+    Jobs share whatever their run functions share, for instance the rate limiter of one API client,
+    so the quota budget stays global while independent jobs overlap.
+    When a job fails its dependents are not started, running jobs are waited for then the error is raised.
+    """
+
+    def __init__(self, jobs: Sequence[SyncJob], max_parallel_jobs: int = 2,
+                 progress_interval: float = CT_SYNC_PROGRESS_LOG_INTERVAL):
+        """
+        :param max_parallel_jobs: maximum number of jobs running at once, 1 runs them one after another
+        :param progress_interval: delay in seconds between two progress logs of the running jobs
+        """
+        self.jobs = {job.name: job for job in jobs}
+        if len(self.jobs) != len(jobs):
+            raise ValueError("Job names must be unique")
+        self.max_parallel_jobs = max(1, max_parallel_jobs)
+        self.progress_interval = progress_interval
+        self.progress = {name: JobProgress(name) for name in self.jobs}
+        self.__check_dependencies__()
+
+    def __check_dependencies__(self):
+        for job in self.jobs.values():
+            unknown = set(job.depends_on) - self.jobs.keys()
+            if unknown:
+                raise ValueError(f"Job {job.name} depends on unknown jobs {sorted(unknown)}")
+        # Kahn's algorithm, the jobs left unordered are in a cycle
+        remaining = {name: set(job.depends_on) for name, job in self.jobs.items()}
+        while True:
+            ready = [name for name, dependencies in remaining.items() if not dependencies]
+            if not ready:
+                break
+            for name in ready:
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+        if remaining:
+            raise ValueError(f"Cyclic dependencies between jobs {sorted(remaining)}")
+
+    def log_progress(self, names: Sequence[str]):
+        for name in names:
+            general_logger.info(f"Progress {self.progress[name]}")
+
+    def publish_progress(self):
+        for progress in self.progress.values():
+            progress.publish()
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Progress summaries of the running jobs are logged every progress_interval seconds
+        and their gauges are refreshed whenever the metrics are rendered
+        :return: result of each job run function by job name
+        """
+        results = {}
+        failures: List[Tuple[str, BaseException]] = []
+        pending = dict(self.jobs)
+        running: Dict[Future, str] = {}
+        next_log_at = time.monotonic() + self.progress_interval
+        metrics_registry.add_collector(self.publish_progress)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel_jobs, thread_name_prefix='sync-job') as executor:
+                while pending or running:
+                    if not failures:
+                        for name, job in list(pending.items()):
+                            if len(running) >= self.max_parallel_jobs:
+                                break
+                            if all(dependency in results for dependency in job.depends_on):
+                                general_logger.info(f"Start job {name}")
+                                running[executor.submit(job.run, self.progress[name])] = name
+                                del pending[name]
+                    if not running:
+                        break
+                    done, _ = wait(running, timeout=max(0.0, next_log_at - time.monotonic()),
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        self.progress[name].finish()
+                        try:
+                            results[name] = future.result()
+                        except BaseException as exc:
+                            general_logger.error(f"Job {name} failed after {self.progress[name].elapsed():.0f}s: {exc}")
+                            failures.append((name, exc))
+                        else:
+                            general_logger.info(f"End of job {name} in {self.progress[name].elapsed():.0f}s: "
+                                                f"{results[name]}")
+                    # After the finished jobs are popped, so that only the jobs still running are logged
+                    if time.monotonic() >= next_log_at:
+                        self.log_progress(list(running.values()))
+                        next_log_at = time.monotonic() + self.progress_interval
+        finally:
+            metrics_registry.remove_collector(self.publish_progress)
+            self.publish_progress()
+        if failures:
+            if pending:
+                general_logger.error(f"Jobs {sorted(pending)} not started because of failed jobs")
+            name, exc = failures[0]
+            raise exc
+        return results
@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Set, Union
+
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select, delete
+
+from constants import CT_SYNC_STATUS_RUNNING, CT_SYNC_STATUS_COMPLETED
+from db.crud.upsert import upsert_batch
+from schemas.sync_schemas import SyncJobState, SyncCodeState, SyncGeneration
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def is_job_completed(session: Session, job: str) -> bool:
+    job_state = session.get(SyncJobState, job)
+    return job_state is not None and job_state.status == CT_SYNC_STATUS_COMPLETED
+
+
+def start_job(session: Session, job: str, resume: bool = False) -> SyncJobState:
+    """
+    Mark a job as running, a resumed job keeps the start date of its interrupted run
+    """
+    job_state = session.get(SyncJobState, job)
+    if job_state is None:
+        job_state = SyncJobState(job=job, status=CT_SYNC_STATUS_RUNNING, started_at=utc_now())
+    elif not resume or job_state.status == CT_SYNC_STATUS_COMPLETED:
+        job_state.started_at = utc_now()
+    job_state.status = CT_SYNC_STATUS_RUNNING
+    job_state.finished_at = None
+    session.add(job_state)
+    session.commit()
+    session.refresh(job_state)
+    return job_state
+
+
+def finish_job(session: Session, job: str):
+    """
+    Mark a job as completed and publish its writes as a new data generation
+    """
+    job_state = session.get(SyncJobState, job)
+    job_state.status = CT_SYNC_STATUS_COMPLETED
+    job_state.finished_at = utc_now()
+    session.add(job_state)
+    bump_generation(session=session)
+    session.commit()
+
+
+def bump_generation(session: Session):
+    """
+    Increment the data generation in the current transaction, without committing.
+    A single INSERT ... ON CONFLICT statement, so that jobs finishing in parallel never lose an increment.
+    """
+    table = SyncGeneration.__table__
+    now = utc_now()
+    statement = insert(table).values(id=1, generation=1, updated_at=now)
+    statement = statement.on_conflict_do_update(index_elements=[table.c.id],
+                                                set_={'generation': table.c.generation + 1, 'updated_at': now})
+    session.execute(statement)
+
+
+def current_generation(engine: Engine) -> int:
+    """
+    Data generation of the database, 0 when no sync has completed yet
+    """
+    try:
+        with engine.connect() as connection:
+            generation = connection.execute(text(f"SELECT generation FROM {SyncGeneration.__tablename__} "
+                                                 f"WHERE id = 1")).scalar()
+    except OperationalError:
+        # Database created before the generation table
+        return 0
+    return generation or 0
+
+
+def fetched_codes(session: Session, job_state: SyncJobState, schema: Any) -> Set[str]:
+    """
+    Codes that a resumed job does not need to fetch again
+    :param job_state: state of the running job
+    :param schema: SQLModel table of the job, its existing codes are considered fetched
+    :return: codes fetched since the start of the job run or already present in the target table
+    """
+    statement = select(SyncCodeState.code).where(SyncCodeState.job == job_state.job,
+                                                  SyncCodeState.fetched_at >= job_state.started_at)
+    codes = set(session.exec(statement).all())
+    codes.update(session.exec(select(schema.code)).all())
+    return codes
+
+
+def list_entry_hash(element: Union[BaseModel, Dict[str, Any]]) -> str:
+    """
+    Stable hash of an entry of a list response, independent of the order of its keys
+    :param element: validated model or payload dict of the entry
+    """
+    if isinstance(element, BaseModel):
+        element = element.model_dump(mode='json')
+    payload = json.dumps(element, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def previous_hashes(session: Session, job: str) -> Dict[str, str]:
+    statement = select(SyncCodeState.code, SyncCodeState.list_hash).where(SyncCodeState.job == job)
+    return {code: list_hash for code, list_hash in session.exec(statement).all()}
+
+
+def delete_codes(session: Session, job: str, schema: Any, codes: Iterable[str]) -> int:
+    """
+    Delete the rows and sync states of codes that disappeared from the referential
+    :return: number of deleted rows in the target table
+    """
+    codes = list(codes)
+    if not codes:
+        return 0
+    result = session.exec(delete(schema).where(schema.code.in_(codes)))
+    session.exec(delete(SyncCodeState).where(SyncCodeState.job == job, SyncCodeState.code.in_(codes)))
+    session.commit()
+    return result.rowcount
+
+
+def record_codes(session: Session, job: str, codes: Iterable[str], hashes: Dict[str, str] = None):
+    """
+    Checkpoint fetched codes in the transaction of their batch, without committing
+    :param hashes: list entry hash of each code, stored for the next delta sync
+    """
+    now = utc_now()
+    hashes = hashes or {}
+    rows = [{'job': job, 'code': code, 'fetched_at': now, 'list_hash': hashes.get(code)} for code in codes]
+    if rows:
+        upsert_batch(session=session, table=SyncCodeState.__table__, rows=rows)
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List
+
+from sqlalchemy import Table, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session
+
+from constants import CT_SQLITE_MAX_KEYS_PER_QUERY
+from server_cfg import general_logger, DB_BATCH_SIZE
+
+
+@dataclass
+class UpsertReport:
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+
+    def __add__(self, other: 'UpsertReport') -> 'UpsertReport':
+        return UpsertReport(inserted=self.inserted + other.inserted,
+                            updated=self.updated + other.updated,
+                            skipped=self.skipped + other.skipped,
+                            deleted=self.deleted + other.deleted)
+
+    def __str__(self):
+        return f"inserted={self.inserted} updated={self.updated} skipped={self.skipped} deleted={self.deleted}"
+
+
+def row_key(table: Table, row: Dict[str, Any]) -> tuple:
+    return tuple(row[column.name] for column in table.primary_key.columns)
+
+
+def select_existing(session: Session, table: Table, keys: List[tuple]) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Read the existing rows of the given primary keys, by chunks to stay below the SQLite parameters limit
+    """
+    pk_columns = list(table.primary_key.columns)
+    existing = {}
+    for start in range(0, len(keys), CT_SQLITE_MAX_KEYS_PER_QUERY):
+        chunk = keys[start:start + CT_SQLITE_MAX_KEYS_PER_QUERY]
+        if len(pk_columns) == 1:
+            key_filter = pk_columns[0].in_([key[0] for key in chunk])
+        else:
+            key_filter = tuple_(*pk_columns).in_(chunk)
+        for row in session.execute(select(table).where(key_filter)).mappings():
+            existing[row_key(table, row)] = row
+    return existing
+
+
+def insert_or_ignore(session: Session, table: Table, rows: List[Dict[str, Any]]):
+    """
+    Insert rows whose primary key is not already present, without reading nor committing
+    """
+    if rows:
+        session.execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+def upsert_batch(session: Session, table: Table, rows: List[Dict[str, Any]],
+                 update_existing: bool = True) -> UpsertReport:
+    """
+    Write one batch of rows with a single INSERT ... ON CONFLICT statement, without committing.
+    Existing rows of the batch are read first so that unchanged rows are neither written nor counted as updated.
+    :param session: session holding the transaction of the batch
+    :param table: SQLAlchemy table, i.e. schema.__table__ of a SQLModel table
+    :param rows: dicts of column values, missing columns are written as NULL
+    :param update_existing: ON CONFLICT DO UPDATE if True, DO NOTHING otherwise
+    """
+    pk_columns = list(table.primary_key.columns)
+    data_columns = [column for column in table.columns if not column.primary_key]
+    # The last occurrence of a key wins, like successive updates would
+    batch = {}
+    for row in rows:
+        row = {column.name: row.get(column.name) for column in table.columns}
+        batch[row_key(table, row)] = row
+
+    existing = select_existing(session=session, table=table, keys=list(batch))
+
+    report = UpsertReport()
+    changed_rows = []
+    for key, row in batch.items():
+        if key not in existing:
+            report.inserted += 1
+            changed_rows.append(row)
+        elif update_existing and any(row[column.name] != existing[key][column.name] for column in data_columns):
+            report.updated += 1
+            changed_rows.append(row)
+        else:
+            report.skipped += 1
+
+    if changed_rows:
+        statement = insert(table)
+        if update_existing and data_columns:
+            statement = statement.on_conflict_do_update(
+                index_elements=pk_columns,
+                set_={column.name: statement.excluded[column.name] for column in data_columns})
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=pk_columns)
+        session.execute(statement, changed_rows)
+    return report
+
+
+def upsert_rows(session: Session, schema: Any, rows: Iterable[Dict[str, Any]], batch_size: int = DB_BATCH_SIZE,
+                update_existing: bool = True,
+                on_batch: Callable[[Session, List[Dict[str, Any]]], None] = None) -> UpsertReport:
+    """
+    Bulk upsert rows into the table of a SQLModel schema, one transaction per batch
+    :param session: session used to write, committed after each batch
+    :param schema: SQLModel table class, its primary key is used as conflict target
+    :param rows: dicts of column values, consumed lazily
+    :param batch_size: number of rows per transaction
+    :param update_existing: update existing rows whose values changed, otherwise keep them untouched
+    :param on_batch: called as on_batch(session, batch) before each commit, to write along in the same transaction
+    :return: numbers of inserted, updated and skipped rows
+    """
+    table = schema.__table__
+    report = UpsertReport()
+
+    def write(batch: List[Dict[str, Any]]) -> UpsertReport:
+        try:
+            batch_report = upsert_batch(session=session, table=table, rows=batch, update_existing=update_existing)
+            if on_batch is not None:
+                on_batch(session, batch)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        general_logger.debug(f"Batch of {len(batch)} rows committed in table {table.name}: {batch_report}")
+        return batch_report
+
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= max(1, batch_size):
+                pending, batch = batch, []
+                report += write(pending)
+    except BaseException:
+        # Keep what was produced before the failure of the rows iterator, e.g. an API quota error
+        if batch:
+            try:
+                write(batch)
+            except Exception as error:
+                # The failure of the rows iterator is the one to report
+                general_logger.error(f"Partial batch of {len(batch)} rows not written in table {table.name}: {error}")
+        raise
+    if batch:
+        report += write(batch)
+    return report
@@ -1,15 +1,97 @@
+from contextlib import contextmanager
+from typing import Iterator
 from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 
-from server_cfg import DB_ENGINE_ECHO, SQLITE_FILE_PATH
+from db.crud.rome_search import create_search_indexes
+# Imported for create_db_and_tables to create every table, including those of the modules not loaded yet
+from schemas import rome_schemas, similarity_schemas, sync_schemas  # noqa: F401
+from server_cfg import DB_ENGINE_ECHO, SQLITE_FILE_PATH, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE, \
+    DB_MMAP_SIZE, DB_BUSY_TIMEOUT, DB_READ_POOL_SIZE
+
+
+def create_sqlite_engine(file_path: str = SQLITE_FILE_PATH, read_only: bool = False,
+                         echo: bool = DB_ENGINE_ECHO) -> Engine:
+    """
+    SQLite engine whose connections are configured by the pragmas of the ini file
+    :param file_path: path of the SQLite database file
+    :param read_only: open connections in read-only mode, with a pool of DB_READ_POOL_SIZE connections
+    :param echo: log SQL statements
+    """
+    if read_only:
+        url = f"sqlite:///file:{file_path}?mode=ro&uri=true"
+        pool_args = {'pool_size': DB_READ_POOL_SIZE, 'max_overflow': DB_READ_POOL_SIZE}
+    else:
+        url = f"sqlite:///{file_path}"
+        pool_args = {}
+    connect_args = {"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT / 1000}
+    sqlite_engine = create_engine(url, echo=echo, connect_args=connect_args, **pool_args)
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # The journal mode is persistent in the database file, readers inherit it
+            cursor.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        cursor.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        # foreign_keys is left OFF: the foreign keys of the link tables describe the joins but are not enforced,
+        # a link is written with its batch even when its target is downloaded later, e.g. by a job still running
+        cursor.close()
+
+    return sqlite_engine
+
+
+# engine is used by syncs and writers, read_engine by the API and the caches,
+# thanks to WAL readers keep going while a sync writes
+engine = create_sqlite_engine()
+read_engine = create_sqlite_engine(read_only=True)
 
 
-sqlite_url = f"sqlite:///{SQLITE_FILE_PATH}"
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=DB_ENGINE_ECHO, connect_args=connect_args)
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    create_search_indexes(engine)
+
 
-def get_session()-> Session:
+def get_session() -> Session:
+    """
+    Open write session, to be closed by the caller, preferably used as a context manager
+    """
+    return Session(engine)
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """
+    Write session committed when the block succeeds, rolled back on error and always closed
+    """
     with Session(engine) as session:
-        return session
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+
+@contextmanager
+def read_session_scope() -> Iterator[Session]:
+    """
+    Session on the read-only connection pool, closed at the end of the block
+    """
+    with Session(read_engine) as session:
+        yield session
+
+
+def yield_session() -> Iterator[Session]:
+    """
+    Read-only session closed after use, to be used as a FastAPI dependency
+    """
+    with Session(read_engine) as session:
+        yield session
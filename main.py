@@ -0,0 +1,24 @@
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI
+
+from db.data_access import create_db_and_tables
+from routers import rome_router
+from server_cfg import API_TITLE, DB_ENGINE_CREATE_ALL, SERVER_HOSTNAME, SERVER_PORT
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_ENGINE_CREATE_ALL:
+        # Tables and search indexes added since the database was synced or seeded, existing ones are left as they are
+        create_db_and_tables()
+    yield
+
+
+app = FastAPI(title=API_TITLE, lifespan=lifespan)
+app.include_router(rome_router.router)
+
+
+if __name__ == '__main__':
+    uvicorn.run(app, host=SERVER_HOSTNAME, port=SERVER_PORT)
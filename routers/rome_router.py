@@ -0,0 +1,176 @@
+from typing import Any, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from sqlmodel import Session
+
+from apis.metrics import metrics_registry
+from constants import CT_DEFAULT_LIMIT, CT_LIMIT_KEY, CT_ORDER_BY_KEY, CT_ORDER_BY_DESC, CT_START_WITH_COLUMN_KEY, \
+    CT_START_WITH_VALUE_KEY, CT_METRICS_CONTENT_TYPE, CT_MATCHING_METRIC_COSINE, CT_MATCHING_METRICS_LIST, \
+    CT_MATCHING_MAX_PROFILES, CT_SIMILARITY_TOP_N, CT_SEARCH_TABLES, CT_MOBILITY_EDGE_KINDS_LIST, CT_MOBILITY_MAX_HOPS
+from db.crud.mobility_graph import mobility_graph, MobilityGraph, MobilityStep, MOBILITY_KINDS
+from db.crud.rome_read import rome_tables, primary_key_column, read_page, read_one_cached, cache_stats
+from db.crud.rome_search import search_labels, SearchResult
+from db.crud.similarity_index import similar_elements, similarity_index_built, SIMILARITY_KINDS
+from db.crud.skill_matching import matching_engine
+from db.data_access import yield_session
+from schemas.core_schemas import Page, ScoredElement
+
+router = APIRouter(prefix="/rome")
+
+
+@router.get("/search", response_model=List[SearchResult], tags=['search'])
+def search(q: str = Query(min_length=1), limit: int = Query(default=10, ge=1, le=CT_DEFAULT_LIMIT),
+           kind: List[str] = Query(default=list(CT_SEARCH_TABLES)), session: Session = Depends(yield_session)):
+    """
+    Ranked search of métiers and appellations labels, accent and case insensitive, the last word is a prefix
+    """
+    unknown_kinds = set(kind) - set(CT_SEARCH_TABLES)
+    if unknown_kinds:
+        raise HTTPException(status_code=400, detail=f"Unknown search kinds {sorted(unknown_kinds)}")
+    return search_labels(session=session, query=q, limit=limit, kinds=kind)
+
+
+def check_matching_metric(metric: str):
+    if metric not in CT_MATCHING_METRICS_LIST:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown matching metric '{metric}', use one of {sorted(CT_MATCHING_METRICS_LIST)}")
+
+
+@router.post("/matching/metiers", response_model=List[ScoredElement], tags=['matching'])
+def match_metiers(competences: List[str], limit: int = Query(default=10, ge=1, le=CT_DEFAULT_LIMIT),
+                  metric: str = Query(default=CT_MATCHING_METRIC_COSINE), min_score: float = Query(default=0.0, ge=0)):
+    """
+    Métiers best matching a candidate profile, given as the list of its competence codes
+    """
+    check_matching_metric(metric)
+    return matching_engine().match([competences], k=limit, metric=metric, min_score=min_score)[0]
+
+
+@router.post("/matching/metiers/batch", response_model=List[List[ScoredElement]], tags=['matching'])
+def match_metiers_batch(profiles: List[List[str]], limit: int = Query(default=10, ge=1, le=CT_DEFAULT_LIMIT),
+                        metric: str = Query(default=CT_MATCHING_METRIC_COSINE),
+                        min_score: float = Query(default=0.0, ge=0)):
+    """
+    Best matching métiers of each profile, in the order of the profiles, all of them scored at once
+    """
+    check_matching_metric(metric)
+    if len(profiles) > CT_MATCHING_MAX_PROFILES:
+        raise HTTPException(status_code=400, detail=f"At most {CT_MATCHING_MAX_PROFILES} profiles per request")
+    return matching_engine().match(profiles, k=limit, metric=metric, min_score=min_score)
+
+
+@router.get("/{kind}/{code}/similaires", response_model=List[ScoredElement], tags=['similarity'])
+def get_similar_elements(kind: str, code: str, limit: int = Query(default=10, ge=1, le=CT_SIMILARITY_TOP_N),
+                         session: Session = Depends(yield_session)):
+    """
+    Métiers or appellations most similar to a given one by their competences, themes and domains,
+    read from the similarity index built by db.crud.similarity_index
+    """
+    if kind not in SIMILARITY_KINDS:
+        raise HTTPException(status_code=404, detail=f"No similarity index of {kind}, use one of "
+                                                    f"{sorted(SIMILARITY_KINDS)}")
+    elements = similar_elements(session=session, kind=kind, code=code, limit=limit)
+    if not elements:
+        if not similarity_index_built(session=session, kind=kind):
+            raise HTTPException(status_code=404, detail=f"Similarity index of {kind} not built yet, "
+                                                        f"run python -m db.crud.similarity_index")
+        if session.get(SIMILARITY_KINDS[kind].schema, code) is None:
+            raise HTTPException(status_code=404, detail=f"No {kind} with code={code}")
+    return elements
+
+
+def checked_mobility_graph(kind: str, codes: List[str], edge_kinds: List[str]) -> MobilityGraph:
+    if kind not in MOBILITY_KINDS:
+        raise HTTPException(status_code=404, detail=f"No mobility graph of {kind}, use one of {sorted(MOBILITY_KINDS)}")
+    unknown_edge_kinds = set(edge_kinds) - set(CT_MOBILITY_EDGE_KINDS_LIST)
+    if unknown_edge_kinds:
+        raise HTTPException(status_code=400, detail=f"Unknown transition kinds {sorted(unknown_edge_kinds)}")
+    graph = mobility_graph(kind)
+    for code in codes:
+        if code not in graph.index:
+            raise HTTPException(status_code=404, detail=f"No {kind} with code={code}")
+    return graph
+
+
+@router.get("/{kind}/{code}/mobilite", response_model=List[MobilityStep], tags=['mobility'])
+def get_reachable_elements(kind: str, code: str, hops: int = Query(default=2, ge=1, le=CT_MOBILITY_MAX_HOPS),
+                           edge: List[str] = Query(default=CT_MOBILITY_EDGE_KINDS_LIST),
+                           transition_ecologique: Optional[bool] = Query(default=None, alias='transitionEcologique'),
+                           transition_numerique: Optional[bool] = Query(default=None, alias='transitionNumerique'),
+                           grand_domaine: Optional[str] = Query(default=None, alias='grandDomaine')):
+    """
+    Métiers or appellations reachable from a given one within hops transitions of the edge kinds,
+    going only through elements matching the transition and grand domaine filters
+    """
+    graph = checked_mobility_graph(kind=kind, codes=[code], edge_kinds=edge)
+    allowed = graph.node_filter(transition_ecologique=transition_ecologique, transition_numerique=transition_numerique,
+                                grand_domaine=grand_domaine)
+    reached = graph.reachable(code, max_hops=hops, edge_kinds=edge, allowed=allowed)
+    return graph.steps([position for position, _ in reached], [hop for _, hop in reached])
+
+
+@router.get("/{kind}/{code}/mobilite/{target}", response_model=List[MobilityStep], tags=['mobility'])
+def get_mobility_path(kind: str, code: str, target: str, edge: List[str] = Query(default=CT_MOBILITY_EDGE_KINDS_LIST),
+                      transition_ecologique: Optional[bool] = Query(default=None, alias='transitionEcologique'),
+                      transition_numerique: Optional[bool] = Query(default=None, alias='transitionNumerique'),
+                      grand_domaine: Optional[str] = Query(default=None, alias='grandDomaine')):
+    """
+    Shortest path of transitions from a métier or appellation to another one,
+    whose intermediate elements all match the transition and grand domaine filters
+    """
+    graph = checked_mobility_graph(kind=kind, codes=[code, target], edge_kinds=edge)
+    allowed = graph.node_filter(transition_ecologique=transition_ecologique, transition_numerique=transition_numerique,
+                                grand_domaine=grand_domaine)
+    path = graph.shortest_path(code, target, edge_kinds=edge, allowed=allowed)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No path from {kind} {code} to {target}")
+    return graph.steps(path, range(len(path)))
+
+
+@router.get("/cache/stats", tags=['cache'])
+def get_cache_stats():
+    """
+    Hit and miss statistics of the reference lookups cache, per table
+    """
+    return cache_stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=['metrics'])
+def get_metrics():
+    """
+    Metrics of the process in Prometheus text format: France Travail API calls, sync jobs and read caches
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type=CT_METRICS_CONTENT_TYPE)
+
+
+def add_table_routes(table_name: str, schema: Any):
+    key_name = primary_key_column(schema).name
+
+    def list_rows(start_with_column: str = Query(default=key_name, alias=CT_START_WITH_COLUMN_KEY),
+                  start_with_value: str = Query(default=None, alias=CT_START_WITH_VALUE_KEY),
+                  limit: int = Query(default=CT_DEFAULT_LIMIT, ge=1, le=CT_DEFAULT_LIMIT, alias=CT_LIMIT_KEY),
+                  order_by: str = Query(default=key_name, alias=CT_ORDER_BY_KEY),
+                  order_by_desc: bool = Query(default=False, alias=CT_ORDER_BY_DESC),
+                  session: Session = Depends(yield_session)):
+        if start_with_column != key_name or order_by != key_name:
+            raise HTTPException(status_code=400,
+                                detail=f"Pagination of {table_name} is only available on column '{key_name}'")
+        items, next_start_with_value = read_page(session=session, schema=schema, start_with_value=start_with_value,
+                                                 limit=limit, order_by_desc=order_by_desc)
+        return Page[schema](items=items, next_start_with_value=next_start_with_value)
+
+    def get_row(code: str):
+        row = read_one_cached(schema=schema, code=code)
+        if row is None:
+            raise HTTPException(status_code=404, detail=f"No {table_name} with {key_name}={code}")
+        return row
+
+    router.add_api_route(f"/{table_name}", list_rows, methods=['GET'], response_model=Page[schema],
+                         tags=[table_name], name=f"list_{table_name}")
+    router.add_api_route(f"/{table_name}/{{code}}", get_row, methods=['GET'], response_model=schema,
+                         tags=[table_name], name=f"get_{table_name}")
+
+
+for rome_table_name, rome_schema in rome_tables().items():
+    add_table_routes(table_name=rome_table_name, schema=rome_schema)
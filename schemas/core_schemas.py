@@ -1,6 +1,9 @@
+from typing import Generic, List, Optional, TypeVar
 from pydantic import RootModel, BaseModel
 from sqlmodel import SQLModel, Field
 
+T = TypeVar('T')
+
 class OurBaseModel(BaseModel):
     pass
 
@@ -15,3 +18,20 @@ class OurRootModel(RootModel):
 
     def __getitem__(self, item):
         return self.root[item]
+
+
+class Page(OurBaseModel, Generic[T]):
+    """
+    Page of a keyset paginated list, next_start_with_value is None on the last page
+    """
+    items: List[T]
+    next_start_with_value: Optional[str] = None
+
+
+class ScoredElement(OurBaseModel):
+    """
+    Métier or appellation ranked by a similarity score between 0 and 1
+    """
+    code: str
+    libelle: str
+    score: float
@@ -9,12 +9,6 @@ class CompetenceESCO(SQLModel, table=True):
     libelle: str
 
 
-class ContexteTravail(SQLModel, table=True):
-    code: str = Field(primary_key=True)
-    libelle: str
-    categorie: str
-
-
 class CategorieSavoir(SQLModel, table=True):
     code: str = Field(primary_key=True)
     libelle: str
@@ -256,6 +250,91 @@ class MetierRead(MetierBase):
     appellationsEnvisageables: Optional[List[Appellation]] = None
 
 
+class DomaineGrandDomaineLink(SQLModel, table=True):
+    codeDomaine: str = Field(foreign_key="domainemetiers.code", primary_key=True)
+    codeGrandDomaine: str = Field(foreign_key="granddomainemetiers.code", primary_key=True, index=True)
+
+
+class MetierDomaineLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeDomaine: str = Field(foreign_key="domainemetiers.code", primary_key=True, index=True)
+
+
+class MetierAppellationLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True, index=True)
+
+
+class MetierThemeLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeTheme: str = Field(foreign_key="theme.code", primary_key=True, index=True)
+
+
+class MetierCompetenceLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeCompetence: str = Field(foreign_key="competence.code", primary_key=True, index=True)
+
+
+class MetierDivisionNafLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeDivisionNaf: str = Field(foreign_key="divisionnaf.code", primary_key=True, index=True)
+
+
+class MetierFormacodeLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeFormacode: str = Field(foreign_key="formacode.code", primary_key=True, index=True)
+
+
+class MetierContexteTravailLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeContexteTravail: str = Field(foreign_key="contextetravail.code", primary_key=True, index=True)
+
+
+class MetierProcheLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeMetierProche: str = Field(foreign_key="metier.code", primary_key=True, index=True)
+
+
+class MetierEnvisageableLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeMetierEnvisageable: str = Field(foreign_key="metier.code", primary_key=True, index=True)
+
+
+class MetierAppellationProcheLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeAppellationProche: str = Field(foreign_key="appellation.code", primary_key=True, index=True)
+
+
+class MetierAppellationEnvisageableLink(SQLModel, table=True):
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    codeAppellationEnvisageable: str = Field(foreign_key="appellation.code", primary_key=True, index=True)
+
+
+class AppellationCompetenceLink(SQLModel, table=True):
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    codeCompetence: str = Field(foreign_key="competence.code", primary_key=True, index=True)
+
+
+class AppellationProcheLink(SQLModel, table=True):
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    codeAppellationProche: str = Field(foreign_key="appellation.code", primary_key=True, index=True)
+
+
+class AppellationEnvisageableLink(SQLModel, table=True):
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    codeAppellationEnvisageable: str = Field(foreign_key="appellation.code", primary_key=True, index=True)
+
+
+class AppellationMetierProcheLink(SQLModel, table=True):
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    codeMetierProche: str = Field(foreign_key="metier.code", primary_key=True, index=True)
+
+
+class AppellationMetierEnvisageableLink(SQLModel, table=True):
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    codeMetierEnvisageable: str = Field(foreign_key="metier.code", primary_key=True, index=True)
+
+
 class Appellations(OurRootModel):
     root: List[AppellationRead]
 
@@ -0,0 +1,83 @@
+import functools
+import typing
+from typing import Any, Dict, List, Union
+
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import PydanticUndefined
+from typing_extensions import NotRequired, TypedDict
+
+# TypedDict mirror of each model, nested models being replaced by their own mirror
+payload_types: Dict[type, type] = {}
+
+
+def payload_annotation(annotation: Any) -> Any:
+    """
+    Same annotation where every pydantic model is replaced by its TypedDict mirror
+    """
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return payload_type(annotation)
+    origin = typing.get_origin(annotation)
+    if origin is None:
+        return annotation
+    arguments = tuple(payload_annotation(argument) for argument in typing.get_args(annotation))
+    if origin is Union:
+        return Union[arguments]
+    if origin is list:
+        return List[arguments[0]]
+    return origin[arguments]
+
+
+def payload_type(model: type) -> type:
+    """
+    TypedDict with the fields of model: validating into it checks the same types and required fields
+    as the model but builds plain dicts, without model instances nor a later model_dump()
+    """
+    if model not in payload_types:
+        if not model.__pydantic_complete__:
+            # Models referencing classes defined after them keep forward references until rebuilt
+            model.model_rebuild()
+        fields = {}
+        for name, field in model.model_fields.items():
+            annotation = payload_annotation(field.annotation)
+            fields[name] = annotation if field.is_required() else NotRequired[annotation]
+        payload_types[model] = TypedDict(f"{model.__name__}Payload", fields)
+    return payload_types[model]
+
+
+class RowAdapter:
+    """
+    Single validation path from a raw API payload to a table row.
+    The payload is validated once against the *Read model through a cached TypeAdapter,
+    the result is a dict holding both the table columns and the nested relations of the element.
+    """
+
+    def __init__(self, read_schema: type, table_schema: type):
+        """
+        :param read_schema: *Read model of the API payload
+        :param table_schema: table model whose columns are extracted from the payload
+        """
+        self.read_schema = read_schema
+        self.table_schema = table_schema
+        self.type_adapter = TypeAdapter(payload_type(read_schema))
+        self.column_defaults = {name: None if field.default is PydanticUndefined else field.default
+                                for name, field in table_schema.model_fields.items()}
+
+    def validate_json(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        return self.type_adapter.validate_json(data)
+
+    def validate_python(self, data: Any) -> Dict[str, Any]:
+        return self.type_adapter.validate_python(data)
+
+    def row(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Table row of a validated payload, every column present so that rows can be bulk inserted together
+        """
+        return {name: payload.get(name, default) for name, default in self.column_defaults.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def row_adapter(read_schema: type, table_schema: type) -> RowAdapter:
+    """
+    Cached adapter, building the TypeAdapter validator is much slower than using it
+    """
+    return RowAdapter(read_schema=read_schema, table_schema=table_schema)
@@ -0,0 +1,30 @@
+from sqlmodel import Field, SQLModel
+
+
+class MetierSimilaire(SQLModel, table=True):
+    """
+    Top neighbours of each métier by shared competences, themes and domains, rang 1 being the most similar
+    """
+    codeMetier: str = Field(foreign_key="metier.code", primary_key=True)
+    rang: int = Field(primary_key=True)
+    codeMetierSimilaire: str = Field(foreign_key="metier.code", index=True)
+    score: float
+
+
+class AppellationSimilaire(SQLModel, table=True):
+    """
+    Top neighbours of each appellation by shared key competences and the themes and domains of their métiers
+    """
+    codeAppellation: str = Field(foreign_key="appellation.code", primary_key=True)
+    rang: int = Field(primary_key=True)
+    codeAppellationSimilaire: str = Field(foreign_key="appellation.code", index=True)
+    score: float
+
+
+class SimilaritySignature(SQLModel, table=True):
+    """
+    Hash of the features of each indexed element, used by incremental refreshes to find the changed ones
+    """
+    kind: str = Field(primary_key=True)
+    code: str = Field(primary_key=True)
+    signature: str
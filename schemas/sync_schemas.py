@@ -0,0 +1,33 @@
+from datetime import datetime
+from typing import Optional
+from sqlmodel import Field, SQLModel
+
+
+class SyncJobState(SQLModel, table=True):
+    """
+    One row per download job, started_at is the start of the last run of the job
+    """
+    job: str = Field(primary_key=True)
+    status: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class SyncCodeState(SQLModel, table=True):
+    """
+    One row per job and code whose detail has been fetched and written in database,
+    list_hash is the hash of the list entry of the code, used by delta syncs to detect changes
+    """
+    job: str = Field(primary_key=True)
+    code: str = Field(primary_key=True)
+    fetched_at: datetime
+    list_hash: Optional[str] = None
+
+
+class SyncGeneration(SQLModel, table=True):
+    """
+    Single row counting the data generations written by syncs, used to invalidate read caches
+    """
+    id: int = Field(default=1, primary_key=True)
+    generation: int = 0
+    updated_at: Optional[datetime] = None
@@ -17,7 +17,9 @@ from constants import *
 config = configparser.ConfigParser()
 PROJECT_PATH_ROOT = Path(__file__).parent
 CONFIG_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, CT_CONFIG_FILE_RELATIVE_PATH))
-SQLITE_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, CT_SQLITE_FILE_RELATIVE_PATH))
+SNAPSHOT_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, CT_SNAPSHOT_FILE_RELATIVE_PATH))
+HTTP_CACHE_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, CT_HTTP_CACHE_FILE_RELATIVE_PATH))
+TOKEN_CACHE_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, CT_TOKEN_CACHE_FILE_RELATIVE_PATH))
 
 if os.path.isfile(CONFIG_FILE_PATH):
     config_file_path = CT_CONFIG_FILE_RELATIVE_PATH
@@ -255,6 +257,190 @@ API_DB_DRIVER = getServerParam(param_name=CT_ENV_DB_DRIVER,
                                default_value="ODBC Driver 17 for SQL Server",
                                auto_lower=False)
 
+# DB_FILE_PATH IS THE SQLITE DATABASE FILE, RELATIVE PATHS START FROM THE PROJECT ROOT
+DB_FILE_PATH = getServerParam(param_name=CT_ENV_DB_FILE_PATH,
+                              param_ini_file_section='DB',
+                              is_mandatory=False,
+                              default_value=CT_SQLITE_FILE_RELATIVE_PATH,
+                              auto_lower=False)
+SQLITE_FILE_PATH = os.path.normpath(os.path.join(PROJECT_PATH_ROOT, DB_FILE_PATH))
+
+# DB_BATCH_SIZE IS THE NUMBER OF ROWS WRITTEN PER TRANSACTION DURING A SYNC
+DB_BATCH_SIZE = getServerParam(param_name=CT_ENV_DB_BATCH_SIZE,
+                               param_ini_file_section='DB',
+                               is_mandatory=False,
+                               default_value='500')
+DB_BATCH_SIZE = int(DB_BATCH_SIZE)
+
+# SQLITE PRAGMAS: WAL LETS READERS RUN WHILE A SYNC WRITES, NORMAL SYNCHRONOUS IS SAFE WITH WAL
+DB_JOURNAL_MODE = getServerParam(param_name=CT_ENV_DB_JOURNAL_MODE,
+                                 param_ini_file_section='DB',
+                                 is_mandatory=False,
+                                 possible_values=CT_DB_JOURNAL_MODES_LIST,
+                                 default_value='wal')
+
+DB_SYNCHRONOUS = getServerParam(param_name=CT_ENV_DB_SYNCHRONOUS,
+                                param_ini_file_section='DB',
+                                is_mandatory=False,
+                                possible_values=CT_DB_SYNCHRONOUS_LIST,
+                                default_value='normal')
+
+# DB_CACHE_SIZE IS THE SQLITE PAGE CACHE PER CONNECTION, NEGATIVE VALUES ARE IN KIB
+DB_CACHE_SIZE = getServerParam(param_name=CT_ENV_DB_CACHE_SIZE,
+                               param_ini_file_section='DB',
+                               is_mandatory=False,
+                               default_value='-16000')
+DB_CACHE_SIZE = int(DB_CACHE_SIZE)
+
+# DB_MMAP_SIZE IS THE NUMBER OF BYTES OF THE DATABASE FILE READ THROUGH MEMORY MAPPING
+DB_MMAP_SIZE = getServerParam(param_name=CT_ENV_DB_MMAP_SIZE,
+                              param_ini_file_section='DB',
+                              is_mandatory=False,
+                              default_value='268435456')
+DB_MMAP_SIZE = int(DB_MMAP_SIZE)
+
+# DB_BUSY_TIMEOUT IS THE WAIT IN MILLISECONDS FOR A LOCKED DATABASE BEFORE FAILING
+DB_BUSY_TIMEOUT = getServerParam(param_name=CT_ENV_DB_BUSY_TIMEOUT,
+                                 param_ini_file_section='DB',
+                                 is_mandatory=False,
+                                 default_value='5000')
+DB_BUSY_TIMEOUT = int(DB_BUSY_TIMEOUT)
+
+# DB_READ_POOL_SIZE IS THE NUMBER OF READ-ONLY CONNECTIONS KEPT OPEN FOR THE API
+DB_READ_POOL_SIZE = getServerParam(param_name=CT_ENV_DB_READ_POOL_SIZE,
+                                   param_ini_file_section='DB',
+                                   is_mandatory=False,
+                                   default_value='8')
+DB_READ_POOL_SIZE = int(DB_READ_POOL_SIZE)
+
+# CACHE_MAXSIZE IS THE MAXIMUM NUMBER OF CACHED ROWS PER TABLE FOR REFERENCE LOOKUPS
+CACHE_MAXSIZE = getServerParam(param_name=CT_ENV_CACHE_MAXSIZE,
+                               param_ini_file_section='CACHE',
+                               is_mandatory=False,
+                               default_value='4096')
+CACHE_MAXSIZE = int(CACHE_MAXSIZE)
+
+# CACHE_TTL IS THE LIFETIME IN SECONDS OF A CACHED ROW, 0 DISABLES EXPIRATION
+CACHE_TTL = getServerParam(param_name=CT_ENV_CACHE_TTL,
+                           param_ini_file_section='CACHE',
+                           is_mandatory=False,
+                           default_value='300')
+CACHE_TTL = float(CACHE_TTL)
+
+# CACHE_GENERATION_CHECK_INTERVAL IS THE DELAY IN SECONDS BETWEEN TWO CHECKS OF THE DATA GENERATION WRITTEN BY SYNCS
+CACHE_GENERATION_CHECK_INTERVAL = getServerParam(param_name=CT_ENV_CACHE_GENERATION_CHECK_INTERVAL,
+                                                 param_ini_file_section='CACHE',
+                                                 is_mandatory=False,
+                                                 default_value='5')
+CACHE_GENERATION_CHECK_INTERVAL = float(CACHE_GENERATION_CHECK_INTERVAL)
+
+# FT_POOL_SIZE IS THE NUMBER OF KEEP-ALIVE CONNECTIONS KEPT OPEN TO THE FRANCE TRAVAIL API
+FT_POOL_SIZE = getServerParam(param_name=CT_ENV_FT_POOL_SIZE,
+                              param_ini_file_section='FT_API',
+                              is_mandatory=False,
+                              default_value='10')
+FT_POOL_SIZE = int(FT_POOL_SIZE)
+
+# FT_TRANSPORT_RETRIES IS THE NUMBER OF RETRIES ON CONNECTION RESETS AND READ ERRORS
+FT_TRANSPORT_RETRIES = getServerParam(param_name=CT_ENV_FT_TRANSPORT_RETRIES,
+                                      param_ini_file_section='FT_API',
+                                      is_mandatory=False,
+                                      default_value='3')
+FT_TRANSPORT_RETRIES = int(FT_TRANSPORT_RETRIES)
+
+# FT_REQUEST_TIMEOUT IS THE CONNECT AND READ TIMEOUT IN SECONDS OF EACH FRANCE TRAVAIL API REQUEST
+FT_REQUEST_TIMEOUT = getServerParam(param_name=CT_ENV_FT_REQUEST_TIMEOUT,
+                                    param_ini_file_section='FT_API',
+                                    is_mandatory=False,
+                                    default_value='30')
+FT_REQUEST_TIMEOUT = float(FT_REQUEST_TIMEOUT)
+
+# FT_MAX_IN_FLIGHT IS THE MAXIMUM NUMBER OF CONCURRENT DETAIL REQUESTS DURING A SYNC, 1 MEANS SERIAL FETCHING
+FT_MAX_IN_FLIGHT = getServerParam(param_name=CT_ENV_FT_MAX_IN_FLIGHT,
+                                  param_ini_file_section='FT_API',
+                                  is_mandatory=False,
+                                  default_value='4')
+FT_MAX_IN_FLIGHT = int(FT_MAX_IN_FLIGHT)
+
+# FT_MAX_PARALLEL_JOBS IS THE NUMBER OF INDEPENDENT SYNC JOBS RUNNING AT ONCE, SHARING THE SAME RATE LIMITER
+FT_MAX_PARALLEL_JOBS = getServerParam(param_name=CT_ENV_FT_MAX_PARALLEL_JOBS,
+                                      param_ini_file_section='FT_API',
+                                      is_mandatory=False,
+                                      default_value='2')
+FT_MAX_PARALLEL_JOBS = int(FT_MAX_PARALLEL_JOBS)
+
+# FT_RATE_LIMIT IS THE MAXIMUM NUMBER OF REQUESTS PER SECOND SENT TO THE FRANCE TRAVAIL API (QUOTA CEILING)
+FT_RATE_LIMIT = getServerParam(param_name=CT_ENV_FT_RATE_LIMIT,
+                               param_ini_file_section='FT_API',
+                               is_mandatory=False,
+                               default_value='2')
+FT_RATE_LIMIT = float(FT_RATE_LIMIT)
+
+# FT_RATE_LIMIT_BURST IS THE NUMBER OF REQUESTS THAT CAN BE SENT AT ONCE AFTER AN IDLE PERIOD
+FT_RATE_LIMIT_BURST = getServerParam(param_name=CT_ENV_FT_RATE_LIMIT_BURST,
+                                     param_ini_file_section='FT_API',
+                                     is_mandatory=False,
+                                     default_value='2')
+FT_RATE_LIMIT_BURST = int(FT_RATE_LIMIT_BURST)
+
+# FT_RATE_LIMIT_MIN IS THE LOWEST REQUESTS PER SECOND RATE REACHED AFTER SUCCESSIVE 429 RESPONSES
+FT_RATE_LIMIT_MIN = getServerParam(param_name=CT_ENV_FT_RATE_LIMIT_MIN,
+                                   param_ini_file_section='FT_API',
+                                   is_mandatory=False,
+                                   default_value='0.2')
+FT_RATE_LIMIT_MIN = float(FT_RATE_LIMIT_MIN)
+
+# FT_RATE_LIMIT_RETRIES IS THE NUMBER OF RETRIES OF A REQUEST ANSWERED BY 429 BEFORE GIVING UP
+FT_RATE_LIMIT_RETRIES = getServerParam(param_name=CT_ENV_FT_RATE_LIMIT_RETRIES,
+                                       param_ini_file_section='FT_API',
+                                       is_mandatory=False,
+                                       default_value='5')
+FT_RATE_LIMIT_RETRIES = int(FT_RATE_LIMIT_RETRIES)
+
+# FT_HTTP_CACHE_MODE: OFF, RECORD (ALWAYS FETCH AND STORE), REPLAY (DISK ONLY, NO NETWORK)
+# OR TTL (REUSE FRESH RESPONSES)
+FT_HTTP_CACHE_MODE = getServerParam(param_name=CT_ENV_FT_HTTP_CACHE_MODE,
+                                    param_ini_file_section='FT_API',
+                                    is_mandatory=False,
+                                    possible_values=CT_HTTP_CACHE_MODES_LIST,
+                                    default_value=CT_HTTP_CACHE_MODE_OFF)
+
+# FT_HTTP_CACHE_TTL IS THE LIFETIME IN SECONDS OF A CACHED RESPONSE IN TTL MODE, 0 FOR NO EXPIRATION
+FT_HTTP_CACHE_TTL = getServerParam(param_name=CT_ENV_FT_HTTP_CACHE_TTL,
+                                   param_ini_file_section='FT_API',
+                                   is_mandatory=False,
+                                   default_value='86400')
+FT_HTTP_CACHE_TTL = float(FT_HTTP_CACHE_TTL)
+
+# FT_TOKEN_CACHE SHARES THE ACCESS TOKEN BETWEEN PROCESSES THROUGH A LOCKED FILE,
+# SO THAT N WORKERS DO NOT AUTHENTICATE N TIMES
+FT_TOKEN_CACHE = getServerParam(param_name=CT_ENV_FT_TOKEN_CACHE,
+                                param_ini_file_section='FT_API',
+                                is_mandatory=False,
+                                default_value=True,
+                                is_bool=True)
+
+# FT_TOKEN_REFRESH_MARGIN IS THE NUMBER OF SECONDS BEFORE EXPIRY FROM WHICH THE ACCESS TOKEN IS REFRESHED
+FT_TOKEN_REFRESH_MARGIN = getServerParam(param_name=CT_ENV_FT_TOKEN_REFRESH_MARGIN,
+                                         param_ini_file_section='FT_API',
+                                         is_mandatory=False,
+                                         default_value='60')
+FT_TOKEN_REFRESH_MARGIN = float(FT_TOKEN_REFRESH_MARGIN)
+
+# FT_API_BASE_URL AND FT_OAUTH_URL LOCATE THE ROME METIERS API AND ITS TOKEN ENDPOINT
+FT_API_BASE_URL = getServerParam(param_name=CT_ENV_FT_API_BASE_URL,
+                                 param_ini_file_section='FT_API',
+                                 is_mandatory=False,
+                                 default_value=CT_FT_API_BASE_URL,
+                                 auto_lower=False)
+FT_API_BASE_URL = FT_API_BASE_URL.rstrip('/')
+
+FT_OAUTH_URL = getServerParam(param_name=CT_ENV_FT_OAUTH_URL,
+                              param_ini_file_section='FT_API',
+                              is_mandatory=False,
+                              default_value=CT_FT_OAUTH_URL,
+                              auto_lower=False)
+
 gunicorn_logger.setLevel(API_LOGGING_LEVEL)
 general_logger.setLevel(API_LOGGING_LEVEL)
 fastapi_logger.setLevel(API_LOGGING_LEVEL)